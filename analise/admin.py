@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import CustomUser, Jogador, Campeonato, Time, Confronto, Escalacao, Substituicao, Lance, Tipo_Lance
+from .models import CustomUser, Jogador, Campeonato, Time, Confronto, Escalacao, Substituicao, Lance, Tipo_Lance, EstatisticaJogadorConfronto
 
 # Register your models here.
 
@@ -52,4 +52,10 @@ admin.site.register(Lance, LanceAdmin)
 
 class TipoLanceAdmin(admin.ModelAdmin):
     list_display = ['id', 'tipo_lance']
-admin.site.register(Tipo_Lance, TipoLanceAdmin)
\ No newline at end of file
+admin.site.register(Tipo_Lance, TipoLanceAdmin)
+
+
+class EstatisticaJogadorConfrontoAdmin(admin.ModelAdmin):
+    list_display = ['jogador', 'confronto', 'tempo', 'titular', 'substituto', 'minutos', 'gols', 'assistencias']
+    list_filter = ['tempo', 'confronto__campeonato']
+admin.site.register(EstatisticaJogadorConfronto, EstatisticaJogadorConfrontoAdmin)
\ No newline at end of file
@@ -1,5 +1,9 @@
+import math
 import django_filters
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
 from analise import models
+from analise.estatisticas import AGRUPAMENTOS
 
 class LanceFilter(django_filters.FilterSet):
     campeonato = django_filters.NumberFilter(field_name='confronto__campeonato__id')
@@ -8,8 +12,101 @@ class LanceFilter(django_filters.FilterSet):
     """ tipo_lance = django_filters.NumberFilter(field_name='tipo_lance__id')
     jogador = django_filters.NumberFilter(field_name='jogador__id') """
     jogo = django_filters.NumberFilter(field_name='confronto__id')
+    tempo = django_filters.ChoiceFilter(choices=[('1', '1'), ('2', '2')], method='filtrar_tempo')
 
     class Meta:
         model = models.Lance
         fields = ['campeonato', 'minuto_inicio', 'minuto_fim']
         """ fields = ['campeonato', 'tipo_lance', 'jogador', 'jogo', 'minuto_inicio', 'minuto_fim'] """
+
+    def filtrar_tempo(self, queryset, name, value):
+        # lances sem tempo definido (None ou 0) contam como primeiro tempo
+        if value == '2':
+            return queryset.filter(tempo=2)
+        return queryset.filter(Q(tempo__in=[0, 1]) | Q(tempo__isnull=True))
+
+
+# parâmetros do LanceFilter, que entram na chave de cache de todo endpoint filtrado por ele
+PARAMETROS_LANCE = ('campeonato', 'jogo', 'minuto_inicio', 'minuto_fim', 'tempo')
+
+
+def lista_de_ids(query_params, nome):
+    """
+    Lê um parâmetro com vários ids, aceitando tanto ?nome=1,2 quanto ?nome=1&nome=2.
+    Retorna os ids sem repetição, na ordem informada.
+    """
+    ids = []
+    for valor in query_params.getlist(nome):
+        for parte in valor.split(','):
+            parte = parte.strip()
+            if not parte:
+                continue
+            if not parte.isdigit():
+                raise ValidationError({"detail": f"O parâmetro {nome} deve ser uma lista de ids."})
+            if int(parte) not in ids:
+                ids.append(int(parte))
+    return ids
+
+
+def campos_pedidos(query_params, campos):
+    """
+    Filtra os campos (chave na resposta, métrica) de um endpoint de estatísticas pelo parâmetro ?fields=.
+    Sem o parâmetro retorna todos os campos; chaves desconhecidas são erro.
+    """
+    pedidos = [parte.strip() for valor in query_params.getlist('fields') for parte in valor.split(',') if parte.strip()]
+    if not pedidos:
+        return campos
+
+    chaves = {chave for chave, _ in campos}
+    # nome e posição sempre vêm na resposta dos jogadores
+    desconhecidos = [chave for chave in pedidos if chave not in chaves and chave not in ('nome', 'posicao')]
+    if desconhecidos:
+        raise ValidationError({"detail": f"Campos desconhecidos: {', '.join(desconhecidos)}."})
+
+    return [(chave, metrica) for chave, metrica in campos if chave in pedidos]
+
+
+def janela_de_minutos(query_params):
+    """
+    Lê a janela de minutos (minuto_inicio, minuto_fim e tempo) com as mesmas regras do LanceFilter.
+    Retorna None quando nenhum dos três foi informado.
+    """
+    filtro = LanceFilter(query_params, queryset=models.Lance.objects.none())
+    filtro.is_valid()
+    dados = filtro.form.cleaned_data
+
+    minuto_inicio, minuto_fim, tempo = dados.get('minuto_inicio'), dados.get('minuto_fim'), dados.get('tempo')
+    if minuto_inicio is None and minuto_fim is None and not tempo:
+        return None
+
+    # os minutos dos lances são inteiros: 10.5 <= minuto vale a partir do 11
+    return {
+        'minuto_inicio': None if minuto_inicio is None else math.ceil(minuto_inicio),
+        'minuto_fim': None if minuto_fim is None else math.floor(minuto_fim),
+        'tempo': int(tempo) if tempo else None,
+    }
+
+
+def inteiro_do_parametro(query_params, nome, padrao, minimo=0, maximo=None):
+    """
+    Lê um parâmetro inteiro opcional, dentro dos limites informados.
+    """
+    valor = query_params.get(nome)
+    if not valor:
+        return padrao
+    if not valor.isdigit() or int(valor) < minimo or (maximo is not None and int(valor) > maximo):
+        limites = f"entre {minimo} e {maximo}" if maximo is not None else f"maior ou igual a {minimo}"
+        raise ValidationError({"detail": f"O parâmetro {nome} deve ser um inteiro {limites}."})
+    return int(valor)
+
+
+def agrupamento_pedido(query_params):
+    """
+    Lê o parâmetro ?group_by= dos endpoints de estatísticas. Retorna None quando não foi informado.
+    """
+    agrupar_por = query_params.get('group_by')
+    if not agrupar_por:
+        return None
+    if agrupar_por not in AGRUPAMENTOS:
+        raise ValidationError({"detail": f"O parâmetro group_by deve ser um de: {', '.join(AGRUPAMENTOS)}."})
+    return agrupar_por
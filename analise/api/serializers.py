@@ -1,3 +1,5 @@
+from django.db.models import FloatField
+from django.db.models.functions import Cast
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from analise import models
@@ -135,10 +137,65 @@ class SubstituicaoCreateSerializer(serializers.ModelSerializer):
 
 
 class LanceSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.Lance
+        # as zonas são índices internos das consultas de coordenadas, calculados a partir das coordenadas
+        exclude = ['zona', 'zona_final']
+
+
+# chaves estrangeiras do lance e o model de cada uma
+CHAVES_LANCE = {'confronto': models.Confronto, 'jogador': models.Jogador, 'tipo_lance': models.Tipo_Lance}
+
+
+class IdCarregadoField(serializers.IntegerField):
+    # chave estrangeira conferida contra os ids já carregados para o lote (context['ids']), sem consulta por lance
+    default_error_messages = {
+        'does_not_exist': serializers.PrimaryKeyRelatedField.default_error_messages['does_not_exist'],
+    }
+
+    def to_internal_value(self, data):
+        valor = super().to_internal_value(data)
+        if valor not in self.context['ids'][self.field_name]:
+            self.fail('does_not_exist', pk_value=valor)
+        return valor
+
+
+class LanceLoteSerializer(serializers.ModelSerializer):
+    confronto = IdCarregadoField()
+    jogador = IdCarregadoField()
+    tipo_lance = IdCarregadoField()
+
     class Meta:
         model = models.Lance
         fields = '__all__'
 
+    def para_lance(self):
+        dados = dict(self.validated_data)
+        for campo in CHAVES_LANCE:
+            dados[f'{campo}_id'] = dados.pop(campo)
+        return models.Lance(**dados)
+
+
+def ids_dos_lances(itens):
+    """
+    Ids existentes de cada chave estrangeira citada nos lances do lote, uma consulta por model.
+    Retorna {'confronto': set, 'jogador': set, 'tipo_lance': set}.
+    """
+    citados = {campo: set() for campo in CHAVES_LANCE}
+    for item in itens:
+        if not isinstance(item, dict):
+            continue
+        for campo in CHAVES_LANCE:
+            try:
+                citados[campo].add(int(item.get(campo)))
+            except (TypeError, ValueError):
+                # valores inválidos são apontados na validação do item
+                pass
+    return {
+        campo: set(model.objects.filter(id__in=citados[campo]).values_list('id', flat=True)) if citados[campo] else set()
+        for campo, model in CHAVES_LANCE.items()
+    }
+
 
 class JogadorFezLanceSerializer(serializers.ModelSerializer):
     class Meta:
@@ -161,6 +218,28 @@ class LanceSerializer2(serializers.ModelSerializer):
         fields = ['id', 'minuto', 'tipo_lance', 'link_video', 'confronto', 'jogador', 'tempo']
         
 
+def serializar_lances_confronto(lances):
+    """
+    Mesmo JSON do LanceSerializer2, montado a partir de uma única consulta com values_list
+    (jogador e tipo de lance vêm no mesmo join, sem uma consulta por linha).
+    """
+    linhas = lances.values_list(
+        'id', 'minuto', 'tipo_lance__tipo_lance', 'link_video', 'confronto_id', 'jogador_id', 'jogador__nome', 'tempo'
+    )
+    return [
+        {
+            'id': lance_id,
+            'minuto': minuto,
+            'tipo_lance': {'tipo_lance': tipo_lance},
+            'link_video': link_video,
+            'confronto': confronto_id,
+            'jogador': {'id': jogador_id, 'nome': jogador_nome},
+            'tempo': tempo,
+        }
+        for lance_id, minuto, tipo_lance, link_video, confronto_id, jogador_id, jogador_nome, tempo in linhas
+    ]
+
+
 class LanceCoordenadaSerializer(serializers.ModelSerializer):
     jogador = JogadorFezLanceSerializer()  # Usando o novo serializer para a representação do jogador
     tipo_lance = NomeDoLanceSerializer()
@@ -170,6 +249,38 @@ class LanceCoordenadaSerializer(serializers.ModelSerializer):
         fields = ['id', 'tipo_lance', 'jogador', 'minuto', 'coordenadaX', 'coordenadaY', 'coordenadaXFinal', 'coordenadaYFinal']
         
 
+CAMPOS_COORDENADAS = ['coordenadaX', 'coordenadaY', 'coordenadaXFinal', 'coordenadaYFinal']
+
+
+def _coordenada(valor):
+    # mesmo texto do DecimalField(decimal_places=6) do LanceCoordenadaSerializer
+    return None if valor is None else f'{valor:.6f}'
+
+
+def serializar_lances_coordenada(lances):
+    """
+    Mesmo JSON do LanceCoordenadaSerializer, montado a partir de uma única consulta com values_list:
+    sem instanciar Lance, Jogador e Tipo_Lance por linha e com as coordenadas lidas como float (sem Decimal).
+    """
+    linhas = lances.values_list(
+        'id', 'tipo_lance__tipo_lance', 'jogador_id', 'jogador__nome', 'minuto',
+        *(Cast(campo, FloatField()) for campo in CAMPOS_COORDENADAS),
+    )
+    return [
+        {
+            'id': lance_id,
+            'tipo_lance': {'tipo_lance': tipo_lance},
+            'jogador': {'id': jogador_id, 'nome': jogador_nome},
+            'minuto': minuto,
+            'coordenadaX': _coordenada(x),
+            'coordenadaY': _coordenada(y),
+            'coordenadaXFinal': _coordenada(x_final),
+            'coordenadaYFinal': _coordenada(y_final),
+        }
+        for lance_id, tipo_lance, jogador_id, jogador_nome, minuto, x, y, x_final, y_final in linhas
+    ]
+
+
 class ListaLancesSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -4,12 +4,25 @@ from analise import models
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.views import APIView
-from itertools import chain
+from collections import defaultdict
 from rest_framework.decorators import action, api_view
 from django.shortcuts import get_object_or_404
 from rest_framework import mixins
-from django.db.models import Count, Case, When, IntegerField, Q, Value, F
-from .filters import LanceFilter
+from django.db import transaction
+from django.db.models import Count
+from .filters import LanceFilter, PARAMETROS_LANCE, lista_de_ids, campos_pedidos, janela_de_minutos, agrupamento_pedido, inteiro_do_parametro
+from analise.estatisticas import ler_estatisticas_jogadores, contar_lances_por_tipo, contar_lances_por_confronto_e_tipo, contar_lances_por_grupo_e_tipo, montar_estatisticas_jogadores, calcular_metricas_jogadores, agrupador, ranquear, percentis, calcular_forma, perfis_por_90, mais_proximos
+from analise.tipos_lance import ContagemPorTipo, registro
+from analise.metricas import CAMPOS_JOGADOR, CAMPOS_TIME, CAMPOS_FORMA, Plano, matriz_de_contagens
+import numpy as np
+from analise import cache_estatisticas
+from analise.cache_estatisticas import resposta_em_cache
+from analise.em_campo import ADVERSARIO_ID, jogadores_em_campo
+from analise.linha_do_tempo import linha_do_tempo
+from analise.elenco import elenco_do_confronto
+from analise.signals import confronto_alterado
+from analise.campo import COMPRIMENTO, LARGURA, ZONAS, ZONAS_ATAQUE, ZONAS_DEFESA, coordenadas, histograma, metricas_de_progressao
+from analise.campo import zonas as zonas_do_campo
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import permission_classes
 from analise.permissions import IsAdminOrStaff
@@ -113,40 +126,16 @@ class EscalacaoViewSet(viewsets.ModelViewSet):
 class EscalacaoConfrontoView(APIView):
     permission_classes = (IsAuthenticated,)
     
-    # retorna os jogadores que estão em campo nesse minuto (titulares - subs_sairam + subs_entraram)
-    # futuramente add expulsos
+    # retorna os jogadores que estão em campo nesse minuto (titulares - subs_sairam + subs_entraram - expulsos) e o Adversário
     def get(self, request, confronto_id, *args, **kwargs):
 
-        escalacao = models.Escalacao.objects.filter(confronto_id=confronto_id).first()
+        jogadores = jogadores_em_campo(confronto_id, incluir=[ADVERSARIO_ID])
 
-        if not escalacao:
+        if jogadores is None:
             # Retorna array vazio se não houver escalacao
             return Response([], status=status.HTTP_200_OK)
-        
-        substituicoes = models.Substituicao.objects.filter(confronto_id=confronto_id)
-        jogadores_entrada_ids = substituicoes.values_list('jogador_entrada__id', flat=True)
-        jogadores_saida_ids = substituicoes.values_list('jogador_saida__id', flat=True)
-
-        jogadores_escalacao = escalacao.jogadores.all()
-        jogadores_entrada = models.Jogador.objects.filter(id__in=jogadores_entrada_ids)
-
-        # Junte os jogadores iniciais com os que entraram
-        nova_lista_jogadores = list(chain(jogadores_escalacao, jogadores_entrada))
-
-        # Exclua os jogadores que saíram da lista
-        nova_lista_jogadores = [jogador for jogador in nova_lista_jogadores if jogador.id not in jogadores_saida_ids]
-        
-        # Buscar o jogador "Adversário" pelo ID e adicioná-lo à lista
-        jogador_adversario = models.Jogador.objects.filter(id=16).first()
-        if jogador_adversario:
-            nova_lista_jogadores.append(jogador_adversario)
 
-        # Ordenação dos jogadores por posição
-        ordem_desejada = ['Goleiro', 'Lateral', 'Zagueiro', 'Volante', 'Meia', 'Ponta', 'Atacante']
-        casos = [When(posicao=posicao, then=pos) for pos, posicao in enumerate(ordem_desejada)]
-        jogadores_ordenados = sorted(nova_lista_jogadores, key=lambda jogador: ordem_desejada.index(jogador.posicao) if jogador.posicao in ordem_desejada else len(ordem_desejada))
-
-        serializer = serializers.JogadorSerializers(jogadores_ordenados, many=True)
+        serializer = serializers.JogadorSerializers(jogadores, many=True)
 
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -154,37 +143,37 @@ class EscalacaoConfrontoView(APIView):
 class EscalacaoConfrontoSemAdversarioView(APIView):
     permission_classes = (IsAuthenticated,)
     
-    # retorna os jogadores que estão em campo nesse minuto (titulares - subs_sairam + subs_entraram)
-    # futuramente add expulsos
+    # retorna os jogadores que estão em campo nesse minuto (titulares - subs_sairam + subs_entraram - expulsos)
     def get(self, request, confronto_id, *args, **kwargs):
 
-        escalacao = models.Escalacao.objects.filter(confronto_id=confronto_id).first()
+        jogadores = jogadores_em_campo(confronto_id)
 
-        if not escalacao:
+        if jogadores is None:
             # Retorna array vazio se não houver escalacao
             return Response([], status=status.HTTP_200_OK)
-        
-        substituicoes = models.Substituicao.objects.filter(confronto_id=confronto_id)
-        jogadores_entrada_ids = substituicoes.values_list('jogador_entrada__id', flat=True)
-        jogadores_saida_ids = substituicoes.values_list('jogador_saida__id', flat=True)
 
-        jogadores_escalacao = escalacao.jogadores.all()
-        jogadores_entrada = models.Jogador.objects.filter(id__in=jogadores_entrada_ids)
+        serializer = serializers.JogadorSerializers(jogadores, many=True)
 
-        # Junte os jogadores iniciais com os que entraram
-        nova_lista_jogadores = list(chain(jogadores_escalacao, jogadores_entrada))
+        return Response(serializer.data, status=status.HTTP_200_OK)
 
-        # Exclua os jogadores que saíram da lista
-        nova_lista_jogadores = [jogador for jogador in nova_lista_jogadores if jogador.id not in jogadores_saida_ids]
 
-        # Ordenação dos jogadores por posição
-        ordem_desejada = ['Goleiro', 'Lateral', 'Zagueiro', 'Volante', 'Meia', 'Ponta', 'Atacante']
-        casos = [When(posicao=posicao, then=pos) for pos, posicao in enumerate(ordem_desejada)]
-        jogadores_ordenados = sorted(nova_lista_jogadores, key=lambda jogador: ordem_desejada.index(jogador.posicao) if jogador.posicao in ordem_desejada else len(ordem_desejada))
+class LinhaDoTempoConfrontoView(APIView):
+    permission_classes = (IsAuthenticated,)
 
-        serializer = serializers.JogadorSerializers(jogadores_ordenados, many=True)
+    # placar, cartões e jogadores em campo depois de cada evento do confronto, para o replay da partida;
+    # com ?tempo=&minuto= retorna só o momento da partida nesse minuto
+    def get(self, request, confronto_id, *args, **kwargs):
+        linha = linha_do_tempo(confronto_id)
+        if linha is None:
+            return Response({"error": "Confronto não encontrado."}, status=status.HTTP_404_NOT_FOUND)
 
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        tempo = inteiro_do_parametro(request.query_params, 'tempo', None, minimo=1, maximo=2)
+        minuto = inteiro_do_parametro(request.query_params, 'minuto', None)
+        if tempo is None and minuto is None:
+            return Response(linha.como_dict())
+        if tempo is None or minuto is None:
+            return Response({"detail": "Informe os parâmetros tempo e minuto juntos."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(linha.no_minuto(tempo, minuto))
 
 
 class SubstituicaoViewSet(viewsets.ModelViewSet):
@@ -225,34 +214,17 @@ class JogadoresForaEscalacaoView(APIView):
     permission_classes = (IsAuthenticated,)
     
     def get(self, request, confronto_id, *args, **kwargs):
-        escalacao = models.Escalacao.objects.filter(confronto_id=confronto_id).first()
+        elenco = elenco_do_confronto(confronto_id)
 
-        if not escalacao:
+        if not elenco.tem_escalacao:
             # Retorna array vazio se não houver escalacao
             return Response([], status=status.HTTP_200_OK)
 
-        substituicoes = models.Substituicao.objects.filter(confronto_id=confronto_id)
-
-        # Obtém todos os jogadores do time
-        todos_jogadores = models.Jogador.objects.all()
-
-        # Obtém os IDs dos jogadores na escalacao e na lista de jogador_entrada das substituicoes
-        jogadores_na_escalacao_ids = escalacao.jogadores.values_list('id', flat=True)
-        jogadores_entrada_ids = substituicoes.values_list('jogador_entrada__id', flat=True)
-        adversario = [16]
-
-        # Combina os dois conjuntos de IDs
-        ids_para_excluir = list(jogadores_na_escalacao_ids) + list(jogadores_entrada_ids) + adversario
-
-        # Filtra os jogadores que não estão na escalacao ou na lista de jogador_entrada das substituicoes
-        jogadores_fora_escalacao = todos_jogadores.exclude(id__in=ids_para_excluir)
-
-        # Serializa os jogadores
-        serializer = serializers.JogadorSerializers(jogadores_fora_escalacao, many=True)
+        # jogadores que não estão na escalacao nem entraram nas substituicoes (sem o Adversário)
+        serializer = serializers.JogadorSerializers(elenco.reservas(), many=True)
 
         return Response(serializer.data, status=status.HTTP_200_OK)
 
-        
 
 class SubstituicaoConfrontoViewSet(APIView):
     permission_classes = (IsAuthenticated,)
@@ -280,15 +252,16 @@ class JogadoresNaoTitularViewSet(viewsets.ViewSet):
         if confronto_id is None:
             return Response({"detail": "O parâmetro confronto_id é obrigatório."}, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            titulares = models.Escalacao.objects.filter(confronto_id=confronto_id).values_list('jogadores', flat=True)
-            jogadores_nao_titulares = models.Jogador.objects.exclude(id__in=titulares)
-            serializer = self.serializer_class(jogadores_nao_titulares, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        except models.Escalacao.DoesNotExist:
-            return Response({"detail": "Confronto não encontrado."}, status=status.HTTP_404_NOT_FOUND)
+        elenco = elenco_do_confronto(inteiro_do_parametro(self.request.query_params, 'confronto_id', None, minimo=1))
+        serializer = self.serializer_class(elenco.nao_titulares(), many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
         
 
+# limite de lances por requisição do envio em lote e tamanho de cada INSERT
+MAXIMO_LANCES_LOTE = 1000
+TAMANHO_LOTE_LANCES = 200
+
+
 class LanceViewSet(viewsets.ModelViewSet):
     
     queryset = models.Lance.objects.all()
@@ -322,6 +295,43 @@ class LanceViewSet(viewsets.ModelViewSet):
         self.perform_destroy(instance)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(detail=False, methods=['post'])
+    def em_lote(self, request):
+        # cria vários lances de uma vez; itens inválidos voltam em "erros" sem impedir a criação dos demais
+        itens = request.data
+        if not isinstance(itens, list) or not itens:
+            return Response({"detail": "Envie uma lista de lances."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(itens) > MAXIMO_LANCES_LOTE:
+            return Response({"detail": f"Envie no máximo {MAXIMO_LANCES_LOTE} lances por vez."}, status=status.HTTP_400_BAD_REQUEST)
+
+        contexto = {**self.get_serializer_context(), 'ids': serializers.ids_dos_lances(itens)}
+        lances, erros = [], []
+        for indice, item in enumerate(itens):
+            serializer = serializers.LanceLoteSerializer(data=item, context=contexto)
+            if serializer.is_valid():
+                lances.append(serializer.para_lance())
+            else:
+                erros.append({'indice': indice, 'erros': serializer.errors})
+
+        if lances:
+            # o bulk_create não chama Lance.save nem os signals: as zonas e o recálculo dos confrontos são feitos aqui
+            pontos = np.array(
+                [[lance.coordenadaX, lance.coordenadaY, lance.coordenadaXFinal, lance.coordenadaYFinal] for lance in lances],
+                dtype=np.float64,
+            )
+            zonas, zonas_finais = zonas_do_campo(pontos[:, 0], pontos[:, 1]), zonas_do_campo(pontos[:, 2], pontos[:, 3])
+            for lance, zona, zona_final in zip(lances, zonas.tolist(), zonas_finais.tolist()):
+                lance.zona = zona or None
+                lance.zona_final = zona_final or None
+
+            with transaction.atomic():
+                models.Lance.objects.bulk_create(lances, batch_size=TAMANHO_LOTE_LANCES)
+                for confronto_id in {lance.confronto_id for lance in lances}:
+                    confronto_alterado(confronto_id)
+
+        resposta = {'criados': serializers.LanceSerializer(lances, many=True).data, 'erros': erros}
+        return Response(resposta, status=status.HTTP_201_CREATED if lances else status.HTTP_400_BAD_REQUEST)
+
     @action(detail=False, methods=['get'])
     def filtrar_por_confronto(self, request):
         confronto_id = request.query_params.get('confronto_id')
@@ -329,8 +339,8 @@ class LanceViewSet(viewsets.ModelViewSet):
             return Response({"detail": "O parâmetro confronto_id é obrigatório."}, status=400)
 
         lances = self.queryset.filter(confronto_id=confronto_id).order_by('-tempo', '-minuto', '-id')
-        serializer = serializers.LanceSerializer2(lances, many=True)
-        return Response(serializer.data)
+        # mesmo formato do LanceSerializer2, em uma única consulta
+        return Response(serializers.serializar_lances_confronto(lances))
     
 
 class TiposLancesViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
@@ -398,37 +408,59 @@ def adicionar_jogador(request, confronto_id, jogador_id):
         return Response({"detail": "Jogador não encontrado."}, status=status.HTTP_404_NOT_FOUND)
     
 
+@api_view(['PUT', 'POST'])
+def definir_escalacao(request, confronto_id):
+
+    permission = IsAdminOrStaff()
+
+    if not permission.has_permission(request, view=None):
+        return Response({"detail": "Permissão negada."}, status=status.HTTP_403_FORBIDDEN)
+
+    # recebe a escalação completa ({"jogadores": [ids]}) e aplica só a diferença para a atual
+    # um corpo que não é objeto (ex.: uma lista) também é recusado
+    jogadores_ids = request.data.get('jogadores') if isinstance(request.data, dict) else None
+    if not isinstance(jogadores_ids, list) or not all(isinstance(jogador_id, int) and not isinstance(jogador_id, bool) for jogador_id in jogadores_ids):
+        return Response({"detail": "Informe jogadores como uma lista de ids."}, status=status.HTTP_400_BAD_REQUEST)
+    desejados = set(jogadores_ids)
+
+    if not models.Confronto.objects.filter(id=confronto_id).exists():
+        return Response({"detail": "Confronto não encontrado."}, status=status.HTTP_404_NOT_FOUND)
+
+    inexistentes = desejados - set(models.Jogador.objects.filter(id__in=desejados).values_list('id', flat=True))
+    if inexistentes:
+        return Response({"detail": "Jogador não encontrado.", "jogadores": sorted(inexistentes)}, status=status.HTTP_404_NOT_FOUND)
+
+    EscalacaoJogadores = models.Escalacao.jogadores.through
+    with transaction.atomic():
+        escalacao, _ = models.Escalacao.objects.get_or_create(confronto_id=confronto_id)
+        atuais = set(EscalacaoJogadores.objects.filter(escalacao=escalacao).values_list('jogador_id', flat=True))
+
+        remover = atuais - desejados
+        adicionar = desejados - atuais
+        if remover:
+            EscalacaoJogadores.objects.filter(escalacao=escalacao, jogador_id__in=remover).delete()
+        if adicionar:
+            EscalacaoJogadores.objects.bulk_create(
+                [EscalacaoJogadores(escalacao=escalacao, jogador_id=jogador_id) for jogador_id in sorted(adicionar)]
+            )
+        # a tabela da escalação é alterada direto, sem o m2m_changed: recalcula o confronto uma única vez
+        if remover or adicionar:
+            confronto_alterado(escalacao.confronto_id)
+
+    serializer = serializers.EscalacaoSerializers2(escalacao)
+    return Response(serializer.data, status=status.HTTP_200_OK)
+
+
 @api_view(['GET'])
 def jogadores_disponiveis(request, confronto_id):
     permission_classes = (IsAuthenticated,)
     
-    try:
-        confronto = models.Confronto.objects.get(id=confronto_id)
-    except models.Confronto.DoesNotExist:
+    elenco = elenco_do_confronto(confronto_id)
+    if not elenco.existe:
         return Response({"detail": "Confronto não encontrado"}, status=status.HTTP_404_NOT_FOUND)
 
-    # Verifica se existe uma escalacao para o confronto
-    try:
-        escalacao = models.Escalacao.objects.get(confronto=confronto)
-        jogadores_na_escalacao = escalacao.jogadores.all()
-    except models.Escalacao.DoesNotExist:
-        jogadores_na_escalacao = []
-
-    POSICAO_ORDENACAO = {
-        'Goleiro': 1,
-        'Lateral': 2,
-        'Zagueiro': 3,
-        'Volante': 4,
-        'Meia': 5,
-        'Ponta': 6,
-        'Atacante': 7,
-    }
-
-    # Ordena os jogadores disponíveis conforme a ordem de posição
-    ordenacao_case = Case(*[When(posicao=posicao, then=Value(ordem)) for posicao, ordem in POSICAO_ORDENACAO.items()], default=Value(8), output_field=IntegerField())
-    jogadores_disponiveis = models.Jogador.objects.exclude(id__in=[jogador.id for jogador in jogadores_na_escalacao] + [16]).annotate(ordenacao=ordenacao_case).order_by('ordenacao')
-
-    serializer = serializers.JogadorOrdemSerializers(jogadores_disponiveis, many=True)
+    # jogadores fora da escalacao (sem o Adversário), já ordenados por posição
+    serializer = serializers.JogadorOrdemSerializers(elenco.disponiveis(), many=True)
     
     return Response(serializer.data)
 
@@ -438,18 +470,17 @@ class LanceCoordenadaViewSet(viewsets.ModelViewSet):
     
     queryset = models.Lance.objects.all()
     serializer_class = serializers.LanceCoordenadaSerializer
+    # parâmetros de lances_do_escopo e filtrar_coordenadas, que entram na chave de cache das ações com cache
+    parametros_coordenadas = ('confronto_id', 'campeonato', 'jogador', 'tipo_lance', 'tempo', 'campo')
 
-    @action(detail=False, methods=['get'])
-    def filtrar_por_confronto(self, request):
-        confronto_id = request.query_params.get('confronto_id')
-        jogador_id = request.query_params.get('jogador')
-        tipo_lance_ids = request.query_params.getlist('tipo_lance')  # Usa getlist para pegar uma lista de valores
-        tempo = request.query_params.get('tempo')
-        campo = request.query_params.get('campo')
+    def filtrar_coordenadas(self, lances, query_params):
+        # filtros comuns das ações de coordenadas
+        jogador_id = inteiro_do_parametro(query_params, 'jogador', None, minimo=1)
+        # aceita ?tipo_lance=1&tipo_lance=2 e ?tipo_lance=1,2, como na chave do cache
+        tipo_lance_ids = lista_de_ids(query_params, 'tipo_lance')
+        tempo = query_params.get('tempo')
+        campo = query_params.get('campo')
 
-        # Filtrar por confronto
-        lances = self.queryset.filter(confronto_id=confronto_id)
-        
         # Filtrar por jogador, se fornecido
         if jogador_id:
             lances = lances.filter(jogador_id=jogador_id)
@@ -464,16 +495,122 @@ class LanceCoordenadaViewSet(viewsets.ModelViewSet):
         elif tempo == "2":
             lances = lances.filter(tempo=2)
 
-        # Filtrar por campo
+        # Filtrar por campo (pela zona indexada: defesa é coordenadaX > 300, ataque é coordenadaX <= 300)
         if campo == "defesa":
-            lances = lances.filter(coordenadaX__gt=300)
+            lances = lances.filter(zona__in=ZONAS_DEFESA)
         elif campo == "ataque":
-            lances = lances.filter(coordenadaX__lte=300)
-            
+            lances = lances.filter(zona__in=ZONAS_ATAQUE)
+
+        return lances
+
+    @action(detail=False, methods=['get'])
+    def filtrar_por_confronto(self, request):
+        confronto_id = inteiro_do_parametro(request.query_params, 'confronto_id', None, minimo=1)
+
+        # Filtrar por confronto
+        lances = self.filtrar_coordenadas(self.queryset.filter(confronto_id=confronto_id), request.query_params)
+
+        return Response(serializers.serializar_lances_coordenada(lances))
+
+    def list(self, request, *args, **kwargs):
+        # leitura rápida: o mesmo JSON do LanceCoordenadaSerializer, a partir de uma única consulta
+        return Response(serializers.serializar_lances_coordenada(self.filter_queryset(self.get_queryset())))
+
+    @action(detail=False, methods=['get'])
+    def heatmap(self, request):
+        # mapa de calor já agrupado em uma grade, com os mesmos filtros de filtrar_por_confronto
+        return resposta_em_cache('heatmap', request, self.calcular_heatmap, self.parametros_coordenadas + ('colunas', 'linhas'))
+
+    @action(detail=False, methods=['get'])
+    def zonas(self, request):
+        # lances por zona do campo e tipo de lance, com os mesmos filtros do heatmap
+        return resposta_em_cache('zonas', request, self.calcular_zonas, self.parametros_coordenadas + ('ponto',))
+
+    def calcular_zonas(self, request):
+        ponto = request.query_params.get('ponto', 'inicio')
+        if ponto not in ('inicio', 'final'):
+            return Response({"detail": "O parâmetro ponto deve ser inicio ou final."}, status=status.HTTP_400_BAD_REQUEST)
+        campo_zona = 'zona' if ponto == 'inicio' else 'zona_final'
+
+        lances = self.filtrar_coordenadas(self.lances_do_escopo(request.query_params), request.query_params)
+        agrupado = (
+            lances.filter(**{f'{campo_zona}__isnull': False})
+            .order_by()
+            .values_list(campo_zona, 'tipo_lance_id')
+            .annotate(total=Count('id'))
+        )
+
+        registro_tipos = registro()
+        zonas = {zona: {'zona': zona, 'total': 0, 'por_tipo': {}} for zona in range(1, ZONAS + 1)}
+        for zona, tipo_lance_id, total in agrupado:
+            nome = registro_tipos.nome_do_tipo(tipo_lance_id)
+            zonas[zona]['total'] += total
+            zonas[zona]['por_tipo'][nome] = zonas[zona]['por_tipo'].get(nome, 0) + total
+
+        return Response({'ponto': ponto, 'zonas': list(zonas.values())})
+
+    @action(detail=False, methods=['get'])
+    def progressao(self, request):
+        # métricas de progressão (coordenada inicial -> final) por jogador e partida, ou por jogador (?por=jogador)
+        return resposta_em_cache('progressao', request, self.calcular_progressao, self.parametros_coordenadas + ('por',))
+
+    def calcular_progressao(self, request):
+        por = request.query_params.get('por', 'partida')
+        if por not in ('partida', 'jogador'):
+            return Response({"detail": "O parâmetro por deve ser partida ou jogador."}, status=status.HTTP_400_BAD_REQUEST)
+
+        lances = self.filtrar_coordenadas(self.lances_do_escopo(request.query_params), request.query_params)
+        dados = coordenadas(
+            lances.filter(coordenadaXFinal__isnull=False, coordenadaYFinal__isnull=False),
+            campos=('jogador_id', 'confronto_id', 'coordenadaX', 'coordenadaY', 'coordenadaXFinal', 'coordenadaYFinal'),
+        )
+        dados = dados[~np.isnan(dados[:, 2:]).any(axis=1)]
+
+        chaves = dados[:, :1] if por == 'jogador' else dados[:, :2]
+        grupos, indices = np.unique(chaves.astype(np.int64), axis=0, return_inverse=True)
+        metricas = metricas_de_progressao(dados[:, 2], dados[:, 3], dados[:, 4], dados[:, 5], indices.reshape(-1), len(grupos))
+        metricas = {nome: valores.tolist() for nome, valores in metricas.items()}
+
+        jogadores = models.Jogador.objects.in_bulk(grupos[:, 0].tolist())
+        resultado = []
+        for linha, grupo in enumerate(grupos.tolist()):
+            item = {'jogador': grupo[0], 'nome': jogadores[grupo[0]].nome if grupo[0] in jogadores else None}
+            if por == 'partida':
+                item['confronto'] = grupo[1]
+            item.update({nome: valores[linha] for nome, valores in metricas.items()})
+            resultado.append(item)
+
+        return Response(resultado)
+
+    def lances_do_escopo(self, query_params):
+        # escopo: um confronto, um campeonato ou todos os lances
+        lances = self.queryset
+        confronto_id = inteiro_do_parametro(query_params, 'confronto_id', None, minimo=1)
+        campeonato_id = inteiro_do_parametro(query_params, 'campeonato', None, minimo=1)
+        if confronto_id:
+            lances = lances.filter(confronto_id=confronto_id)
+        elif campeonato_id:
+            lances = lances.filter(confronto__campeonato_id=campeonato_id)
+        return lances
+
+    def calcular_heatmap(self, request):
+        colunas = inteiro_do_parametro(request.query_params, 'colunas', 12, minimo=1, maximo=100)
+        linhas = inteiro_do_parametro(request.query_params, 'linhas', 8, minimo=1, maximo=100)
+
+        lances = self.filtrar_coordenadas(self.lances_do_escopo(request.query_params), request.query_params)
+
+        pontos = coordenadas(lances)
+        contagens = histograma(pontos[:, 0], pontos[:, 1], colunas, linhas)
+
+        return Response({
+            'colunas': colunas,
+            'linhas': linhas,
+            'largura_celula': COMPRIMENTO / colunas,
+            'altura_celula': LARGURA / linhas,
+            'total': int(contagens.sum()),
+            'contagens': contagens.tolist(),
+        })
 
-        serializer = self.get_serializer(lances, many=True)
-        return Response(serializer.data)
-    
 
 class ConfrontoPlacarViewSet(viewsets.ModelViewSet):
     def get_permissions(self):
@@ -525,22 +662,12 @@ class ConfrontoAcrescimosViewSet(viewsets.GenericViewSet):
 def jogadores_no_confronto(request, confronto_id):
     permission_classes = (IsAuthenticated,)
     
-    try:
-        confronto = models.Confronto.objects.get(id=confronto_id)
-    except models.Confronto.DoesNotExist:
+    elenco = elenco_do_confronto(confronto_id)
+    if not elenco.existe:
         return Response({'detail': 'Confronto não encontrado'}, status=status.HTTP_404_NOT_FOUND)
     
-    # Pega todos os jogadores que foram escalados para o confronto
-    jogadores_escalados = models.Jogador.objects.filter(escalacoes__confronto=confronto).distinct()
-    
-    # Pega todos os jogadores que entraram como substitutos no confronto
-    jogadores_substitutos = models.Jogador.objects.filter(substituicoes_entrada__confronto=confronto).distinct()
-    
-    # Combina os dois querysets de jogadores
-    todos_jogadores = jogadores_escalados | jogadores_substitutos
-
-    # Serializa os dados. Supondo que você tenha um serializer chamado JogadorSerializer
-    serializer = serializers.JogadorSerializers(todos_jogadores, many=True)
+    # jogadores escalados e os que entraram como substitutos no confronto
+    serializer = serializers.JogadorSerializers(elenco.no_confronto(), many=True)
     
     return Response(serializer.data)
 
@@ -575,319 +702,44 @@ class EstatisticasJogadoresView(APIView):
     permission_classes = (IsAuthenticated,)
     
     def get(self, request, *args, **kwargs):
-        filtered_lances = LanceFilter(request.GET, queryset=models.Lance.objects.all()).qs
+        return resposta_em_cache('jogadores', request, self.calcular, PARAMETROS_LANCE + ('group_by', 'fields'))
+
+    def calcular(self, request):
         jogadores = models.Jogador.objects.exclude(id=16)
 
         # Recupera o ID do campeonato do parâmetro da query, se existir
         campeonato_id = request.query_params.get('campeonato')
         jogo_id = request.query_params.get('jogo')
 
-        estatisticas = []
-        for jogador in jogadores:
-
-            jogador_lances = filtered_lances.filter(jogador=jogador)
-
-            # desempenho
-            gols = jogador_lances.filter(tipo_lance__tipo_lance='Gol').count()
-            gols_de_penalti = jogador_lances.filter(tipo_lance__tipo_lance='Gol de Penalti').count()
-            assistencias = jogador_lances.filter(tipo_lance__tipo_lance='Assistencia').count()
-            chute_pra_fora = jogador_lances.filter(tipo_lance__tipo_lance='Finalização pra fora').count()
-            chute_defendido = jogador_lances.filter(tipo_lance__tipo_lance='Finalização defendida').count()
-            chute_na_trave = jogador_lances.filter(tipo_lance__tipo_lance='Finalização na trave').count()
-            impedimento = jogador_lances.filter(tipo_lance__tipo_lance='Impedimento').count()
-
-            # desempenho defensivo
-            cartao_amarelo = jogador_lances.filter(tipo_lance__tipo_lance='Cartão Amarelo').count()
-            cartao_vermelho = jogador_lances.filter(tipo_lance__tipo_lance='Cartão Vermelho').count()
-            desarme = jogador_lances.filter(tipo_lance__tipo_lance='Desarme').count()
-            roubada_de_bola = jogador_lances.filter(tipo_lance__tipo_lance='Roubada de Bola').count()
-            falta_cometida = jogador_lances.filter(tipo_lance__tipo_lance='Falta cometida').count()
-            falta_sofrida = jogador_lances.filter(tipo_lance__tipo_lance='Falta sofrida').count()
-            falta_cartao_sofrida = jogador_lances.filter(tipo_lance__tipo_lance='Falta sofrida para cartão').count()
-
-
-            # esperado
-            gols_esperados = jogador_lances.filter(tipo_lance__tipo_lance='Chance de Gol').count()
-            assists_esperados = jogador_lances.filter(tipo_lance__tipo_lance='Chance de Assistencia').count()
-
-            # progressao
-            progressao_solo = jogador_lances.filter(tipo_lance__tipo_lance='Progressão com a bola').count()
-            passe_ql = jogador_lances.filter(tipo_lance__tipo_lance='Passe Quebra linha').count()
-            passe_ql_recebido = jogador_lances.filter(tipo_lance__tipo_lance='Passe QL recebido').count()
-
-            # Aplica o filtro de campeonato na contagem de partidas titulares e partidas jogadas, se um campeonato foi especificado
-            if jogo_id:
-                partidas_titulares = models.Escalacao.objects.filter(
-                    jogadores=jogador,
-                    confronto__id=jogo_id  # Filtra escalacoes pelo campeonato especificado
-                ).distinct().count()
-
-                partidas_substituido = models.Substituicao.objects.filter(
-                    jogador_entrada=jogador,
-                    confronto__id=jogo_id
-                ).distinct().count()
-            
-            elif campeonato_id:
-                partidas_titulares = models.Escalacao.objects.filter(
-                    jogadores=jogador,
-                    confronto__campeonato_id=campeonato_id  # Filtra escalacoes pelo campeonato especificado
-                ).distinct().count()
-
-                partidas_substituido = models.Substituicao.objects.filter(
-                    jogador_entrada=jogador,
-                    confronto__campeonato_id=campeonato_id
-                ).distinct().count()
-        
-            else:
-                partidas_titulares = models.Escalacao.objects.filter(
-                    jogadores=jogador
-                ).distinct().count()
-
-                partidas_substituido = models.Substituicao.objects.filter(
-                    jogador_entrada=jogador
-                ).distinct().count()
-            
-            partidas_jogadas = partidas_titulares + partidas_substituido
-
-
-
-            ####### calculo do tempo de minutos jogador
-            minutos_totais = 0
-
-            if campeonato_id:
-
-                confrontos_jogador_titular = models.Confronto.objects.filter(
-                    escalacao__jogadores=jogador,
-                    campeonato_id=campeonato_id
-                ).distinct()
-
-                confrontos_jogador_entrou = models.Confronto.objects.filter(
-                    substituicao__jogador_entrada=jogador,
-                    campeonato_id=campeonato_id
-                ).distinct()
-
-                confrontos_totais = confrontos_jogador_titular.union(confrontos_jogador_entrou)
-
-                for confronto in confrontos_totais:
-                    foi_substituido = models.Substituicao.objects.filter(
-                        confronto=confronto, jogador_saida=jogador
-                    ).exists()
-                    entrou_como_substituto = models.Substituicao.objects.filter(
-                        confronto=confronto, jogador_entrada=jogador
-                    ).first()
-
-                    foi_expulso = models.Lance.objects.filter(confronto=confronto, jogador=jogador, tipo_lance=11,).distinct().first()
-
-                    if foi_substituido:
-                        substituicao = models.Substituicao.objects.get(confronto=confronto, jogador_saida=jogador)
-                        if substituicao.primeiro_tempo:
-                            minutos_totais += substituicao.minuto
-                        else:
-                            minutos_totais += substituicao.minuto + confronto.acrescimo1tempo
-                    elif entrou_como_substituto:
-                        if foi_expulso:
-                            if foi_expulso.tempo < 2: # expulso no primeiro tempo
-                                minutos_totais += foi_expulso.minuto - entrou_como_substituto.minuto
-                            else: # expulso no segundo tempo
-                                minutos_totais += foi_expulso.minuto + confronto.acrescimo1tempo - entrou_como_substituto.minuto
-                        else:
-                            if entrou_como_substituto.primeiro_tempo:
-                                minutos_totais += 90 + confronto.acrescimo1tempo + confronto.acrescimo2tempo - entrou_como_substituto.minuto
-                            else:
-                                minutos_totais += 90 + confronto.acrescimo2tempo - entrou_como_substituto.minuto
-                    else: # titular e não saiu
-                        if foi_expulso:
-                            if foi_expulso.tempo < 2: # expulso no primeiro tempo
-                                minutos_totais += foi_expulso.minuto
-                            else: # expulso no segundo tempo
-                                minutos_totais += foi_expulso.minuto + confronto.acrescimo1tempo
-                        else:
-                            minutos_totais += 90 + confronto.acrescimo1tempo + confronto.acrescimo2tempo
-            
-            elif jogo_id:
-
-                confrontos_jogador_titular = models.Confronto.objects.filter(
-                    id = jogo_id, escalacao__jogadores=jogador,
-                ).distinct()
-
-                confrontos_jogador_entrou = models.Confronto.objects.filter(
-                    id = jogo_id, substituicao__jogador_entrada=jogador,
-                ).distinct()
-
-                foi_expulso = models.Lance.objects.filter(confronto=jogo_id, jogador=jogador, tipo_lance=11,).distinct().first()
-
-                try:
-                    confronto = models.Confronto.objects.get(id=jogo_id)
-                except models.Confronto.DoesNotExist:
-                    # Trate o caso em que o confronto não existe
-                    # Por exemplo, retornando uma resposta de erro
-                    return Response({"error": "Confronto não encontrado."}, status=status.HTTP_404_NOT_FOUND)
-
-                # Depois, verifique as condições relacionadas ao jogador sendo titular, entrando ou saindo
-                if confrontos_jogador_titular.exists():
-                    substituicao_saida = models.Substituicao.objects.filter(confronto=confronto, jogador_saida=jogador).first()
-                    if foi_expulso:
-                        if foi_expulso.tempo < 2: # expulso no primeiro tempo
-                            minutos_totais += foi_expulso.minuto
-                        else: # expulso no segundo tempo
-                            minutos_totais += foi_expulso.minuto + confronto.acrescimo1tempo
-
-                    elif substituicao_saida:
-                        if substituicao_saida.primeiro_tempo:
-                            minutos_totais = substituicao_saida.minuto
-                        else:
-                            minutos_totais = substituicao_saida.minuto + confronto.acrescimo1tempo
-                    else:
-                        minutos_totais = 90 + confronto.acrescimo1tempo + confronto.acrescimo2tempo
-
-                elif confrontos_jogador_entrou.exists():
-                    substituicao_entrada = models.Substituicao.objects.filter(confronto=confronto, jogador_entrada=jogador).first()
-                    if foi_expulso:
-                        if foi_expulso.tempo < 2: # expulso no primeiro tempo
-                            minutos_totais += foi_expulso.minuto
-                        else: # expulso no segundo tempo
-                            minutos_totais += foi_expulso.minuto + confronto.acrescimo1tempo
-                    elif substituicao_entrada:
-                        if substituicao_entrada.primeiro_tempo:
-                            minutos_totais = 90 + confronto.acrescimo1tempo + confronto.acrescimo2tempo - substituicao_entrada.minuto
-                        else:
-                            minutos_totais = 90 + confronto.acrescimo2tempo - substituicao_entrada.minuto
-
-            else: #sem nenhum filtro
-
-                confrontos_jogador_titular = models.Confronto.objects.filter(
-                    escalacao__jogadores=jogador,
-                ).distinct()
-
-                confrontos_jogador_entrou = models.Confronto.objects.filter(
-                    substituicao__jogador_entrada=jogador,
-                ).distinct()
-
-                confrontos_totais = confrontos_jogador_titular.union(confrontos_jogador_entrou)
-
-                for confronto in confrontos_totais:
-                    foi_substituido = models.Substituicao.objects.filter(
-                        confronto=confronto, jogador_saida=jogador
-                    ).exists()
-                    entrou_como_substituto = models.Substituicao.objects.filter(
-                        confronto=confronto, jogador_entrada=jogador
-                    ).first()
-
-                    foi_expulso = models.Lance.objects.filter(confronto=confronto, jogador=jogador, tipo_lance=11,).distinct().first()
-
-                    if foi_substituido:
-                        substituicao = models.Substituicao.objects.get(confronto=confronto, jogador_saida=jogador)
-                        if substituicao.primeiro_tempo:
-                            minutos_totais += substituicao.minuto
-                        else:
-                            minutos_totais += substituicao.minuto + confronto.acrescimo1tempo
-                    elif entrou_como_substituto:
-                        if foi_expulso:
-                            if foi_expulso.tempo < 2: # expulso no primeiro tempo
-                                minutos_totais += foi_expulso.minuto
-                            else: # expulso no segundo tempo
-                                minutos_totais += foi_expulso.minuto + confronto.acrescimo1tempo
-                        else:
-                            if entrou_como_substituto.primeiro_tempo:
-                                minutos_totais += 90 + confronto.acrescimo1tempo + confronto.acrescimo2tempo - entrou_como_substituto.minuto
-                            else:
-                                minutos_totais += 90 + confronto.acrescimo2tempo - entrou_como_substituto.minuto
-                    else:
-                        if foi_expulso:
-                            if foi_expulso.tempo < 2: # expulso no primeiro tempo
-                                minutos_totais += foi_expulso.minuto
-                            else: # expulso no segundo tempo
-                                minutos_totais += foi_expulso.minuto + confronto.acrescimo1tempo
-                        else:
-                            minutos_totais += 90 + confronto.acrescimo1tempo + confronto.acrescimo2tempo
-
-            if partidas_jogadas == 0:
-                media_minutos = 0
-            else: 
-                media_minutos = round((minutos_totais/partidas_jogadas),2)
-            
-            ############ fim calculo tempo
-
-            # desempenho
-            gols_total = gols + gols_de_penalti
-            faltas_sofridas = falta_sofrida + falta_cartao_sofrida
-            faltas_cometidas = falta_cometida + cartao_amarelo + cartao_vermelho
-
-            # esperado
-            """ gols_assists_esperados = gols_esperados + assists_esperados """
-            # per 90 min
-            if minutos_totais == 0:
-                minutos_totais = 0.0000000001
-
-            tempo_div_90 = minutos_totais/90
-
-            gols_p_90min = round((gols_total/tempo_div_90), 3)
-            assists_p_90min = round((assistencias/tempo_div_90), 3)
-            gols_assists_p_90min = gols_p_90min + assists_p_90min
-            gols_esperados_p_90min = round((gols_esperados/tempo_div_90), 3)
-            assists_esperados_p_90min = round((assists_esperados/tempo_div_90), 3)
-            finalizacoes_p_90min = round(((chute_pra_fora + chute_defendido + chute_na_trave + gols_total)/tempo_div_90), 3)
-            falta_sofrida_p_90 = round(((faltas_sofridas)/tempo_div_90), 3)
-            progressoes_p_90 = round(((progressao_solo + passe_ql_recebido + passe_ql)/tempo_div_90), 3)
-            rb_desarme_p_90 = round(((roubada_de_bola + desarme)/tempo_div_90), 3)
-            cartoes_p_90 = round(((cartao_amarelo + cartao_vermelho)/tempo_div_90), 3)
-            falta_cometida_p_90 = round(((faltas_cometidas)/tempo_div_90), 3)
-
-
-
-            estatisticas.append({
-                # info
-                'nome': jogador.nome,
-                'posicao': jogador.posicao,
+        if jogo_id and not models.Confronto.objects.filter(id=jogo_id).exists():
+            return Response({"error": "Confronto não encontrado."}, status=status.HTTP_404_NOT_FOUND)
+
+        # só as métricas pedidas em ?fields= (e suas dependências) são calculadas
+        plano = Plano(campos_pedidos(request.query_params, CAMPOS_JOGADOR))
+        janela = janela_de_minutos(request.GET)
+        agrupar_por = agrupamento_pedido(request.query_params)
+
+        grupos = ler_estatisticas_jogadores(plano, janela, agrupar_por, campeonato_id=campeonato_id, jogo_id=jogo_id)
+
+        if not agrupar_por:
+            return Response(montar_estatisticas_jogadores(jogadores, plano, *grupos[None]))
+
+        # um bloco por valor do grupo, todos a partir das mesmas consultas agrupadas
+        jogadores = list(jogadores)
+        return Response([
+            {agrupar_por: grupo, 'estatisticas': montar_estatisticas_jogadores(jogadores, plano, *grupos[grupo])}
+            for grupo in sorted(grupos)
+        ])
+
+
+
+
+
+
+
+
 
-                # tempo
-                'partidas_titulares': partidas_titulares,
-                'partidas_jogadas': partidas_jogadas,
-                'minutos_totais': int(minutos_totais),
-                'media_minutos': media_minutos,
-
-                # desempenho
-                'gols': gols_total,
-                'assistencias': assistencias,
-                'chutes_pra_fora': chute_pra_fora,
-                'chutes_defendidos': chute_defendido,
-                'chutes_na_trave': chute_na_trave,
-                'impedimentos': impedimento,
-
-                # desempenho defensivo
-                'cartao_amarelo': cartao_amarelo,
-                'cartao_vermelho': cartao_vermelho,
-                'desarmes': desarme,
-                'roubada_de_bola': roubada_de_bola,
-                'faltas_cometida': faltas_cometidas,
-                'faltas_sofridas': faltas_sofridas,
-
-                # esperado
-                'gols_esperados': gols_esperados,
-                'assistencias_esperados': assists_esperados,
-
-                # progressao
-                'progressao_com_a_bola': progressao_solo,
-                'passe_quebra_linha': passe_ql,
-                'passe_ql_recebido': passe_ql_recebido,
-
-                # a cada 90min
-                'gols_p_90min': gols_p_90min,
-                'assists_p_90min': assists_p_90min,
-                'Gols_assists_p_90min': gols_assists_p_90min,
-                'gols_esperados_p_90min': gols_esperados_p_90min,
-                'assists_esperados_p_90min': assists_esperados_p_90min,
-                'finalizacoes_p_90_min':  finalizacoes_p_90min,
-                'falta_sofrida_p_90': falta_sofrida_p_90,
-                'progressoes_p_90': progressoes_p_90,
-                'rb_desarme_p_90': rb_desarme_p_90,
-                'cartoes_p_90': cartoes_p_90,
-                'falta_cometida_p_90': falta_cometida_p_90,
-
-                # Adicione mais estatísticas conforme necessário
-            })
 
-        return Response(estatisticas)
 
 
 
@@ -897,162 +749,315 @@ class EstatisticasJogadoresView(APIView):
 
 
 
+class RankingJogadoresView(APIView):
+    permission_classes = (IsAuthenticated,)
 
+    def get(self, request, *args, **kwargs):
+        return resposta_em_cache('ranking', request, self.calcular, PARAMETROS_LANCE + ('metrica', 'n', 'minutos_minimos'))
+
+    def calcular(self, request):
+        # top N de uma métrica de EstatisticasJogadoresView, com os mesmos filtros (campeonato, jogo, janela de minutos)
+        metricas = dict(CAMPOS_JOGADOR)
+        metrica = request.query_params.get('metrica')
+        if metrica not in metricas:
+            return Response({"detail": f"O parâmetro metrica deve ser um de: {', '.join(metricas)}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        n = inteiro_do_parametro(request.query_params, 'n', 10, minimo=1, maximo=100)
+        minutos_minimos = inteiro_do_parametro(request.query_params, 'minutos_minimos', 0)
+
+        campeonato_id = inteiro_do_parametro(request.query_params, 'campeonato', None, minimo=1)
+        jogo_id = inteiro_do_parametro(request.query_params, 'jogo', None, minimo=1)
+        if jogo_id and not models.Confronto.objects.filter(id=jogo_id).exists():
+            return Response({"error": "Confronto não encontrado."}, status=status.HTTP_404_NOT_FOUND)
+
+        # só a métrica pedida e os minutos (para o corte) são calculados
+        plano = Plano(list({metrica: metricas[metrica], 'minutos_totais': 'minutos_totais'}.items()))
+        lances_por_jogador, titulares_por_jogador, substituido_por_jogador, minutos_por_jogador = ler_estatisticas_jogadores(
+            plano, janela_de_minutos(request.GET), campeonato_id=campeonato_id, jogo_id=jogo_id
+        )[None]
+
+        # só entram jogadores com dados no filtro e com os minutos mínimos (sem o Adversário)
+        candidatos = [
+            jogador_id for jogador_id in set(lances_por_jogador) | set(minutos_por_jogador)
+            if jogador_id != ADVERSARIO_ID and (minutos_por_jogador.get(jogador_id) or 0) >= minutos_minimos
+        ]
+        # a colocação sai só da coluna da métrica; nomes e posições são lidos só para os ranqueados
+        valores = calcular_metricas_jogadores(
+            candidatos, plano, lances_por_jogador, titulares_por_jogador, substituido_por_jogador, minutos_por_jogador
+        )
+        ranqueados = ranquear(valores[metrica], n)
+        jogadores = models.Jogador.objects.in_bulk([candidatos[indice] for _, indice in ranqueados])
+
+        ranking = []
+        for colocacao, indice in ranqueados:
+            jogador = jogadores[candidatos[indice]]
+            ranking.append({
+                'colocacao': colocacao,
+                'id': jogador.id,
+                'nome': jogador.nome,
+                'posicao': jogador.posicao,
+                'minutos_totais': valores['minutos_totais'][indice],
+                'valor': valores[metrica][indice],
+            })
+        # empatados em ordem de nome
+        ranking.sort(key=lambda linha: (linha['colocacao'], linha['nome']))
+        return Response({'metrica': metrica, 'minutos_minimos': minutos_minimos, 'ranking': ranking})
 
 
+class PercentisJogadoresView(APIView):
+    permission_classes = (IsAuthenticated,)
 
+    def get(self, request, *args, **kwargs):
+        # a chave do cache leva o campeonato e a posição, e muda quando os dados do campeonato mudam
+        return resposta_em_cache('percentis', request, self.calcular, PARAMETROS_LANCE + ('posicao', 'fields'))
+
+    def calcular(self, request):
+        # percentil de cada métrica de cada jogador, comparado aos jogadores que atuaram no filtro (e na posição)
+        posicao = request.query_params.get('posicao')
+        if posicao and posicao not in dict(models.Jogador.POSICOES_CHOICES):
+            return Response({"detail": "Posição inválida."}, status=status.HTTP_400_BAD_REQUEST)
+
+        campeonato_id = inteiro_do_parametro(request.query_params, 'campeonato', None, minimo=1)
+        jogo_id = inteiro_do_parametro(request.query_params, 'jogo', None, minimo=1)
+        if jogo_id and not models.Confronto.objects.filter(id=jogo_id).exists():
+            return Response({"error": "Confronto não encontrado."}, status=status.HTTP_404_NOT_FOUND)
+
+        campos = campos_pedidos(request.query_params, CAMPOS_JOGADOR)
+        plano = Plano(campos if any(chave == 'minutos_totais' for chave, _ in campos) else campos + [('minutos_totais', 'minutos_totais')])
+        lances_por_jogador, titulares_por_jogador, substituido_por_jogador, minutos_por_jogador = ler_estatisticas_jogadores(
+            plano, janela_de_minutos(request.GET), campeonato_id=campeonato_id, jogo_id=jogo_id
+        )[None]
+
+        # só quem jogou entra na comparação
+        jogadores = models.Jogador.objects.exclude(id=16).filter(
+            id__in=[jogador_id for jogador_id, minutos in minutos_por_jogador.items() if minutos]
+        ).order_by('nome')
+        if posicao:
+            jogadores = jogadores.filter(posicao=posicao)
+        jogadores = list(jogadores)
+
+        estatisticas = montar_estatisticas_jogadores(
+            jogadores, plano, lances_por_jogador, titulares_por_jogador, substituido_por_jogador, minutos_por_jogador
+        )
+        chaves = [chave for chave, _ in campos]
+        matriz = percentis([[estatistica[chave] for chave in chaves] for estatistica in estatisticas]).tolist()
+
+        return Response([
+            {
+                'id': jogador.id,
+                'nome': jogador.nome,
+                'posicao': jogador.posicao,
+                'percentis': dict(zip(chaves, linha)),
+            }
+            for jogador, linha in zip(jogadores, matriz)
+        ])
 
 
+class FormaJogadoresView(APIView):
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, *args, **kwargs):
+        return resposta_em_cache('forma', request, self.calcular, ('campeonato', 'jogador', 'janelas', 'fields'))
+
+    def calcular(self, request):
+        # métricas de cada jogador nas suas últimas N partidas (?janelas=3,5,10), em ordem de data do confronto
+        janelas = lista_de_ids(request.query_params, 'janelas') or [3, 5, 10]
+        if 0 in janelas:
+            return Response({"detail": "As janelas devem ter pelo menos uma partida."}, status=status.HTTP_400_BAD_REQUEST)
+
+        campeonato_id = inteiro_do_parametro(request.query_params, 'campeonato', None, minimo=1)
+        jogador_id = inteiro_do_parametro(request.query_params, 'jogador', None, minimo=1)
+
+        campos = campos_pedidos(request.query_params, CAMPOS_JOGADOR) if request.query_params.get('fields') else CAMPOS_FORMA
+        plano = Plano(campos)
+        jogador_ids, partidas, valores = calcular_forma(plano, janelas, campeonato_id=campeonato_id, jogador_id=jogador_id)
+
+        valores = {janela: {chave: coluna.tolist() for chave, coluna in colunas.items()} for janela, colunas in valores.items()}
+        jogadores = models.Jogador.objects.exclude(id=16).in_bulk(jogador_ids)
+
+        forma = []
+        for linha, jogador_id in enumerate(jogador_ids):
+            if jogador_id not in jogadores:
+                continue
+            jogador = jogadores[jogador_id]
+            forma.append({
+                'id': jogador.id,
+                'nome': jogador.nome,
+                'posicao': jogador.posicao,
+                'partidas': partidas[linha],
+                'forma': {
+                    str(janela): {chave: coluna[linha] for chave, coluna in colunas.items()}
+                    for janela, colunas in valores.items()
+                },
+            })
+        return Response(sorted(forma, key=lambda item: item['nome']))
 
 
+class JogadoresSemelhantesView(APIView):
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, *args, **kwargs):
+        # k jogadores com o perfil por 90 minutos mais parecido com o do jogador informado
+        jogador_id = inteiro_do_parametro(request.query_params, 'jogador', None, minimo=1)
+        if jogador_id is None:
+            return Response({"detail": "Informe o parâmetro jogador."}, status=status.HTTP_400_BAD_REQUEST)
+        k = inteiro_do_parametro(request.query_params, 'k', 5, minimo=1, maximo=50)
+        minutos_minimos = inteiro_do_parametro(request.query_params, 'minutos_minimos', 0)
+        campeonato_id = inteiro_do_parametro(request.query_params, 'campeonato', None, minimo=1)
+
+        posicao = request.query_params.get('posicao')
+        if posicao and posicao not in dict(models.Jogador.POSICOES_CHOICES):
+            return Response({"detail": "Posição inválida."}, status=status.HTTP_400_BAD_REQUEST)
+
+        perfis = perfis_por_90(campeonato_id)
+        if jogador_id not in perfis['ids']:
+            return Response({"error": "Jogador sem minutos no filtro."}, status=status.HTTP_404_NOT_FOUND)
+        linha = perfis['ids'].index(jogador_id)
+
+        candidatos = perfis['minutos'] >= minutos_minimos
+        if posicao:
+            candidatos &= np.array(perfis['posicoes']) == posicao
+
+        semelhantes = [
+            {
+                'id': perfis['ids'][indice],
+                'nome': perfis['nomes'][indice],
+                'posicao': perfis['posicoes'][indice],
+                'minutos_totais': int(perfis['minutos'][indice]),
+                'distancia': round(float(distancia), 3),
+            }
+            for indice, distancia in mais_proximos(perfis['vetores'], linha, k, candidatos)
+        ]
+        jogador = {'id': jogador_id, 'nome': perfis['nomes'][linha], 'posicao': perfis['posicoes'][linha]}
+        return Response({'jogador': jogador, 'semelhantes': semelhantes})
+
 
 class EstatisticasTimeView(APIView):
     permission_classes = (IsAuthenticated,)
     
     def get(self, request, *args, **kwargs):
+        return resposta_em_cache('time', request, self.calcular, PARAMETROS_LANCE + ('group_by', 'campeonatos', 'times', 'fields'))
+
+    def calcular(self, request):
         filtered_lances = LanceFilter(request.GET, queryset=models.Lance.objects.all()).qs
 
         campeonato_id = request.query_params.get('campeonato')
         jogo_id = request.query_params.get('jogo')
 
-        estatisticas_time = {
-            # desempenho
-            'partidas_jogadas': 0,
-            'gols': 0,
-            'assistencias': 0,
-            'gols_assistencias': 0,
-            'penaltis_batidos': 0,
-            'gols_de_penalti': 0,
-            'finalizacoes_pra_fora': 0,
-            'finalizacoes_defendidas': 0,
-            'finalizacoes_na_trave': 0,
-            'impedimentos': 0,
-            'faltas_sofridas': 0,
-            'falta_pra_cartao_sofrida': 0,
-            # desempenho defensivo
-            'cartao_amarelo': 0,
-            'cartao_vermelho': 0,
-            'roubadas_de_bola': 0,
-            'desarmes': 0,
-            'faltas_cometidas': 0,
-            'finalizacoes_sofridas': 0,
-            'finalizacoes_perigosas_sofridas': 0,
-            'gol_sofrido': 0,
-            # chances de gols/esperado
-            'gols_esperados': 0,
-            'assists_esperados': 0,
-            'gols_assists_esperados': 0,
-            # progressao
-            'progressao_solo': 0,
-            'passe_ql': 0,
-            'passe_ql_recebido': 0,
-            # a cada 90min
-            'gols_p_90min': 0,
-            'assists_p_90min': 0,
-            'gols_assists_p_90min': 0,
-            'gols_esperados_p_90min': 0,
-            'assists_esperados_p_90min': 0,
-            'gols_assists_esperados_p_90min': 0,
-            'finalizacoes_p_90min': 0,
-            'faltas_sofrida_p_90min': 0,
-            'cartoes_causados_p_90': 0,
-            'cartoes_sofridos_p_90min': 0,
-            'rb_desarme_p_90min': 0,
-            'falta_cometida_p_90min': 0,
-            'finalizacoes_sofridas_p_90min': 0,
-            'finalizacoes_perigosas_sofridas_p_90min': 0,
-            'gols_sofridos_p_90min': 0,
-        }
-
-        ############### pegando os dados para o response ###############
-
         # tempo
+        confrontos = models.Confronto.objects.all()
         if jogo_id:
-            estatisticas_time['partidas_jogadas'] = models.Confronto.objects.filter(id=jogo_id).count()
+            confrontos = confrontos.filter(id=jogo_id)
         elif campeonato_id:
-            estatisticas_time['partidas_jogadas'] = models.Confronto.objects.filter(campeonato_id=campeonato_id).count()
-        else:
-            estatisticas_time['partidas_jogadas'] = models.Confronto.objects.count()
-
-        if estatisticas_time['partidas_jogadas'] == 0:
-            estatisticas_time['partidas_jogadas']=0.000000001
-
-        # desempenho
-        gols_normais = filtered_lances.filter(tipo_lance__tipo_lance='Gol').count()
-        gols_de_penalti = filtered_lances.filter(tipo_lance__tipo_lance='Gol de Penalti').count()
-        assists = filtered_lances.filter(tipo_lance__tipo_lance='Assistencia').count()
-        penaltis_batidos = filtered_lances.filter(tipo_lance__tipo_lance='Penalti perdido').count()
-        chute_pra_fora = filtered_lances.filter(tipo_lance__tipo_lance='Finalização pra fora').count()
-        chute_na_trave = filtered_lances.filter(tipo_lance__tipo_lance='Finalização na trave').count()
-        chute_defendido = filtered_lances.filter(tipo_lance__tipo_lance='Finalização defendida').count()
-        impedimento = filtered_lances.filter(tipo_lance__tipo_lance='Impedimento').count()
-        falta_sofrida = filtered_lances.filter(tipo_lance__tipo_lance='Falta sofrida').count()
-        falta_s_p_cartao = filtered_lances.filter(tipo_lance__tipo_lance='Falta sofrida para cartão').count()
-        # desempenho defensivo
-        cartao_amarelo = filtered_lances.filter(tipo_lance__tipo_lance='Cartão Amarelo').count()
-        cartao_vermelho = filtered_lances.filter(tipo_lance__tipo_lance='Cartão Vermelho').count()
-        rb = filtered_lances.filter(tipo_lance__tipo_lance='Roubada de Bola').count()
-        desarmes = filtered_lances.filter(tipo_lance__tipo_lance='Desarmes').count()
-        falta_cometida = filtered_lances.filter(tipo_lance__tipo_lance='Falta cometida').count()
-        fin_sofrida = filtered_lances.filter(tipo_lance__tipo_lance='Finalização normal sofrida').count()
-        fin_s_perigosa = filtered_lances.filter(tipo_lance__tipo_lance='Finalização perigosa sofrida').count()
-        gol_sofrido = filtered_lances.filter(tipo_lance__tipo_lance='Gol sofrido').count()
-        # chances de gols/esperado
-        gols_esperados = filtered_lances.filter(tipo_lance__tipo_lance='Chance de Gol').count()
-        assists_esperados = filtered_lances.filter(tipo_lance__tipo_lance='Chance de Assistencia').count()
-        # progressao
-        progressao_solo = filtered_lances.filter(tipo_lance__tipo_lance='Progressão com a bola').count()
-        passe_ql = filtered_lances.filter(tipo_lance__tipo_lance='Passe Quebra linha').count()
-        passe_ql_recebido = filtered_lances.filter(tipo_lance__tipo_lance='Passe QL recebido').count()
-
-
-        ############### passando dados para o response ###############
-
-        # desempenho
-        estatisticas_time['gols'] = gols_normais + gols_de_penalti
-        estatisticas_time['assistencias'] = assists
-        estatisticas_time['gols_assistencias'] = gols_normais + gols_de_penalti + assists
-        estatisticas_time['penaltis_batidos'] = penaltis_batidos + gols_de_penalti
-        estatisticas_time['gols_de_penalti'] = gols_de_penalti
-        estatisticas_time['finalizacoes_pra_fora'] = chute_pra_fora
-        estatisticas_time['finalizacoes_defendidas'] = chute_defendido
-        estatisticas_time['finalizacoes_na_trave'] = chute_na_trave
-        estatisticas_time['impedimentos'] = impedimento
-        estatisticas_time['faltas_sofridas'] = falta_sofrida + falta_s_p_cartao
-        estatisticas_time['falta_pra_cartao_sofrida'] = falta_s_p_cartao
-        # desempenho defensivo
-        estatisticas_time['cartao_amarelo'] = cartao_amarelo
-        estatisticas_time['cartao_vermelho'] = cartao_vermelho
-        estatisticas_time['roubadas_de_bola'] = rb
-        estatisticas_time['desarmes'] = desarmes
-        estatisticas_time['faltas_cometidas'] = falta_cometida + cartao_amarelo + cartao_vermelho
-        estatisticas_time['finalizacoes_sofridas'] = fin_sofrida + fin_s_perigosa + gol_sofrido
-        estatisticas_time['finalizacoes_perigosas_sofridas'] = fin_s_perigosa
-        estatisticas_time['gol_sofrido'] = gol_sofrido
-        # chances de gols/esperado
-        estatisticas_time['gols_esperados'] = gols_esperados
-        estatisticas_time['assists_esperados'] = assists_esperados
-        estatisticas_time['gols_assists_esperados'] = gols_esperados + assists_esperados
-        # progressao
-        estatisticas_time['progressao_solo'] = progressao_solo
-        estatisticas_time['passe_ql'] = passe_ql
-        estatisticas_time['passe_ql_recebido'] = passe_ql_recebido
-        # a cada 90min
-        estatisticas_time['gols_p_90min'] = round(((gols_normais + gols_de_penalti)/estatisticas_time['partidas_jogadas']),3)
-        estatisticas_time['assists_p_90min'] = round((assists/estatisticas_time['partidas_jogadas']),3)
-        estatisticas_time['gols_assists_p_90min'] = estatisticas_time['assists_p_90min'] + estatisticas_time['gols_p_90min']
-        estatisticas_time['gols_esperados_p_90min'] = round((gols_esperados/estatisticas_time['partidas_jogadas']),3)
-        estatisticas_time['assists_esperados_p_90min'] = round((assists_esperados/estatisticas_time['partidas_jogadas']),3)
-        estatisticas_time['gols_assists_esperados_p_90min'] = estatisticas_time['gols_esperados_p_90min'] + estatisticas_time['assists_esperados_p_90min']
-        estatisticas_time['finalizacoes_p_90min'] = round(((chute_pra_fora + chute_na_trave + chute_defendido + gols_normais + gols_de_penalti)/estatisticas_time['partidas_jogadas']),3)
-        estatisticas_time['faltas_sofrida_p_90min'] = round(((falta_sofrida + falta_s_p_cartao)/estatisticas_time['partidas_jogadas']),3)
-        estatisticas_time['cartoes_causados_p_90'] = round(((falta_s_p_cartao)/estatisticas_time['partidas_jogadas']),3)
-        estatisticas_time['cartoes_sofridos_p_90min'] = round(((cartao_amarelo + cartao_vermelho)/estatisticas_time['partidas_jogadas']),3)
-        estatisticas_time['rb_desarme_p_90min'] = round(((rb + desarmes)/estatisticas_time['partidas_jogadas']),3)
-        estatisticas_time['falta_cometida_p_90min'] = round(((falta_cometida + cartao_amarelo + cartao_vermelho)/estatisticas_time['partidas_jogadas']),3)
-        estatisticas_time['finalizacoes_sofridas_p_90min'] = round(((fin_sofrida)/estatisticas_time['partidas_jogadas']),3)
-        estatisticas_time['finalizacoes_perigosas_sofridas_p_90min'] = round(((fin_s_perigosa)/estatisticas_time['partidas_jogadas']),3)
-        estatisticas_time['gols_sofridos_p_90min'] = round(((gol_sofrido)/estatisticas_time['partidas_jogadas']),3)
-        # Adicione lógica para calcular partidas jogadas, se necessário
-
-        return Response(estatisticas_time)
+            confrontos = confrontos.filter(campeonato_id=campeonato_id)
+
+        campeonatos_ids = lista_de_ids(request.query_params, 'campeonatos')
+        times_ids = lista_de_ids(request.query_params, 'times')
+
+        # só as métricas pedidas em ?fields= (e suas dependências) são calculadas
+        plano = Plano(campos_pedidos(request.query_params, CAMPOS_TIME))
+        lances = plano.filtrar_lances(filtered_lances)
+
+        agrupar_por = agrupamento_pedido(request.query_params)
+        if agrupar_por and (campeonatos_ids or times_ids):
+            return Response({"detail": "Use group_by ou campeonatos/times, não os dois."}, status=status.HTTP_400_BAD_REQUEST)
+
+        janela = janela_de_minutos(request.GET)
+        tempo = janela['tempo'] if janela else None
+
+        if campeonatos_ids or times_ids:
+            # modo comparação: um resumo por campeonato/time, todos a partir da mesma contagem agrupada
+            return Response(self.comparar(plano, lances, confrontos, campeonatos_ids, times_ids, tempo))
+
+        if agrupar_por:
+            return Response(self.agrupar(plano, lances, confrontos, agrupar_por, tempo))
+
+        # contagem de lances por tipo em uma única consulta agrupada
+        contagens = contar_lances_por_tipo(lances) if plano.tipos_lance else None
+        partidas_jogadas = confrontos.count() if plano.precisa('partidas_jogadas', 'tempo_div_90') else 0
+
+        return Response(self.montar_estatisticas(plano, [contagens], [partidas_jogadas], fracao_da_partida=0.5 if tempo else 1)[0])
+
+    def comparar(self, plano, lances, confrontos, campeonatos_ids, times_ids, tempo):
+        # grupos (campeonato/time) de cada confronto do filtro
+        grupos_por_confronto = defaultdict(list)
+        for confronto_id, campeonato_id, time_a_id, time_b_id in confrontos.values_list('id', 'campeonato_id', 'time_a_id', 'time_b_id'):
+            if campeonato_id in campeonatos_ids:
+                grupos_por_confronto[confronto_id].append(('campeonatos', campeonato_id))
+            for time_id in {time_a_id, time_b_id}:
+                if time_id in times_ids:
+                    grupos_por_confronto[confronto_id].append(('times', time_id))
+
+        partidas = defaultdict(int)
+        for grupos in grupos_por_confronto.values():
+            for grupo in grupos:
+                partidas[grupo] += 1
+
+        # uma única contagem agrupada por confronto e tipo, somada em cada grupo do confronto
+        registro_tipos = registro()
+        contagens = defaultdict(lambda: ContagemPorTipo(registro_tipos))
+        lances_dos_grupos = lances.filter(confronto_id__in=list(grupos_por_confronto))
+        for confronto_id, contagens_confronto in contar_lances_por_confronto_e_tipo(lances_dos_grupos).items():
+            for grupo in grupos_por_confronto[confronto_id]:
+                contagens[grupo].somar(contagens_confronto)
+
+        grupos = [(chave, grupo_id) for chave, ids in (('campeonatos', campeonatos_ids), ('times', times_ids)) for grupo_id in ids]
+        # filtrado por tempo, cada partida vale meia partida, como no resumo de um único campeonato
+        estatisticas = self.montar_estatisticas(
+            plano, [contagens[grupo] for grupo in grupos], [partidas[grupo] for grupo in grupos], fracao_da_partida=0.5 if tempo else 1
+        )
+
+        resultado = {}
+        for (chave, grupo_id), estatisticas_grupo in zip(grupos, estatisticas):
+            resultado.setdefault(chave, []).append({'id': grupo_id, 'estatisticas': estatisticas_grupo})
+        return resultado
+
+    def agrupar(self, plano, lances, confrontos, agrupar_por, tempo):
+        # partidas de cada grupo; por tempo, cada confronto conta nos dois tempos (ou só no tempo filtrado)
+        valor_do_grupo = agrupador(confrontos, agrupar_por)
+        tempos = [tempo] if tempo else [1, 2]
+        partidas = defaultdict(int)
+        for confronto_id in confrontos.values_list('id', flat=True):
+            for grupo in {valor_do_grupo(confronto_id, numero) for numero in tempos}:
+                partidas[grupo] += 1
+
+        # uma única contagem agrupada por grupo e tipo
+        contagens = contar_lances_por_grupo_e_tipo(lances, agrupar_por) if plano.tipos_lance else {}
+
+        grupos = sorted(set(partidas) | set(contagens))
+        # um tempo vale meia partida nas métricas por 90 minutos, agrupado por tempo ou filtrado com ?tempo=
+        fracao = 0.5 if agrupar_por == 'tempo' or tempo else 1
+        estatisticas = self.montar_estatisticas(
+            plano, [contagens.get(grupo) for grupo in grupos], [partidas[grupo] for grupo in grupos], fracao_da_partida=fracao
+        )
+        return [{agrupar_por: grupo, 'estatisticas': estatisticas_grupo} for grupo, estatisticas_grupo in zip(grupos, estatisticas)]
+
+    def montar_estatisticas(self, plano, contagens, partidas_jogadas, fracao_da_partida=1):
+        # calcula as métricas de todos os grupos de uma vez (uma linha da matriz por grupo)
+        partidas = np.array(partidas_jogadas, dtype=np.int64)
+        contexto = {
+            # para o time, 90 minutos = uma partida
+            'tempo_div_90': partidas * fracao_da_partida,
+            'partidas_jogadas': partidas,
+        }
+        valores = {chave: coluna.tolist() for chave, coluna in plano.calcular(matriz_de_contagens(contagens, plano.tipos_lance), contexto).items()}
+
+        estatisticas = []
+        for linha in range(len(partidas_jogadas)):
+            estatisticas_time = {chave: coluna[linha] for chave, coluna in valores.items()}
+            if estatisticas_time.get('partidas_jogadas') == 0:
+                estatisticas_time['partidas_jogadas'] = 0.000000001
+            estatisticas.append(estatisticas_time)
+        return estatisticas
+
+
+class EstatisticasCacheView(APIView):
+    permission_classes = (IsAdminOrStaff,)
+
+    # acertos e falhas do cache dos endpoints de estatísticas
+    def get(self, request, *args, **kwargs):
+        return Response(cache_estatisticas.contadores(), status=status.HTTP_200_OK)
+
+    def delete(self, request, *args, **kwargs):
+        cache_estatisticas.zerar_contadores()
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AnaliseConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'analise'
+
+    def ready(self):
+        from analise import signals  # noqa: F401
@@ -0,0 +1,170 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+# Cache das respostas dos endpoints de estatísticas.
+# As chaves levam o endpoint, a versão do escopo consultado (confronto, campeonato ou todos) e um hash
+# dos parâmetros normalizados que o endpoint declara. Os signals incrementam as versões quando os dados
+# mudam, então uma resposta antiga nunca é reaproveitada e simplesmente expira.
+
+PREFIXO = 'estatisticas'
+# incrementar quando o formato ou o conteúdo das respostas mudar, para descartar respostas antigas
+VERSAO_RESPOSTAS = 5
+# parâmetros com vários valores (?times=1&times=2 ou ?times=2,1)
+PARAMETROS_LISTA = ['campeonatos', 'times', 'fields', 'janelas', 'tipo_lance']
+
+
+def _timeout():
+    return getattr(settings, 'ESTATISTICAS_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def _chave_versao(escopo, identificador=None):
+    if identificador is None:
+        return f'{PREFIXO}:versao:{escopo}'
+    return f'{PREFIXO}:versao:{escopo}:{identificador}'
+
+
+def _versao(chave):
+    # versões começam num valor baseado no relógio, assim uma versão perdida (cache reiniciado)
+    # nunca volta para um número já usado por respostas ainda guardadas
+    versao = cache.get(chave)
+    if versao is None:
+        versao = time.time_ns()
+        if not cache.add(chave, versao, timeout=None):
+            versao = cache.get(chave)
+    return versao
+
+
+def _incrementar_versao(chave):
+    try:
+        cache.incr(chave)
+    except ValueError:
+        cache.set(chave, time.time_ns(), timeout=None)
+
+
+def invalidar_confronto(confronto_id, campeonato_id=None):
+    """
+    Invalida as respostas que dependem do confronto: as do próprio jogo, as do campeonato e as sem filtro.
+    """
+    invalidar_confrontos({confronto_id: campeonato_id})
+
+
+def invalidar_confrontos(campeonatos_por_confronto):
+    """
+    Invalida vários confrontos de uma vez ({confronto_id: campeonato_id}),
+    incrementando cada campeonato e a versão geral uma única vez.
+    """
+    for confronto_id in campeonatos_por_confronto:
+        _incrementar_versao(_chave_versao('confronto', confronto_id))
+    for campeonato_id in set(campeonatos_por_confronto.values()) - {None}:
+        _incrementar_versao(_chave_versao('campeonato', campeonato_id))
+    if campeonatos_por_confronto:
+        _incrementar_versao(_chave_versao('todos'))
+
+
+def versoes_confrontos(confronto_ids):
+    """
+    Retorna a versão atual de cada confronto, {confronto_id: versao}, lendo todas do cache de uma vez.
+    """
+    chaves = {confronto_id: _chave_versao('confronto', confronto_id) for confronto_id in confronto_ids}
+    guardadas = cache.get_many(list(chaves.values()))
+    return {
+        confronto_id: guardadas[chave] if chave in guardadas else _versao(chave)
+        for confronto_id, chave in chaves.items()
+    }
+
+
+def invalidar_tudo():
+    """
+    Invalida todas as respostas (jogadores e tipos de lance aparecem em qualquer filtro).
+    """
+    _incrementar_versao(_chave_versao('base'))
+
+
+def versao_dados(campeonato_id=None, jogo_id=None):
+    """
+    Versão dos dados de um escopo (jogo, campeonato ou todos), para chaves de cache de valores derivados deles.
+    """
+    if jogo_id:
+        versao_escopo = _versao(_chave_versao('confronto', jogo_id))
+    elif campeonato_id:
+        versao_escopo = _versao(_chave_versao('campeonato', campeonato_id))
+    else:
+        versao_escopo = _versao(_chave_versao('todos'))
+    return f"{_versao(_chave_versao('base'))}.{versao_escopo}"
+
+
+def _normalizar(query_params, nome):
+    if nome in PARAMETROS_LISTA:
+        valores = ','.join(query_params.getlist(nome)).split(',')
+    else:
+        # como no LanceFilter, vale o último valor informado
+        valores = [query_params.get(nome) or '']
+
+    normalizados = set()
+    for valor in valores:
+        valor = valor.strip()
+        if valor:
+            normalizados.add(str(int(valor)) if valor.isdigit() else valor)
+    return ','.join(sorted(normalizados))
+
+
+def chave_resposta(endpoint, query_params, parametros):
+    """
+    Monta a chave de cache da resposta a partir dos parâmetros que o endpoint usa e da versão do escopo consultado.
+    Os parâmetros entram como hash, para a chave não passar do limite de tamanho do cache.
+    """
+    valores = {nome: _normalizar(query_params, nome) for nome in parametros}
+    filtro = '&'.join(f'{nome}={valor}' for nome, valor in sorted(valores.items()) if valor)
+
+    versao = versao_dados(valores.get('campeonato'), valores.get('jogo') or valores.get('confronto_id'))
+    return f"{PREFIXO}:{endpoint}:r{VERSAO_RESPOSTAS}:v{versao}:{hashlib.sha1(filtro.encode()).hexdigest()}"
+
+
+def _contar(resultado):
+    chave = f'{PREFIXO}:contador:{resultado}'
+    if not cache.add(chave, 1, timeout=None):
+        try:
+            cache.incr(chave)
+        except ValueError:
+            cache.set(chave, 1, timeout=None)
+
+
+def contadores():
+    """
+    Retorna os acertos e falhas do cache de estatísticas desde o último reset.
+    """
+    return {
+        'acertos': cache.get(f'{PREFIXO}:contador:acertos', 0),
+        'falhas': cache.get(f'{PREFIXO}:contador:falhas', 0),
+    }
+
+
+def zerar_contadores():
+    cache.delete_many([f'{PREFIXO}:contador:acertos', f'{PREFIXO}:contador:falhas'])
+
+
+def resposta_em_cache(endpoint, request, calcular, parametros):
+    """
+    Devolve a resposta guardada para o filtro da requisição ou calcula e guarda uma nova.
+    parametros: os parâmetros da query que mudam a resposta do endpoint (os demais não entram na chave).
+    Só respostas 200 são guardadas. O header X-Cache indica HIT ou MISS.
+    """
+    chave = chave_resposta(endpoint, request.query_params, parametros)
+    dados = cache.get(chave)
+
+    if dados is not None:
+        _contar('acertos')
+        response = Response(dados)
+        response['X-Cache'] = 'HIT'
+        return response
+
+    _contar('falhas')
+    response = calcular(request)
+    if response.status_code == status.HTTP_200_OK:
+        cache.set(chave, response.data, timeout=_timeout())
+    response['X-Cache'] = 'MISS'
+    return response
@@ -0,0 +1,107 @@
+import numpy as np
+
+# Geometria do campo usada pelas coordenadas dos lances (em pixels do campo desenhado no frontend).
+# O time ataca em direção a x = 0: o gol adversário fica em x = 0 e o nosso em x = COMPRIMENTO.
+
+COMPRIMENTO = 600
+LARGURA = 450
+MEIO_CAMPO = COMPRIMENTO / 2
+
+
+def coordenadas(lances, campos=('coordenadaX', 'coordenadaY')):
+    """
+    Lê as colunas de coordenadas dos lances em uma única consulta e converte tudo para float de uma vez.
+    Retorna uma matriz (lances x campos), com NaN onde a coordenada não foi marcada.
+    """
+    linhas = list(lances.order_by().values_list(*campos))
+    if not linhas:
+        return np.zeros((0, len(campos)))
+    return np.array(linhas, dtype=np.float64)
+
+
+def histograma(xs, ys, colunas, linhas):
+    """
+    Conta os pontos em uma grade de colunas x linhas sobre o campo inteiro.
+    Pontos marcados um pouco fora do desenho entram na célula da borda.
+    Retorna a matriz (linhas x colunas) de contagens.
+    """
+    validos = ~(np.isnan(xs) | np.isnan(ys))
+    xs = np.clip(xs[validos], 0, COMPRIMENTO)
+    ys = np.clip(ys[validos], 0, LARGURA)
+    contagens, _, _ = np.histogram2d(ys, xs, bins=[linhas, colunas], range=[[0, LARGURA], [0, COMPRIMENTO]])
+    return contagens.astype(np.int64)
+
+
+# Zonas do campo: grade de 6 faixas no comprimento x 3 corredores na largura, numeradas de 1 a 18
+# no sentido do ataque. As zonas 1-3 são a faixa junto ao nosso gol e as 16-18 a faixa junto ao gol adversário;
+# em cada faixa o corredor segue o eixo y (1 = y menor).
+FAIXAS = 6
+CORREDORES = 3
+ZONAS = FAIXAS * CORREDORES
+# zonas do nosso lado do campo (coordenadaX > MEIO_CAMPO) e do lado do ataque (coordenadaX <= MEIO_CAMPO)
+ZONAS_DEFESA = list(range(1, ZONAS // 2 + 1))
+ZONAS_ATAQUE = list(range(ZONAS // 2 + 1, ZONAS + 1))
+
+
+def zonas(xs, ys):
+    """
+    Zona (1 a 18) de cada ponto, calculada de uma vez para os vetores de coordenadas.
+    As faixas são fechadas à direita, como o filtro de campo (x <= 300 é ataque), e pontos marcados
+    um pouco fora do desenho ficam na zona da borda. Pontos sem coordenada ficam com 0.
+    """
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    faixa_x = np.clip(np.ceil(np.nan_to_num(xs) / (COMPRIMENTO / FAIXAS)) - 1, 0, FAIXAS - 1)
+    corredor = np.clip(np.ceil(np.nan_to_num(ys) / (LARGURA / CORREDORES)) - 1, 0, CORREDORES - 1)
+    resultado = ((FAIXAS - 1 - faixa_x) * CORREDORES + corredor + 1).astype(np.int64)
+    resultado[np.isnan(xs) | np.isnan(ys)] = 0
+    return resultado
+
+
+def zona(x, y):
+    """
+    Zona (1 a 18) de um único ponto, ou None se faltar coordenada.
+    """
+    if x is None or y is None:
+        return None
+    return int(zonas([float(x)], [float(y)])[0])
+
+
+# Terço final e grande área (proporções de um campo de 105 x 68 m) do lado do ataque, junto a x = 0
+TERCO_FINAL = COMPRIMENTO / 3
+AREA_PROFUNDIDADE = COMPRIMENTO * 16.5 / 105
+AREA_LARGURA = LARGURA * 40.32 / 68
+# setores de direção: 8 setores de 45 graus, o primeiro centrado na direção do ataque (x diminuindo),
+# girando no sentido de y crescente
+SETORES = 8
+
+
+def na_area(xs, ys):
+    return (xs <= AREA_PROFUNDIDADE) & (np.abs(ys - LARGURA / 2) <= AREA_LARGURA / 2)
+
+
+def metricas_de_progressao(xs, ys, xs_final, ys_final, grupos, total_grupos):
+    """
+    Soma, para cada grupo, as métricas de progressão dos lances com coordenada inicial e final,
+    tudo sobre os vetores de coordenadas de uma vez.
+    grupos: índice do grupo (0 a total_grupos - 1) de cada lance.
+    Retorna {'acoes', 'distancia_progressiva', 'entradas_terco_final', 'entradas_area', 'direcoes'},
+    um vetor por métrica (e uma matriz grupos x SETORES nas direções).
+    """
+    # distância ganha em direção ao gol adversário (só o que avança conta)
+    avanco = np.maximum(xs - xs_final, 0)
+    entrou_terco_final = (xs > TERCO_FINAL) & (xs_final <= TERCO_FINAL)
+    entrou_area = ~na_area(xs, ys) & na_area(xs_final, ys_final)
+
+    angulo = np.arctan2(ys_final - ys, xs - xs_final)
+    setor = np.floor((angulo + np.pi / SETORES) / (2 * np.pi / SETORES)).astype(np.int64) % SETORES
+    direcoes = np.zeros((total_grupos, SETORES), dtype=np.int64)
+    np.add.at(direcoes, (grupos, setor), 1)
+
+    return {
+        'acoes': np.bincount(grupos, minlength=total_grupos),
+        'distancia_progressiva': np.round(np.bincount(grupos, weights=avanco, minlength=total_grupos), 2),
+        'entradas_terco_final': np.bincount(grupos, weights=entrou_terco_final, minlength=total_grupos).astype(np.int64),
+        'entradas_area': np.bincount(grupos, weights=entrou_area, minlength=total_grupos).astype(np.int64),
+        'direcoes': direcoes,
+    }
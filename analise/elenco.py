@@ -0,0 +1,83 @@
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
+from analise import models
+from analise.cache_estatisticas import versao_dados
+from analise.em_campo import ADVERSARIO_ID, ordem_da_posicao
+
+# Disponibilidade do elenco em cada confronto: titulares, substitutos que entraram, reservas e jogadores
+# disponíveis para a escalação, todos ordenados por posição. Calculada com uma única consulta sobre os jogadores
+# e guardada no cache com a versão do confronto, que os signals incrementam quando a escalação ou as
+# substituições mudam.
+
+PREFIXO = 'elenco'
+
+
+class ElencoConfronto:
+    """
+    jogadores: {jogador_id: Jogador} de todo o elenco, ordenado por posição.
+    titulares_ids e substitutos_ids: ids dos titulares e dos que entraram por substituição.
+    existe: se o confronto existe; tem_escalacao: se o confronto já tem escalação.
+    """
+
+    def __init__(self, jogadores, titulares, substitutos, existe, tem_escalacao):
+        self.jogadores = jogadores
+        self.titulares_ids = frozenset(titulares)
+        self.substitutos_ids = frozenset(substitutos)
+        self.existe = existe
+        self.tem_escalacao = tem_escalacao
+
+    def _filtrar(self, condicao):
+        return [jogador for jogador_id, jogador in self.jogadores.items() if condicao(jogador_id)]
+
+    def no_confronto(self):
+        # titulares e os que entraram durante a partida
+        return self._filtrar(lambda jogador_id: jogador_id in self.titulares_ids or jogador_id in self.substitutos_ids)
+
+    def reservas(self):
+        # quem ainda não entrou em campo, sem o Adversário
+        return self._filtrar(
+            lambda jogador_id: jogador_id not in self.titulares_ids and jogador_id not in self.substitutos_ids and jogador_id != ADVERSARIO_ID
+        )
+
+    def disponiveis(self):
+        # quem pode entrar na escalação, sem o Adversário
+        return self._filtrar(lambda jogador_id: jogador_id not in self.titulares_ids and jogador_id != ADVERSARIO_ID)
+
+    def nao_titulares(self):
+        return self._filtrar(lambda jogador_id: jogador_id not in self.titulares_ids)
+
+
+def montar_elenco(confronto_id):
+    """
+    Monta o elenco do confronto em duas consultas: o confronto (com a escalação) e os jogadores
+    marcados como titular e substituto.
+    """
+    tem_escalacao = models.Confronto.objects.filter(id=confronto_id).annotate(
+        tem_escalacao=Exists(models.Escalacao.objects.filter(confronto_id=OuterRef('pk')))
+    ).values_list('tem_escalacao', flat=True).first()
+
+    jogadores = models.Jogador.objects.annotate(
+        titular=Exists(models.Escalacao.jogadores.through.objects.filter(escalacao__confronto_id=confronto_id, jogador_id=OuterRef('pk'))),
+        substituto=Exists(models.Substituicao.objects.filter(confronto_id=confronto_id, jogador_entrada_id=OuterRef('pk'))),
+    )
+    jogadores = sorted(jogadores, key=lambda jogador: (ordem_da_posicao(jogador.posicao), jogador.id))
+
+    return ElencoConfronto(
+        {jogador.id: jogador for jogador in jogadores},
+        [jogador.id for jogador in jogadores if jogador.titular],
+        [jogador.id for jogador in jogadores if jogador.substituto],
+        existe=tem_escalacao is not None,
+        tem_escalacao=bool(tem_escalacao),
+    )
+
+
+def elenco_do_confronto(confronto_id):
+    """
+    Elenco do confronto, do cache enquanto a escalação, as substituições e o cadastro de jogadores não mudarem.
+    """
+    chave = f'{PREFIXO}:{confronto_id}:v{versao_dados(jogo_id=confronto_id)}'
+    elenco = cache.get(chave)
+    if elenco is None:
+        elenco = montar_elenco(confronto_id)
+        cache.set(chave, elenco, timeout=None)
+    return elenco
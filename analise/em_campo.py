@@ -0,0 +1,160 @@
+from django.core.cache import cache
+from django.db.models import Case, When, Value, IntegerField, F
+from analise import models
+from analise.cache_estatisticas import versao_dados
+from analise.tipos_lance import registro
+
+# Estado de quem está em campo em cada confronto: a escalação inicial com as substituições e as expulsões
+# reaplicadas na ordem da partida. O estado fica no cache com a versão do confronto, que os signals
+# incrementam quando lances, substituições ou a escalação mudam.
+
+PREFIXO = 'em_campo'
+# jogador cadastrado para marcar os lances do time adversário
+ADVERSARIO_ID = 16
+ORDEM_POSICOES = ['Goleiro', 'Lateral', 'Zagueiro', 'Volante', 'Meia', 'Ponta', 'Atacante']
+
+# tipos de evento, na ordem em que são aplicados quando caem no mesmo minuto
+SUBSTITUICAO, GOL, GOL_SOFRIDO, CARTAO_AMARELO, CARTAO_VERMELHO = range(5)
+NOMES_EVENTOS = {
+    SUBSTITUICAO: 'substituicao',
+    GOL: 'gol',
+    GOL_SOFRIDO: 'gol_sofrido',
+    CARTAO_AMARELO: 'cartao_amarelo',
+    CARTAO_VERMELHO: 'cartao_vermelho',
+}
+# tipos de lance que geram cada evento
+TIPOS_LANCE_EVENTOS = {
+    GOL: ['Gol', 'Gol de Penalti'],
+    GOL_SOFRIDO: ['Gol sofrido'],
+    CARTAO_AMARELO: ['Cartão Amarelo'],
+    CARTAO_VERMELHO: ['Cartão Vermelho'],
+}
+
+
+def ordem_da_posicao(posicao):
+    # posições desconhecidas vão para o fim
+    if posicao in ORDEM_POSICOES:
+        return ORDEM_POSICOES.index(posicao)
+    return len(ORDEM_POSICOES)
+
+
+class EstadoEmCampo:
+    """
+    titulares: jogadores da escalação inicial.
+    em_campo: jogadores em campo, na ordem em que entraram (titulares primeiro).
+    sairam: jogadores substituídos; expulsos: jogadores que receberam cartão vermelho.
+    """
+
+    def __init__(self, titulares):
+        self.titulares = frozenset(titulares)
+        self.em_campo = dict.fromkeys(titulares)
+        self.sairam = set()
+        self.expulsos = set()
+
+    def aplicar(self, tipo, jogador_entrada_id, jogador_id):
+        # jogador_id é quem sai na substituição ou o autor do lance; os demais eventos não mudam quem está em campo
+        if tipo == CARTAO_VERMELHO:
+            self.em_campo.pop(jogador_id, None)
+            self.expulsos.add(jogador_id)
+        elif tipo == SUBSTITUICAO:
+            self.em_campo.pop(jogador_id, None)
+            self.sairam.add(jogador_id)
+            # expulso não volta a campo
+            if jogador_entrada_id is not None and jogador_entrada_id not in self.expulsos:
+                self.em_campo[jogador_entrada_id] = None
+
+    def jogadores(self):
+        return list(self.em_campo)
+
+    def ordem(self, jogador_id, posicao):
+        # em cada posição, titulares antes dos que entraram; jogadores de fora do estado (ex.: Adversário) por último
+        if jogador_id not in self.em_campo:
+            return (ordem_da_posicao(posicao), True, float('inf'))
+        return (ordem_da_posicao(posicao), jogador_id not in self.titulares, jogador_id)
+
+
+def _colunas(eventos, metade, tipo, jogador_entrada, jogador):
+    # mesmas colunas, na mesma ordem, para as substituições e os lances caberem num único UNION
+    return eventos.order_by().annotate(
+        _metade=metade, _minuto=F('minuto'), _tipo=tipo, _ordem=F('id'),
+        _jogador_entrada=jogador_entrada, _jogador=jogador,
+    ).values_list('_metade', '_minuto', '_tipo', '_ordem', '_jogador_entrada', '_jogador')
+
+
+def eventos_do_confronto(confronto_id, tipos=(CARTAO_VERMELHO,)):
+    """
+    Substituições e lances dos tipos de evento informados em uma única consulta, ordenados como aconteceram na partida.
+    Retorna uma lista de (metade, minuto, tipo, ordem, jogador_entrada_id, jogador_id),
+    com jogador_id sendo quem sai na substituição ou o autor do lance.
+    """
+    eventos = _colunas(
+        models.Substituicao.objects.filter(confronto_id=confronto_id),
+        Case(When(primeiro_tempo=True, then=Value(1)), default=Value(2)),
+        Value(SUBSTITUICAO), F('jogador_entrada_id'), F('jogador_saida_id'),
+    )
+
+    registro_tipos = registro()
+    tipos_lance = {
+        tipo: [tipo_lance_id for nome in TIPOS_LANCE_EVENTOS[tipo] for tipo_lance_id in registro_tipos.ids_do_tipo(nome, obrigatorio=False)]
+        for tipo in tipos
+    }
+    casos = [When(tipo_lance_id__in=ids, then=Value(tipo)) for tipo, ids in tipos_lance.items() if ids]
+    if casos:
+        lances = _colunas(
+            models.Lance.objects.filter(confronto_id=confronto_id, tipo_lance_id__in=[i for ids in tipos_lance.values() for i in ids]),
+            # lances sem tempo definido (None ou 0) contam como primeiro tempo
+            Case(When(tempo=2, then=Value(2)), default=Value(1)),
+            Case(*casos), Value(None, output_field=IntegerField()), F('jogador_id'),
+        )
+        eventos = eventos.union(lances, all=True)
+    return sorted(eventos)
+
+
+def titulares_do_confronto(confronto_id):
+    """
+    Titulares da escalação do confronto, ou None se o confronto ainda não tem escalação.
+    """
+    # o LEFT JOIN devolve uma linha com None quando a escalação existe mas está vazia
+    linhas = list(models.Escalacao.objects.filter(confronto_id=confronto_id).order_by('jogadores').values_list('jogadores', flat=True))
+    if not linhas:
+        return None
+    return [jogador_id for jogador_id in linhas if jogador_id is not None]
+
+
+def _chave(confronto_id):
+    return f'{PREFIXO}:{confronto_id}:v{versao_dados(jogo_id=confronto_id)}'
+
+
+def estado_em_campo(confronto_id):
+    """
+    Estado de quem está em campo no último evento registrado do confronto, em no máximo duas consultas.
+    Retorna um EstadoEmCampo, ou None se o confronto não tem escalação.
+    """
+    chave = _chave(confronto_id)
+    guardado = cache.get(chave)
+    if guardado is not None:
+        return guardado or None
+
+    titulares = titulares_do_confronto(confronto_id)
+    estado = None
+    if titulares is not None:
+        estado = EstadoEmCampo(titulares)
+        for _, _, tipo, _, jogador_entrada_id, jogador_id in eventos_do_confronto(confronto_id):
+            estado.aplicar(tipo, jogador_entrada_id, jogador_id)
+
+    # False marca "sem escalação" no cache, já que None é o valor de chave ausente
+    cache.set(chave, estado or False, timeout=None)
+    return estado
+
+
+def jogadores_em_campo(confronto_id, incluir=()):
+    """
+    Jogadores em campo no confronto, ordenados por posição, com os jogadores de incluir
+    (ex.: o Adversário) acrescentados à lista. Retorna None se o confronto não tem escalação.
+    """
+    estado = estado_em_campo(confronto_id)
+    if estado is None:
+        return None
+
+    jogadores = models.Jogador.objects.in_bulk(estado.jogadores() + list(incluir))
+    return sorted(jogadores.values(), key=lambda jogador: estado.ordem(jogador.id, jogador.posicao))
@@ -0,0 +1,495 @@
+from collections import defaultdict
+import heapq
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+from django.db.models.functions import TruncMonth
+from analise import models
+from analise.cache_estatisticas import versao_dados
+from analise.minutos import calcular_periodos, dividir_por_tempo, minutos_na_janela
+from analise.indice_lances import contar_lances_na_janela
+from analise.metricas import CAMPOS_SEMELHANCA, Plano, matriz_de_contagens
+from analise.tipos_lance import ContagemPorTipo, registro
+
+
+# dimensões aceitas em ?group_by=, como expressões sobre Lance ou EstatisticaJogadorConfronto
+# (os dois têm confronto e tempo; lances sem tempo definido contam como primeiro tempo)
+AGRUPAMENTOS = {
+    'campeonato': F('confronto__campeonato_id'),
+    'tempo': Case(When(tempo=2, then=Value(2)), default=Value(1)),
+    'confronto': F('confronto_id'),
+    'mes': TruncMonth('confronto__ano'),
+}
+
+
+def _valor_do_grupo(agrupar_por, valor):
+    if agrupar_por == 'mes':
+        return valor.strftime('%Y-%m')
+    return valor
+
+
+def agrupador(confrontos, agrupar_por):
+    """
+    Retorna uma função (confronto_id, tempo) -> valor do grupo, para agrupar dados que já vêm por confronto e tempo.
+    """
+    if agrupar_por == 'tempo':
+        return lambda confronto_id, tempo: tempo
+    if agrupar_por == 'confronto':
+        return lambda confronto_id, tempo: confronto_id
+
+    campo = 'campeonato_id' if agrupar_por == 'campeonato' else 'ano'
+    valores = {confronto_id: _valor_do_grupo(agrupar_por, valor) for confronto_id, valor in confrontos.values_list('id', campo)}
+    return lambda confronto_id, tempo: valores[confronto_id]
+
+
+def contar_lances_por_grupo_e_tipo(lances, agrupar_por):
+    """
+    Conta os lances de cada grupo (campeonato, tempo, confronto ou mês) por tipo de lance com uma única consulta agrupada.
+    Retorna {valor_do_grupo: ContagemPorTipo}.
+    """
+    registro_tipos = registro()
+    contagens = defaultdict(lambda: ContagemPorTipo(registro_tipos))
+
+    agrupado = (
+        lances.order_by()
+        .annotate(grupo=AGRUPAMENTOS[agrupar_por])
+        .values_list('grupo', 'tipo_lance_id')
+        .annotate(total=Count('id'))
+    )
+    for grupo, tipo_lance_id, total in agrupado:
+        contagens[_valor_do_grupo(agrupar_por, grupo)].adicionar(tipo_lance_id, total)
+
+    return contagens
+
+
+def contar_lances_por_tipo(lances):
+    """
+    Conta os lances por tipo de lance com uma única consulta agrupada.
+    Retorna uma ContagemPorTipo.
+    """
+    contagens = ContagemPorTipo(registro())
+    for tipo_lance_id, total in lances.order_by().values_list('tipo_lance_id').annotate(total=Count('id')):
+        contagens.adicionar(tipo_lance_id, total)
+    return contagens
+
+
+def contar_lances_por_confronto_e_tipo(lances):
+    """
+    Conta os lances de cada confronto por tipo de lance com uma única consulta agrupada.
+    Retorna {confronto_id: ContagemPorTipo}.
+    """
+    registro_tipos = registro()
+    contagens = defaultdict(lambda: ContagemPorTipo(registro_tipos))
+
+    agrupado = (
+        lances.order_by()
+        .values_list('confronto_id', 'tipo_lance_id')
+        .annotate(total=Count('id'))
+    )
+    for confronto_id, tipo_lance_id, total in agrupado:
+        contagens[confronto_id].adicionar(tipo_lance_id, total)
+
+    return contagens
+
+
+########## métricas por jogador ##########
+
+def contexto_jogadores(partidas_titulares, partidas_jogadas, minutos):
+    """
+    Vetores de contexto das métricas de jogador (um valor por linha) a partir das partidas e minutos.
+    """
+    minutos = np.asarray(minutos, dtype=np.float64)
+    return {
+        'partidas_titulares': partidas_titulares,
+        'partidas_jogadas': partidas_jogadas,
+        'minutos_totais': minutos.astype(np.int64),
+        'media_minutos': np.round(np.divide(minutos, partidas_jogadas, out=np.zeros(len(minutos)), where=partidas_jogadas > 0), 2),
+        'tempo_div_90': minutos / 90,
+    }
+
+
+def calcular_metricas_jogadores(ids, plano, lances_por_jogador, partidas_titulares, partidas_substituido, minutos_por_jogador):
+    """
+    Calcula as métricas do plano (totais combinados, médias e taxas por 90 minutos) dos jogadores informados
+    de uma vez, sobre a matriz jogador x tipo de lance e os vetores de minutos e partidas.
+    Retorna {metrica: [valor de cada jogador]}, na ordem de ids.
+    """
+    matriz = matriz_de_contagens([lances_por_jogador.get(jogador_id) for jogador_id in ids], plano.tipos_lance)
+
+    titulares = np.array([partidas_titulares.get(jogador_id, 0) for jogador_id in ids], dtype=np.int64)
+    partidas_jogadas = titulares + np.array([partidas_substituido.get(jogador_id, 0) for jogador_id in ids], dtype=np.int64)
+    minutos = np.array([minutos_por_jogador.get(jogador_id, 0) for jogador_id in ids], dtype=np.float64)
+
+    contexto = contexto_jogadores(titulares, partidas_jogadas, minutos)
+
+    # converte as colunas para tipos nativos de uma vez só
+    return {chave: coluna.tolist() for chave, coluna in plano.calcular(matriz, contexto).items()}
+
+
+def montar_estatisticas_jogadores(jogadores, plano, lances_por_jogador, partidas_titulares, partidas_substituido, minutos_por_jogador):
+    """
+    Métricas do plano de todos os jogadores (ver calcular_metricas_jogadores), com um dicionário por jogador.
+    Retorna a lista de dicionários da resposta de EstatisticasJogadoresView.
+    """
+    jogadores = list(jogadores)
+    valores = calcular_metricas_jogadores(
+        [jogador.id for jogador in jogadores], plano, lances_por_jogador, partidas_titulares, partidas_substituido, minutos_por_jogador
+    )
+
+    estatisticas = []
+    for linha, jogador in enumerate(jogadores):
+        estatistica = {'nome': jogador.nome, 'posicao': jogador.posicao}
+        for chave, coluna in valores.items():
+            estatistica[chave] = coluna[linha]
+        estatisticas.append(estatistica)
+
+    return estatisticas
+
+
+def ranquear(valores, n):
+    """
+    Seleciona os índices dos n maiores valores com um heap limitado,
+    mais os empatados com o n-ésimo. Empatados dividem a colocação (1, 2, 2, 4).
+    Retorna [(colocacao, indice)] em ordem.
+    """
+    selecionados = heapq.nlargest(n, range(len(valores)), key=valores.__getitem__)
+    if not selecionados:
+        return []
+
+    corte = valores[selecionados[-1]]
+    ja_selecionados = set(selecionados)
+    selecionados += [indice for indice, valor in enumerate(valores) if valor == corte and indice not in ja_selecionados]
+
+    ranking = []
+    for posicao, indice in enumerate(selecionados):
+        if posicao and valores[indice] == valores[selecionados[posicao - 1]]:
+            colocacao = ranking[-1][0]
+        else:
+            colocacao = posicao + 1
+        ranking.append((colocacao, indice))
+    return ranking
+
+
+def percentis(matriz):
+    """
+    Percentil de cada valor da matriz (jogadores x métricas) dentro da sua coluna:
+    a porcentagem de jogadores abaixo, com empatados contando pela metade.
+    """
+    matriz = np.asarray(matriz, dtype=np.float64)
+    if not len(matriz):
+        return matriz
+
+    ordenada = np.sort(matriz, axis=0)
+    resultado = np.empty_like(matriz)
+    for coluna in range(matriz.shape[1]):
+        abaixo = np.searchsorted(ordenada[:, coluna], matriz[:, coluna], side='left')
+        ate = np.searchsorted(ordenada[:, coluna], matriz[:, coluna], side='right')
+        resultado[:, coluna] = (abaixo + (ate - abaixo) / 2) / len(matriz) * 100
+    return np.round(resultado, 1)
+
+
+def calcular_forma(plano, janelas, campeonato_id=None, jogador_id=None):
+    """
+    Calcula as métricas do plano nas últimas N partidas de cada jogador, para cada N em janelas,
+    com as partidas em ordem de Confronto.ano. Lê uma linha por jogador e partida jogada das estatísticas
+    pré-agregadas e soma cada janela pela diferença de somas acumuladas, para todos os jogadores de uma vez.
+    Retorna (jogador_ids, partidas_por_jogador, {janela: {chave na resposta: vetor}}).
+    """
+    campos_por_tipo_lance = models.EstatisticaJogadorConfronto.CAMPOS_POR_TIPO_LANCE
+    campos = {tipo: campos_por_tipo_lance[tipo] for tipo in plano.tipos_lance if tipo in campos_por_tipo_lance}
+
+    linhas = models.EstatisticaJogadorConfronto.objects.all()
+    if campeonato_id:
+        linhas = linhas.filter(confronto__campeonato_id=campeonato_id)
+    if jogador_id:
+        linhas = linhas.filter(jogador_id=jogador_id)
+
+    agrupado = list(
+        linhas.order_by()
+        .values_list('jogador_id', 'confronto_id')
+        .annotate(
+            total_minutos=Sum('minutos'),
+            total_titular=Count('id', filter=Q(titular=True)),
+            **{'total_' + campo: Sum(campo) for campo in campos.values()},
+        )
+        .filter(total_minutos__gt=0)
+        .order_by('jogador_id', 'confronto__ano', 'confronto_id')
+    )
+    if not agrupado:
+        return [], [], {janela: {} for janela in janelas}
+
+    # dados: confronto, minutos, titular e os contadores dos tipos de lance que têm campo
+    dados = np.array([linha[1:] for linha in agrupado], dtype=np.int64)
+    jogadores_das_linhas = np.array([linha[0] for linha in agrupado])
+    colunas = {tipo: 3 + indice for indice, tipo in enumerate(campos)}
+
+    # matriz: minutos, titular e um contador por tipo de lance do plano
+    matriz = np.zeros((len(dados), len(plano.tipos_lance) + 2), dtype=np.int64)
+    matriz[:, 0] = dados[:, 1]
+    matriz[:, 1] = dados[:, 2] > 0
+    for coluna, tipo in enumerate(plano.tipos_lance):
+        if tipo in colunas:
+            matriz[:, 2 + coluna] = dados[:, colunas[tipo]]
+
+    # as linhas de cada jogador são contíguas: [inicio, fim) de cada um nas somas acumuladas
+    jogador_ids, inicios, partidas = np.unique(jogadores_das_linhas, return_index=True, return_counts=True)
+    fins = inicios + partidas
+    acumulado = np.vstack([np.zeros((1, matriz.shape[1]), dtype=np.int64), np.cumsum(matriz, axis=0)])
+
+    resultado = {}
+    for janela in janelas:
+        comecos = np.maximum(inicios, fins - janela)
+        soma = acumulado[fins] - acumulado[comecos]
+        contexto = contexto_jogadores(soma[:, 1], fins - comecos, soma[:, 0])
+        resultado[janela] = plano.calcular(soma[:, 2:], contexto)
+
+    return jogador_ids.tolist(), partidas.tolist(), resultado
+
+
+########## jogadores semelhantes ##########
+
+def perfis_por_90(campeonato_id=None):
+    """
+    Monta a matriz de perfis (jogadores x métricas de CAMPOS_SEMELHANCA) dos jogadores com minutos no campeonato,
+    com cada métrica normalizada (média 0, desvio 1). Fica no cache com a versão dos dados do campeonato.
+    Retorna {'ids', 'nomes', 'posicoes', 'minutos', 'vetores'}.
+    """
+    chave = f"semelhantes:{campeonato_id or 'todos'}:v{versao_dados(campeonato_id)}"
+    perfis = cache.get(chave)
+    if perfis is not None:
+        return perfis
+
+    plano = Plano(CAMPOS_SEMELHANCA)
+    lances_por_jogador, _, _, minutos_por_jogador = ler_estatisticas_materializadas(campeonato_id=campeonato_id, tipos_lance=plano.tipos_lance)
+    jogadores = list(
+        models.Jogador.objects.exclude(id=16)
+        .filter(id__in=[jogador_id for jogador_id, minutos in minutos_por_jogador.items() if minutos])
+        .order_by('id')
+    )
+    ids = [jogador.id for jogador in jogadores]
+
+    minutos = np.array([minutos_por_jogador[jogador_id] for jogador_id in ids], dtype=np.float64)
+    matriz = matriz_de_contagens([lances_por_jogador.get(jogador_id) for jogador_id in ids], plano.tipos_lance)
+    valores = plano.calcular(matriz, {'tempo_div_90': minutos / 90})
+    vetores = np.column_stack([valores[chave] for chave, _ in CAMPOS_SEMELHANCA]) if ids else np.zeros((0, len(CAMPOS_SEMELHANCA)))
+
+    # métricas sem variação (desvio 0) não distinguem ninguém e ficam zeradas
+    desvio = vetores.std(axis=0)
+    vetores = np.divide(vetores - vetores.mean(axis=0), desvio, out=np.zeros_like(vetores), where=desvio > 0)
+
+    perfis = {
+        'ids': ids,
+        'nomes': [jogador.nome for jogador in jogadores],
+        'posicoes': [jogador.posicao for jogador in jogadores],
+        'minutos': minutos,
+        'vetores': vetores,
+    }
+    cache.set(chave, perfis, timeout=None)
+    return perfis
+
+
+def mais_proximos(vetores, linha, k, candidatos):
+    """
+    Retorna [(indice, distancia)] das k linhas candidatas (máscara booleana) mais próximas da linha informada,
+    pela distância euclidiana calculada de uma vez para todas as linhas.
+    """
+    distancias = np.sqrt(((vetores - vetores[linha]) ** 2).sum(axis=1))
+    candidatos = candidatos.copy()
+    candidatos[linha] = False
+    indices = np.flatnonzero(candidatos)
+    if len(indices) > k:
+        indices = indices[np.argpartition(distancias[indices], k)[:k]]
+    indices = indices[np.argsort(distancias[indices], kind='stable')]
+    return [(indice, distancias[indice]) for indice in indices.tolist()]
+
+
+########## estatísticas materializadas (EstatisticaJogadorConfronto) ##########
+
+def _calcular_linhas(confrontos):
+    # monta as linhas de EstatisticaJogadorConfronto (jogador x confronto x tempo) dos confrontos informados
+    registro_tipos = registro()
+    campos_por_tipo_lance_id = {
+        tipo_lance_id: campo
+        for nome, campo in models.EstatisticaJogadorConfronto.CAMPOS_POR_TIPO_LANCE.items()
+        for tipo_lance_id in registro_tipos.ids_do_tipo(nome, obrigatorio=False)
+    }
+    acrescimos = dict(confrontos.values_list('id', 'acrescimo1tempo'))
+
+    titulares = set(
+        models.Escalacao.jogadores.through.objects.filter(
+            escalacao__confronto_id__in=acrescimos
+        ).values_list('jogador_id', 'escalacao__confronto_id')
+    )
+    substitutos = set(
+        models.Substituicao.objects.filter(
+            confronto_id__in=acrescimos
+        ).values_list('jogador_entrada_id', 'confronto_id')
+    )
+
+    linhas = {}
+
+    def linha(jogador_id, confronto_id, tempo):
+        chave = (jogador_id, confronto_id, tempo)
+        if chave not in linhas:
+            linhas[chave] = models.EstatisticaJogadorConfronto(
+                jogador_id=jogador_id,
+                confronto_id=confronto_id,
+                tempo=tempo,
+                titular=(jogador_id, confronto_id) in titulares,
+                substituto=(jogador_id, confronto_id) in substitutos,
+            )
+        return linhas[chave]
+
+    # minutos jogados em cada tempo
+    for (jogador_id, confronto_id), (inicio, fim) in calcular_periodos(confrontos).items():
+        for tempo, minutos in dividir_por_tempo(inicio, fim, acrescimos[confronto_id]).items():
+            linha(jogador_id, confronto_id, tempo).minutos = minutos
+
+    # contadores de lances
+    agrupado = (
+        models.Lance.objects.filter(confronto_id__in=acrescimos)
+        .order_by()
+        .values_list('jogador_id', 'confronto_id', 'tempo', 'tipo_lance_id')
+        .annotate(total=Count('id'))
+    )
+    for jogador_id, confronto_id, tempo, tipo_lance_id, total in agrupado:
+        campo = campos_por_tipo_lance_id.get(tipo_lance_id)
+        if campo is None:
+            continue
+        estatistica = linha(jogador_id, confronto_id, 2 if tempo == 2 else 1)
+        setattr(estatistica, campo, getattr(estatistica, campo) + total)
+
+    return list(linhas.values())
+
+
+def atualizar_estatisticas_confrontos(confronto_ids):
+    """
+    Recalcula as estatísticas materializadas dos confrontos informados, todos com as mesmas consultas.
+    Chamado pelos signals, depois do commit, com os confrontos alterados na transação.
+    """
+    with transaction.atomic():
+        models.EstatisticaJogadorConfronto.objects.filter(confronto_id__in=confronto_ids).delete()
+        linhas = _calcular_linhas(models.Confronto.objects.filter(id__in=confronto_ids))
+        models.EstatisticaJogadorConfronto.objects.bulk_create(linhas, batch_size=500)
+
+
+def reconstruir_estatisticas():
+    """
+    Reconstrói do zero as estatísticas materializadas de todos os confrontos.
+    Retorna o número de linhas criadas.
+    """
+    with transaction.atomic():
+        models.EstatisticaJogadorConfronto.objects.all().delete()
+        linhas = _calcular_linhas(models.Confronto.objects.all())
+        models.EstatisticaJogadorConfronto.objects.bulk_create(linhas, batch_size=500)
+    return len(linhas)
+
+
+def ler_estatisticas_materializadas(campeonato_id=None, jogo_id=None, tipos_lance=None, agrupar_por=None, tempo=None):
+    """
+    Lê as estatísticas pré-agregadas de todos os jogadores em uma única consulta agrupada.
+    Com tipos_lance, só os contadores desses tipos são somados.
+    Retorna (lances_por_jogador, partidas_titulares, partidas_substituido, minutos_por_jogador):
+    {jogador_id: ContagemPorTipo} e três dicionários {jogador_id: total}.
+    Com agrupar_por (uma chave de AGRUPAMENTOS), retorna {valor_do_grupo: (...)} com uma tupla dessas por grupo.
+    Com tempo, só as linhas desse tempo entram, como no grupo do mesmo tempo em agrupar_por='tempo'.
+    """
+    campos_por_tipo_lance = models.EstatisticaJogadorConfronto.CAMPOS_POR_TIPO_LANCE
+    if tipos_lance is not None:
+        campos_por_tipo_lance = {nome: campo for nome, campo in campos_por_tipo_lance.items() if nome in tipos_lance}
+
+    linhas = models.EstatisticaJogadorConfronto.objects.all()
+    if jogo_id:
+        linhas = linhas.filter(confronto_id=jogo_id)
+    elif campeonato_id:
+        linhas = linhas.filter(confronto__campeonato_id=campeonato_id)
+    if tempo:
+        linhas = linhas.filter(tempo=tempo)
+
+    # por tempo, só conta a partida no tempo em que o jogador esteve em campo
+    em_campo = Q(minutos__gt=0) if agrupar_por == 'tempo' or tempo else Q()
+
+    agregados = {'total_' + campo: Sum(campo) for campo in campos_por_tipo_lance.values()}
+    linhas = linhas.order_by()
+    if agrupar_por:
+        linhas = linhas.annotate(grupo=AGRUPAMENTOS[agrupar_por])
+    agrupado = linhas.values('jogador_id', *(['grupo'] if agrupar_por else [])).annotate(
+        total_minutos=Sum('minutos'),
+        total_titular=Count('confronto_id', distinct=True, filter=Q(titular=True) & em_campo),
+        total_substituto=Count('confronto_id', distinct=True, filter=Q(substituto=True) & em_campo),
+        **agregados,
+    )
+
+    # cada campo volta para o id do seu tipo de lance (tipos não cadastrados não têm lances)
+    registro_tipos = registro()
+    tipo_lance_id_por_campo = {}
+    for nome, campo in campos_por_tipo_lance.items():
+        ids = registro_tipos.ids_do_tipo(nome, obrigatorio=False)
+        if ids:
+            tipo_lance_id_por_campo[campo] = ids[0]
+
+    grupos = defaultdict(lambda: ({}, {}, {}, {}))
+    for linha in agrupado:
+        jogador_id = linha['jogador_id']
+        lances_por_jogador, partidas_titulares, partidas_substituido, minutos_por_jogador = grupos[
+            _valor_do_grupo(agrupar_por, linha['grupo']) if agrupar_por else None
+        ]
+        lances_por_jogador[jogador_id] = ContagemPorTipo(registro_tipos)
+        for campo, tipo_lance_id in tipo_lance_id_por_campo.items():
+            lances_por_jogador[jogador_id].adicionar(tipo_lance_id, linha['total_' + campo])
+        partidas_titulares[jogador_id] = linha['total_titular']
+        partidas_substituido[jogador_id] = linha['total_substituto']
+        minutos_por_jogador[jogador_id] = linha['total_minutos']
+
+    if agrupar_por:
+        return dict(grupos)
+    return grupos[None]
+
+
+def ler_estatisticas_jogadores(plano, janela=None, agrupar_por=None, campeonato_id=None, jogo_id=None):
+    """
+    Lê o que as métricas do plano precisam para os jogadores: pré-agregado sem janela de minutos,
+    ou pelos índices acumulados e minutos recortados com janela (minuto_inicio, minuto_fim, tempo).
+    Retorna {valor_do_grupo: (lances_por_jogador, partidas_titulares, partidas_substituido, minutos_por_jogador)};
+    sem agrupar_por, o único grupo é None.
+    """
+    if janela is None:
+        # sem janela de minutos: lê as estatísticas pré-agregadas por jogador e confronto
+        lidos = ler_estatisticas_materializadas(campeonato_id=campeonato_id, jogo_id=jogo_id, tipos_lance=plano.tipos_lance, agrupar_por=agrupar_por)
+        return lidos if agrupar_por else {None: lidos}
+
+    if jogo_id:
+        confrontos = models.Confronto.objects.filter(id=jogo_id)
+    elif campeonato_id:
+        confrontos = models.Confronto.objects.filter(campeonato_id=campeonato_id)
+    else:
+        confrontos = models.Confronto.objects.all()
+
+    agrupar = agrupador(confrontos, agrupar_por) if agrupar_por else None
+    lances, partidas, minutos = {}, {}, {}
+
+    # contagem de lances na janela pelos índices acumulados de cada confronto, só dos tipos usados
+    if plano.tipos_lance:
+        lances = contar_lances_na_janela(confrontos, plano.tipos_lance, **janela, agrupar=agrupar)
+
+    # partidas como titular e como substituto, lidas das estatísticas pré-agregadas
+    if plano.precisa('partidas_titulares', 'partidas_jogadas', 'media_minutos'):
+        partidas = ler_estatisticas_materializadas(
+            campeonato_id=campeonato_id, jogo_id=jogo_id, tipos_lance=[], agrupar_por=agrupar_por, tempo=janela['tempo']
+        )
+
+    # minutos jogados por jogador dentro da janela, calculados de uma vez para todos os confrontos do filtro
+    if plano.precisa('minutos_totais', 'media_minutos', 'tempo_div_90'):
+        minutos = minutos_na_janela(confrontos, **janela, agrupar=agrupar)
+
+    if not agrupar_por:
+        return {None: (lances, *(partidas[1:3] if partidas else ({}, {})), minutos)}
+
+    valores = set(lances) | set(partidas) | set(minutos)
+    if agrupar_por == 'tempo' and janela['tempo']:
+        valores &= {janela['tempo']}
+    return {
+        grupo: (lances.get(grupo, {}), *(partidas[grupo][1:3] if grupo in partidas else ({}, {})), minutos.get(grupo, {}))
+        for grupo in valores
+    }
@@ -0,0 +1,111 @@
+from collections import defaultdict
+import numpy as np
+from django.core.cache import cache
+from analise import models
+from analise.cache_estatisticas import versoes_confrontos
+from analise.tipos_lance import ContagemPorTipo, registro
+
+# Índice acumulado dos lances de cada confronto, usado nas consultas com janela de minutos.
+# Para cada (jogador, tipo de lance, tempo) guarda quantos lances aconteceram até cada minuto,
+# então a contagem de qualquer janela sai de duas leituras: acumulado[fim] - acumulado[inicio - 1].
+# Os índices ficam no cache com a versão do confronto, que os signals incrementam quando os dados mudam.
+
+PREFIXO = 'indice_lances'
+
+
+class IndiceConfronto:
+    """
+    chaves: matriz (linhas x 3) com jogador_id, tipo_lance_id e tempo (1 ou 2) de cada linha.
+    acumulado: matriz (linhas x minutos) com o total de lances da linha até cada minuto, inclusive.
+    """
+
+    def __init__(self, chaves, acumulado):
+        self.chaves = chaves
+        self.acumulado = acumulado
+
+    @classmethod
+    def montar(cls, lances):
+        # lances: lista de (jogador_id, tipo_lance_id, tempo, minuto)
+        if not lances:
+            return cls(np.zeros((0, 3), dtype=np.int64), np.zeros((0, 1), dtype=np.int32))
+
+        dados = np.array(
+            # lances sem tempo definido (None ou 0) contam como primeiro tempo
+            [(jogador_id, tipo_lance_id, 2 if tempo == 2 else 1, max(minuto, 0)) for jogador_id, tipo_lance_id, tempo, minuto in lances],
+            dtype=np.int64,
+        )
+        chaves, linhas = np.unique(dados[:, :3], axis=0, return_inverse=True)
+        contagens = np.zeros((len(chaves), dados[:, 3].max() + 1), dtype=np.int32)
+        np.add.at(contagens, (linhas.reshape(-1), dados[:, 3]), 1)
+        return cls(chaves, np.cumsum(contagens, axis=1, dtype=np.int32))
+
+    def contar(self, minuto_inicio=None, minuto_fim=None, tempo=None):
+        """
+        Conta os lances de cada linha com minuto_inicio <= minuto <= minuto_fim, só no tempo informado se houver.
+        Retorna (chaves, totais) apenas das linhas com algum lance na janela.
+        """
+        ultimo = self.acumulado.shape[1] - 1
+        inicio = 0 if minuto_inicio is None else max(minuto_inicio, 0)
+        fim = ultimo if minuto_fim is None else min(minuto_fim, ultimo)
+        if inicio > fim or not len(self.chaves):
+            return self.chaves[:0], self.acumulado[:0, 0]
+
+        totais = self.acumulado[:, fim]
+        if inicio > 0:
+            totais = totais - self.acumulado[:, inicio - 1]
+
+        selecionadas = totais > 0
+        if tempo is not None:
+            selecionadas &= self.chaves[:, 2] == tempo
+        return self.chaves[selecionadas], totais[selecionadas]
+
+
+def _chave(confronto_id, versao):
+    return f'{PREFIXO}:{confronto_id}:v{versao}'
+
+
+def indices_confrontos(confronto_ids):
+    """
+    Retorna {confronto_id: IndiceConfronto} dos confrontos informados.
+    Os índices que não estão no cache são montados com uma única consulta e guardados.
+    """
+    chaves = {confronto_id: _chave(confronto_id, versao) for confronto_id, versao in versoes_confrontos(confronto_ids).items()}
+    guardados = cache.get_many(list(chaves.values()))
+
+    indices = {confronto_id: guardados[chave] for confronto_id, chave in chaves.items() if chave in guardados}
+    faltando = [confronto_id for confronto_id in chaves if confronto_id not in indices]
+
+    if faltando:
+        lances = defaultdict(list)
+        for confronto_id, *lance in models.Lance.objects.filter(confronto_id__in=faltando).order_by().values_list(
+            'confronto_id', 'jogador_id', 'tipo_lance_id', 'tempo', 'minuto'
+        ):
+            lances[confronto_id].append(lance)
+
+        novos = {confronto_id: IndiceConfronto.montar(lances[confronto_id]) for confronto_id in faltando}
+        cache.set_many({chaves[confronto_id]: indice for confronto_id, indice in novos.items()}, timeout=None)
+        indices.update(novos)
+
+    return indices
+
+
+def contar_lances_na_janela(confrontos, tipos_lance, minuto_inicio=None, minuto_fim=None, tempo=None, agrupar=None):
+    """
+    Conta os lances de cada jogador por tipo de lance dentro da janela de minutos, pelos índices acumulados.
+    Retorna {jogador_id: ContagemPorTipo},
+    ou {valor_do_grupo: {jogador_id: ContagemPorTipo}} com agrupar(confronto_id, tempo).
+    """
+    registro_tipos = registro()
+    tipos_lance_ids = [tipo_lance_id for nome in tipos_lance for tipo_lance_id in registro_tipos.ids_do_tipo(nome, obrigatorio=False)]
+    contagens = defaultdict(lambda: defaultdict(lambda: ContagemPorTipo(registro_tipos)))
+
+    for confronto_id, indice in indices_confrontos(list(confrontos.values_list('id', flat=True))).items():
+        chaves, totais = indice.contar(minuto_inicio, minuto_fim, tempo)
+        selecionadas = np.isin(chaves[:, 1], tipos_lance_ids)
+        for (jogador_id, tipo_lance_id, tempo_lance), total in zip(chaves[selecionadas].tolist(), totais[selecionadas].tolist()):
+            grupo = agrupar(confronto_id, tempo_lance) if agrupar else None
+            contagens[grupo][jogador_id].adicionar(tipo_lance_id, total)
+
+    if agrupar:
+        return contagens
+    return contagens[None]
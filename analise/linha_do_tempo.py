@@ -0,0 +1,101 @@
+from bisect import bisect_right
+from django.core.cache import cache
+from analise import models
+from analise.cache_estatisticas import versao_dados
+from analise.em_campo import (
+    EstadoEmCampo, NOMES_EVENTOS, TIPOS_LANCE_EVENTOS, GOL, GOL_SOFRIDO, CARTAO_AMARELO, CARTAO_VERMELHO, SUBSTITUICAO,
+    eventos_do_confronto, titulares_do_confronto,
+)
+
+# Linha do tempo de um confronto para o replay da partida: placar, cartões e jogadores em campo
+# depois de cada evento (substituição, gol, gol sofrido ou cartão). Fica no cache com a versão do confronto,
+# e o momento de um minuto qualquer sai de uma busca binária sobre os eventos já calculados.
+
+PREFIXO = 'linha_do_tempo'
+
+
+class LinhaDoTempo:
+    """
+    momentos: estado da partida no início e depois de cada evento, na ordem da partida.
+    chaves: (tempo, minuto) de cada momento, para a busca binária.
+    """
+
+    def __init__(self, confronto, jogadores, momentos):
+        self.confronto = confronto
+        self.jogadores = jogadores
+        self.momentos = momentos
+        self.chaves = [(momento['tempo'], momento['minuto']) for momento in momentos]
+
+    def no_minuto(self, tempo, minuto):
+        """
+        Momento da partida no minuto marcado do tempo informado: o estado depois do último evento até esse minuto.
+        """
+        return self.momentos[max(bisect_right(self.chaves, (tempo, minuto)) - 1, 0)]
+
+    def como_dict(self):
+        return {**self.confronto, 'jogadores': self.jogadores, 'momentos': self.momentos}
+
+
+def montar_linha_do_tempo(confronto_id):
+    """
+    Monta a linha do tempo do confronto em quatro consultas (acréscimos, escalação, eventos e jogadores).
+    Retorna None se o confronto não existe.
+    """
+    confronto = models.Confronto.objects.filter(id=confronto_id).values('id', 'acrescimo1tempo', 'acrescimo2tempo').first()
+    if confronto is None:
+        return None
+    acrescimo1tempo = confronto['acrescimo1tempo']
+
+    # sem escalação a linha do tempo ainda mostra placar e cartões
+    estado = EstadoEmCampo(titulares_do_confronto(confronto_id) or [])
+    eventos = eventos_do_confronto(confronto_id, tipos=list(TIPOS_LANCE_EVENTOS))
+
+    envolvidos = set(estado.em_campo)
+    for _, _, _, _, jogador_entrada_id, jogador_id in eventos:
+        envolvidos.update(j for j in (jogador_entrada_id, jogador_id) if j is not None)
+    jogadores = list(models.Jogador.objects.filter(id__in=envolvidos).order_by('id').values('id', 'nome', 'posicao'))
+    posicoes = {jogador['id']: jogador['posicao'] for jogador in jogadores}
+
+    placar = {GOL: 0, GOL_SOFRIDO: 0}
+    cartoes = {CARTAO_AMARELO: [], CARTAO_VERMELHO: []}
+
+    def momento(tempo, minuto, evento):
+        return {
+            'tempo': tempo,
+            'minuto': minuto,
+            # minuto no tempo corrido da partida (o segundo tempo soma os acréscimos do primeiro)
+            'relogio': minuto + acrescimo1tempo if tempo == 2 else minuto,
+            'evento': evento,
+            'placar': [placar[GOL], placar[GOL_SOFRIDO]],
+            'amarelos': list(cartoes[CARTAO_AMARELO]),
+            'vermelhos': list(cartoes[CARTAO_VERMELHO]),
+            'em_campo': sorted(estado.em_campo, key=lambda jogador_id: estado.ordem(jogador_id, posicoes.get(jogador_id))),
+        }
+
+    momentos = [momento(1, 0, None)]
+    for tempo, minuto, tipo, _, jogador_entrada_id, jogador_id in eventos:
+        estado.aplicar(tipo, jogador_entrada_id, jogador_id)
+        if tipo in placar:
+            placar[tipo] += 1
+        elif tipo in cartoes:
+            cartoes[tipo].append(jogador_id)
+
+        evento = {'tipo': NOMES_EVENTOS[tipo], 'jogador': jogador_id}
+        if tipo == SUBSTITUICAO:
+            evento['jogador_entrada'] = jogador_entrada_id
+        momentos.append(momento(tempo, minuto, evento))
+
+    return LinhaDoTempo(confronto, jogadores, momentos)
+
+
+def linha_do_tempo(confronto_id):
+    """
+    Linha do tempo do confronto, do cache quando a versão dos dados do confronto não mudou.
+    """
+    chave = f'{PREFIXO}:{confronto_id}:v{versao_dados(jogo_id=confronto_id)}'
+    guardada = cache.get(chave)
+    if guardada is None:
+        guardada = montar_linha_do_tempo(confronto_id) or False
+        # False marca confronto inexistente no cache, já que None é o valor de chave ausente
+        cache.set(chave, guardada, timeout=None)
+    return guardada or None
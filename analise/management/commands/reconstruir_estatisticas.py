@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from analise.estatisticas import reconstruir_estatisticas
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói do zero a tabela de estatísticas por jogador, confronto e tempo.'
+
+    def handle(self, *args, **options):
+        total = reconstruir_estatisticas()
+        self.stdout.write(self.style.SUCCESS(f'{total} linhas de estatísticas criadas.'))
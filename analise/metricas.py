@@ -0,0 +1,302 @@
+import numpy as np
+from analise.tipos_lance import registro
+
+# Registro declarativo das métricas de estatísticas.
+# Cada métrica é declarada uma única vez (tipos de lance de origem, fórmula ou taxa por 90 minutos)
+# e os endpoints só escolhem quais métricas mostrar e com qual chave na resposta. O Plano junta as
+# métricas pedidas, descobre os tipos de lance e os dados de contexto (minutos, partidas) que elas
+# precisam e calcula todas de uma vez sobre a matriz de contagens.
+
+
+class Metrica:
+    """
+    tipos: soma das contagens desses tipos de lance
+    soma: soma de outras métricas
+    por_90: taxa a cada 90 minutos de outra métrica (o divisor vem do contexto 'tempo_div_90')
+    contexto: valor fornecido pelo próprio endpoint (minutos, partidas...)
+    """
+
+    def __init__(self, nome, tipos=None, soma=None, por_90=None, contexto=None):
+        self.nome = nome
+        self.tipos = tipos or []
+        self.soma = soma or []
+        self.por_90 = por_90
+        self.contexto = contexto
+
+    @property
+    def dependencias(self):
+        if self.por_90:
+            return [self.por_90]
+        return self.soma
+
+    @property
+    def contextos(self):
+        if self.por_90:
+            return {'tempo_div_90'}
+        if self.contexto:
+            return {self.contexto}
+        return set()
+
+
+METRICAS = {metrica.nome: metrica for metrica in [
+    # tempo
+    Metrica('partidas_titulares', contexto='partidas_titulares'),
+    Metrica('partidas_jogadas', contexto='partidas_jogadas'),
+    Metrica('minutos_totais', contexto='minutos_totais'),
+    Metrica('media_minutos', contexto='media_minutos'),
+
+    # desempenho
+    Metrica('gols', tipos=['Gol', 'Gol de Penalti']),
+    Metrica('gols_de_penalti', tipos=['Gol de Penalti']),
+    Metrica('assistencias', tipos=['Assistencia']),
+    Metrica('gols_assistencias', soma=['gols', 'assistencias']),
+    Metrica('penaltis_batidos', tipos=['Penalti perdido', 'Gol de Penalti']),
+    Metrica('chutes_pra_fora', tipos=['Finalização pra fora']),
+    Metrica('chutes_defendidos', tipos=['Finalização defendida']),
+    Metrica('chutes_na_trave', tipos=['Finalização na trave']),
+    Metrica('finalizacoes', tipos=['Finalização pra fora', 'Finalização defendida', 'Finalização na trave', 'Gol', 'Gol de Penalti']),
+    Metrica('impedimentos', tipos=['Impedimento']),
+    Metrica('faltas_sofridas', tipos=['Falta sofrida', 'Falta sofrida para cartão']),
+    Metrica('falta_pra_cartao_sofrida', tipos=['Falta sofrida para cartão']),
+
+    # desempenho defensivo
+    Metrica('cartao_amarelo', tipos=['Cartão Amarelo']),
+    Metrica('cartao_vermelho', tipos=['Cartão Vermelho']),
+    Metrica('cartoes', tipos=['Cartão Amarelo', 'Cartão Vermelho']),
+    Metrica('desarmes', tipos=['Desarme']),
+    Metrica('roubadas_de_bola', tipos=['Roubada de Bola']),
+    Metrica('rb_desarmes', tipos=['Roubada de Bola', 'Desarme']),
+    Metrica('faltas_cometidas', tipos=['Falta cometida', 'Cartão Amarelo', 'Cartão Vermelho']),
+    Metrica('finalizacoes_sofridas', tipos=['Finalização normal sofrida', 'Finalização perigosa sofrida', 'Gol sofrido']),
+    Metrica('finalizacoes_normais_sofridas', tipos=['Finalização normal sofrida']),
+    Metrica('finalizacoes_perigosas_sofridas', tipos=['Finalização perigosa sofrida']),
+    Metrica('gols_sofridos', tipos=['Gol sofrido']),
+
+    # esperado
+    Metrica('gols_esperados', tipos=['Chance de Gol']),
+    Metrica('assists_esperados', tipos=['Chance de Assistencia']),
+    Metrica('gols_assists_esperados', soma=['gols_esperados', 'assists_esperados']),
+
+    # progressao
+    Metrica('progressao_com_a_bola', tipos=['Progressão com a bola']),
+    Metrica('passe_quebra_linha', tipos=['Passe Quebra linha']),
+    Metrica('passe_ql_recebido', tipos=['Passe QL recebido']),
+    Metrica('progressoes', tipos=['Progressão com a bola', 'Passe QL recebido', 'Passe Quebra linha']),
+
+    # a cada 90min
+    Metrica('gols_p_90min', por_90='gols'),
+    Metrica('assists_p_90min', por_90='assistencias'),
+    Metrica('gols_assists_p_90min', soma=['gols_p_90min', 'assists_p_90min']),
+    Metrica('gols_esperados_p_90min', por_90='gols_esperados'),
+    Metrica('assists_esperados_p_90min', por_90='assists_esperados'),
+    Metrica('gols_assists_esperados_p_90min', soma=['gols_esperados_p_90min', 'assists_esperados_p_90min']),
+    Metrica('finalizacoes_p_90min', por_90='finalizacoes'),
+    Metrica('faltas_sofridas_p_90min', por_90='faltas_sofridas'),
+    Metrica('falta_pra_cartao_sofrida_p_90min', por_90='falta_pra_cartao_sofrida'),
+    Metrica('progressoes_p_90min', por_90='progressoes'),
+    Metrica('rb_desarmes_p_90min', por_90='rb_desarmes'),
+    Metrica('cartoes_p_90min', por_90='cartoes'),
+    Metrica('faltas_cometidas_p_90min', por_90='faltas_cometidas'),
+    Metrica('finalizacoes_normais_sofridas_p_90min', por_90='finalizacoes_normais_sofridas'),
+    Metrica('finalizacoes_perigosas_sofridas_p_90min', por_90='finalizacoes_perigosas_sofridas'),
+    Metrica('gols_sofridos_p_90min', por_90='gols_sofridos'),
+]}
+
+
+# (chave na resposta, métrica) de cada endpoint, na ordem da resposta
+
+CAMPOS_JOGADOR = [
+    # tempo
+    ('partidas_titulares', 'partidas_titulares'),
+    ('partidas_jogadas', 'partidas_jogadas'),
+    ('minutos_totais', 'minutos_totais'),
+    ('media_minutos', 'media_minutos'),
+    # desempenho
+    ('gols', 'gols'),
+    ('assistencias', 'assistencias'),
+    ('chutes_pra_fora', 'chutes_pra_fora'),
+    ('chutes_defendidos', 'chutes_defendidos'),
+    ('chutes_na_trave', 'chutes_na_trave'),
+    ('impedimentos', 'impedimentos'),
+    # desempenho defensivo
+    ('cartao_amarelo', 'cartao_amarelo'),
+    ('cartao_vermelho', 'cartao_vermelho'),
+    ('desarmes', 'desarmes'),
+    ('roubada_de_bola', 'roubadas_de_bola'),
+    ('faltas_cometida', 'faltas_cometidas'),
+    ('faltas_sofridas', 'faltas_sofridas'),
+    # esperado
+    ('gols_esperados', 'gols_esperados'),
+    ('assistencias_esperados', 'assists_esperados'),
+    # progressao
+    ('progressao_com_a_bola', 'progressao_com_a_bola'),
+    ('passe_quebra_linha', 'passe_quebra_linha'),
+    ('passe_ql_recebido', 'passe_ql_recebido'),
+    # a cada 90min
+    ('gols_p_90min', 'gols_p_90min'),
+    ('assists_p_90min', 'assists_p_90min'),
+    ('Gols_assists_p_90min', 'gols_assists_p_90min'),
+    ('gols_esperados_p_90min', 'gols_esperados_p_90min'),
+    ('assists_esperados_p_90min', 'assists_esperados_p_90min'),
+    ('finalizacoes_p_90_min', 'finalizacoes_p_90min'),
+    ('falta_sofrida_p_90', 'faltas_sofridas_p_90min'),
+    ('progressoes_p_90', 'progressoes_p_90min'),
+    ('rb_desarme_p_90', 'rb_desarmes_p_90min'),
+    ('cartoes_p_90', 'cartoes_p_90min'),
+    ('falta_cometida_p_90', 'faltas_cometidas_p_90min'),
+]
+
+# métricas padrão do endpoint de forma (últimas N partidas), com as mesmas chaves de CAMPOS_JOGADOR
+CAMPOS_FORMA = [
+    ('partidas_jogadas', 'partidas_jogadas'),
+    ('minutos_totais', 'minutos_totais'),
+    ('gols_p_90min', 'gols_p_90min'),
+    ('assists_p_90min', 'assists_p_90min'),
+    ('Gols_assists_p_90min', 'gols_assists_p_90min'),
+    ('gols_esperados_p_90min', 'gols_esperados_p_90min'),
+    ('assists_esperados_p_90min', 'assists_esperados_p_90min'),
+    ('finalizacoes_p_90_min', 'finalizacoes_p_90min'),
+    ('progressoes_p_90', 'progressoes_p_90min'),
+    ('rb_desarme_p_90', 'rb_desarmes_p_90min'),
+]
+
+# perfil por 90 minutos usado na busca de jogadores semelhantes
+CAMPOS_SEMELHANCA = [
+    ('gols_p_90min', 'gols_p_90min'),
+    ('assists_p_90min', 'assists_p_90min'),
+    ('gols_esperados_p_90min', 'gols_esperados_p_90min'),
+    ('assists_esperados_p_90min', 'assists_esperados_p_90min'),
+    ('finalizacoes_p_90_min', 'finalizacoes_p_90min'),
+    ('falta_sofrida_p_90', 'faltas_sofridas_p_90min'),
+    ('progressoes_p_90', 'progressoes_p_90min'),
+    ('rb_desarme_p_90', 'rb_desarmes_p_90min'),
+    ('cartoes_p_90', 'cartoes_p_90min'),
+    ('falta_cometida_p_90', 'faltas_cometidas_p_90min'),
+]
+
+CAMPOS_TIME = [
+    # desempenho
+    ('partidas_jogadas', 'partidas_jogadas'),
+    ('gols', 'gols'),
+    ('assistencias', 'assistencias'),
+    ('gols_assistencias', 'gols_assistencias'),
+    ('penaltis_batidos', 'penaltis_batidos'),
+    ('gols_de_penalti', 'gols_de_penalti'),
+    ('finalizacoes_pra_fora', 'chutes_pra_fora'),
+    ('finalizacoes_defendidas', 'chutes_defendidos'),
+    ('finalizacoes_na_trave', 'chutes_na_trave'),
+    ('impedimentos', 'impedimentos'),
+    ('faltas_sofridas', 'faltas_sofridas'),
+    ('falta_pra_cartao_sofrida', 'falta_pra_cartao_sofrida'),
+    # desempenho defensivo
+    ('cartao_amarelo', 'cartao_amarelo'),
+    ('cartao_vermelho', 'cartao_vermelho'),
+    ('roubadas_de_bola', 'roubadas_de_bola'),
+    ('desarmes', 'desarmes'),
+    ('faltas_cometidas', 'faltas_cometidas'),
+    ('finalizacoes_sofridas', 'finalizacoes_sofridas'),
+    ('finalizacoes_perigosas_sofridas', 'finalizacoes_perigosas_sofridas'),
+    ('gol_sofrido', 'gols_sofridos'),
+    # chances de gols/esperado
+    ('gols_esperados', 'gols_esperados'),
+    ('assists_esperados', 'assists_esperados'),
+    ('gols_assists_esperados', 'gols_assists_esperados'),
+    # progressao
+    ('progressao_solo', 'progressao_com_a_bola'),
+    ('passe_ql', 'passe_quebra_linha'),
+    ('passe_ql_recebido', 'passe_ql_recebido'),
+    # a cada 90min (para o time, 90 minutos = uma partida)
+    ('gols_p_90min', 'gols_p_90min'),
+    ('assists_p_90min', 'assists_p_90min'),
+    ('gols_assists_p_90min', 'gols_assists_p_90min'),
+    ('gols_esperados_p_90min', 'gols_esperados_p_90min'),
+    ('assists_esperados_p_90min', 'assists_esperados_p_90min'),
+    ('gols_assists_esperados_p_90min', 'gols_assists_esperados_p_90min'),
+    ('finalizacoes_p_90min', 'finalizacoes_p_90min'),
+    ('faltas_sofrida_p_90min', 'faltas_sofridas_p_90min'),
+    ('cartoes_causados_p_90', 'falta_pra_cartao_sofrida_p_90min'),
+    ('cartoes_sofridos_p_90min', 'cartoes_p_90min'),
+    ('rb_desarme_p_90min', 'rb_desarmes_p_90min'),
+    ('falta_cometida_p_90min', 'faltas_cometidas_p_90min'),
+    ('finalizacoes_sofridas_p_90min', 'finalizacoes_normais_sofridas_p_90min'),
+    ('finalizacoes_perigosas_sofridas_p_90min', 'finalizacoes_perigosas_sofridas_p_90min'),
+    ('gols_sofridos_p_90min', 'gols_sofridos_p_90min'),
+]
+
+
+class Plano:
+    """
+    Compila uma lista de campos (chave na resposta, métrica) no que precisa ser consultado:
+    os tipos de lance da contagem agrupada e os dados de contexto (minutos, partidas).
+    """
+
+    def __init__(self, campos):
+        self.campos = list(campos)
+        self.metricas = []
+
+        visitadas = set()
+
+        def visitar(nome):
+            if nome in visitadas:
+                return
+            if nome not in METRICAS:
+                raise KeyError(f"Métrica '{nome}' não registrada.")
+            visitadas.add(nome)
+            metrica = METRICAS[nome]
+            for dependencia in metrica.dependencias:
+                visitar(dependencia)
+            self.metricas.append(metrica)
+
+        for _, nome in self.campos:
+            visitar(nome)
+
+        self.tipos_lance = sorted({tipo for metrica in self.metricas for tipo in metrica.tipos})
+        self.contextos = set().union(*(metrica.contextos for metrica in self.metricas))
+
+    def precisa(self, *contextos):
+        # se alguma métrica do plano usa algum dos contextos informados
+        return not self.contextos.isdisjoint(contextos)
+
+    def filtrar_lances(self, lances):
+        """
+        Restringe os lances aos tipos usados pelas métricas do plano.
+        Tipos não cadastrados em Tipo_Lance fazem a consulta falhar.
+        """
+        registro_tipos = registro()
+        ids = [tipo_lance_id for nome in self.tipos_lance for tipo_lance_id in registro_tipos.ids_do_tipo(nome)]
+        return lances.filter(tipo_lance_id__in=ids)
+
+    def calcular(self, matriz, contexto):
+        """
+        Calcula as métricas do plano para todas as linhas de uma vez.
+        matriz: contagens (linhas x self.tipos_lance); contexto: {nome: vetor com um valor por linha}.
+        Retorna {chave na resposta: vetor}.
+        """
+        colunas = {tipo: matriz[:, coluna] for coluna, tipo in enumerate(self.tipos_lance)}
+        valores = {}
+
+        for metrica in self.metricas:
+            if metrica.tipos:
+                valores[metrica.nome] = sum(colunas[tipo] for tipo in metrica.tipos)
+            elif metrica.soma:
+                valores[metrica.nome] = sum(valores[nome] for nome in metrica.soma)
+            elif metrica.por_90:
+                divisor = contexto['tempo_div_90']
+                valores[metrica.nome] = np.round(
+                    np.divide(valores[metrica.por_90], divisor, out=np.zeros(len(divisor)), where=divisor > 0), 3
+                )
+            else:
+                valores[metrica.nome] = contexto[metrica.contexto]
+
+        return {chave: valores[nome] for chave, nome in self.campos}
+
+
+def matriz_de_contagens(contagens, tipos_lance):
+    """
+    Monta a matriz densa linha x tipo de lance a partir de uma ContagemPorTipo por linha (None = sem lances).
+    """
+    matriz = np.zeros((len(contagens), len(tipos_lance)), dtype=np.int64)
+    for linha, contagem in enumerate(contagens):
+        if contagem is not None:
+            matriz[linha] = [contagem.get(tipo_lance, 0) for tipo_lance in tipos_lance]
+    return matriz
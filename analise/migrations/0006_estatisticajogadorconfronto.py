@@ -0,0 +1,52 @@
+# Generated by Django 4.2.4 on 2026-10-18 11:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analise', '0005_lance_tempo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstatisticaJogadorConfronto',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tempo', models.IntegerField()),
+                ('titular', models.BooleanField(default=False)),
+                ('substituto', models.BooleanField(default=False)),
+                ('minutos', models.IntegerField(default=0)),
+                ('gols', models.IntegerField(default=0)),
+                ('gols_de_penalti', models.IntegerField(default=0)),
+                ('penaltis_perdidos', models.IntegerField(default=0)),
+                ('assistencias', models.IntegerField(default=0)),
+                ('chutes_pra_fora', models.IntegerField(default=0)),
+                ('chutes_defendidos', models.IntegerField(default=0)),
+                ('chutes_na_trave', models.IntegerField(default=0)),
+                ('impedimentos', models.IntegerField(default=0)),
+                ('cartao_amarelo', models.IntegerField(default=0)),
+                ('cartao_vermelho', models.IntegerField(default=0)),
+                ('desarmes', models.IntegerField(default=0)),
+                ('roubadas_de_bola', models.IntegerField(default=0)),
+                ('faltas_cometidas', models.IntegerField(default=0)),
+                ('faltas_sofridas', models.IntegerField(default=0)),
+                ('faltas_sofridas_para_cartao', models.IntegerField(default=0)),
+                ('finalizacoes_sofridas', models.IntegerField(default=0)),
+                ('finalizacoes_perigosas_sofridas', models.IntegerField(default=0)),
+                ('gols_sofridos', models.IntegerField(default=0)),
+                ('gols_esperados', models.IntegerField(default=0)),
+                ('assists_esperados', models.IntegerField(default=0)),
+                ('progressao_com_a_bola', models.IntegerField(default=0)),
+                ('passe_quebra_linha', models.IntegerField(default=0)),
+                ('passe_ql_recebido', models.IntegerField(default=0)),
+                ('confronto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='estatisticas_jogadores', to='analise.confronto')),
+                ('jogador', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='estatisticas_confronto', to='analise.jogador')),
+            ],
+            options={
+                'unique_together': {('jogador', 'confronto', 'tempo')},
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.4 on 2026-10-18 11:24
+
+from django.db import migrations, models
+import numpy as np
+
+
+# cópia congelada de analise.campo.zonas (campo de 600 x 450, 6 faixas x 3 corredores), para a migração
+# continuar dando o mesmo resultado mesmo que o módulo do campo mude depois
+COMPRIMENTO, LARGURA, FAIXAS, CORREDORES = 600, 450, 6, 3
+
+
+def zonas(xs, ys):
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    faixa_x = np.clip(np.ceil(np.nan_to_num(xs) / (COMPRIMENTO / FAIXAS)) - 1, 0, FAIXAS - 1)
+    corredor = np.clip(np.ceil(np.nan_to_num(ys) / (LARGURA / CORREDORES)) - 1, 0, CORREDORES - 1)
+    resultado = ((FAIXAS - 1 - faixa_x) * CORREDORES + corredor + 1).astype(np.int64)
+    resultado[np.isnan(xs) | np.isnan(ys)] = 0
+    return resultado
+
+
+def preencher_zonas(apps, schema_editor):
+    Lance = apps.get_model('analise', 'Lance')
+    lances = list(Lance.objects.only('id', 'coordenadaX', 'coordenadaY', 'coordenadaXFinal', 'coordenadaYFinal'))
+    if not lances:
+        return
+
+    coordenadas = np.array(
+        [(lance.coordenadaX, lance.coordenadaY, lance.coordenadaXFinal, lance.coordenadaYFinal) for lance in lances],
+        dtype=np.float64,
+    )
+    iniciais = zonas(coordenadas[:, 0], coordenadas[:, 1]).tolist()
+    finais = zonas(coordenadas[:, 2], coordenadas[:, 3]).tolist()
+    for lance, zona, zona_final in zip(lances, iniciais, finais):
+        lance.zona = zona or None
+        lance.zona_final = zona_final or None
+    Lance.objects.bulk_update(lances, ['zona', 'zona_final'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analise', '0006_estatisticajogadorconfronto'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lance',
+            name='zona',
+            field=models.PositiveSmallIntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='lance',
+            name='zona_final',
+            field=models.PositiveSmallIntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(preencher_zonas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,119 @@
+from collections import defaultdict
+from analise import models
+from analise.tipos_lance import registro
+
+
+def _relogio(minuto, primeiro_tempo, acrescimo1tempo):
+    # converte o minuto marcado no tempo corrido da partida (o segundo tempo soma os acréscimos do primeiro)
+    if primeiro_tempo:
+        return minuto
+    return minuto + acrescimo1tempo
+
+
+def calcular_periodos(confrontos):
+    """
+    Calcula o período em campo (entrada, saída) de cada jogador em cada confronto informado,
+    em minutos do tempo corrido da partida.
+    Carrega escalações, substituições, expulsões e acréscimos em quatro consultas,
+    independente do número de jogadores e confrontos.
+    Retorna {(jogador_id, confronto_id): (inicio, fim)}.
+    """
+    acrescimos = {
+        confronto_id: (acrescimo1tempo, acrescimo2tempo)
+        for confronto_id, acrescimo1tempo, acrescimo2tempo in confrontos.values_list('id', 'acrescimo1tempo', 'acrescimo2tempo')
+    }
+    if not acrescimos:
+        return {}
+
+    titulares = models.Escalacao.jogadores.through.objects.filter(
+        escalacao__confronto_id__in=acrescimos
+    ).values_list('jogador_id', 'escalacao__confronto_id')
+
+    substituicoes = models.Substituicao.objects.filter(
+        confronto_id__in=acrescimos
+    ).order_by('id').values_list('confronto_id', 'minuto', 'primeiro_tempo', 'jogador_entrada_id', 'jogador_saida_id')
+
+    expulsoes = models.Lance.objects.filter(
+        confronto_id__in=acrescimos, tipo_lance_id__in=registro().ids_do_tipo('Cartão Vermelho', obrigatorio=False)
+    ).order_by('id').values_list('confronto_id', 'jogador_id', 'minuto', 'tempo')
+
+    # minuto (no tempo corrido) em que cada jogador entrou e saiu de campo
+    entradas = {(jogador_id, confronto_id): 0 for jogador_id, confronto_id in titulares}
+    saidas = defaultdict(list)
+
+    for confronto_id, minuto, primeiro_tempo, jogador_entrada_id, jogador_saida_id in substituicoes:
+        relogio = _relogio(minuto, primeiro_tempo, acrescimos[confronto_id][0])
+        entradas.setdefault((jogador_entrada_id, confronto_id), relogio)
+        saidas[(jogador_saida_id, confronto_id)].append(relogio)
+
+    for confronto_id, jogador_id, minuto, tempo in expulsoes:
+        # lances sem tempo definido (None ou 0) contam como primeiro tempo
+        relogio = _relogio(minuto, (tempo or 0) < 2, acrescimos[confronto_id][0])
+        saidas[(jogador_id, confronto_id)].append(relogio)
+
+    periodos = {}
+    for (jogador_id, confronto_id), inicio in entradas.items():
+        acrescimo1tempo, acrescimo2tempo = acrescimos[confronto_id]
+        fim = 90 + acrescimo1tempo + acrescimo2tempo
+
+        # sai na primeira substituição ou expulsão depois de ter entrado
+        fim = min([saida for saida in saidas.get((jogador_id, confronto_id), []) if saida >= inicio] + [fim])
+        periodos[(jogador_id, confronto_id)] = (inicio, max(fim, inicio))
+
+    return periodos
+
+
+def dividir_por_tempo(inicio, fim, acrescimo1tempo):
+    """
+    Divide um período em campo entre o primeiro e o segundo tempo.
+    Retorna {1: minutos_primeiro_tempo, 2: minutos_segundo_tempo}.
+    """
+    fim_primeiro_tempo = 45 + acrescimo1tempo
+    primeiro_tempo = max(min(fim, fim_primeiro_tempo) - inicio, 0)
+    return {1: primeiro_tempo, 2: (fim - inicio) - primeiro_tempo}
+
+
+def recortar_periodo(inicio, fim, acrescimo1tempo, acrescimo2tempo, minuto_inicio=None, minuto_fim=None, tempo=None):
+    """
+    Minutos de um período em campo (no tempo corrido) que caem dentro de uma janela de minutos marcados.
+    A janela segue o LanceFilter: minuto_inicio <= minuto <= minuto_fim, em cada tempo pedido
+    (o minuto marcado do segundo tempo começa em 45, como nos lances).
+    """
+    # (primeiro minuto marcado, fim do tempo em minutos marcados, acréscimos anteriores para o tempo corrido)
+    tempos = {1: (0, 45 + acrescimo1tempo, 0), 2: (45, 90 + acrescimo2tempo, acrescimo1tempo)}
+
+    minutos = 0
+    for numero, (comeco_tempo, fim_tempo, deslocamento) in tempos.items():
+        if tempo is not None and tempo != numero:
+            continue
+        # o minuto marcado m cobre o intervalo [m, m + 1)
+        comeco = comeco_tempo if minuto_inicio is None else max(comeco_tempo, minuto_inicio)
+        final = fim_tempo if minuto_fim is None else min(fim_tempo, minuto_fim + 1)
+        minutos += max(min(fim, final + deslocamento) - max(inicio, comeco + deslocamento), 0)
+    return minutos
+
+
+def minutos_na_janela(confrontos, minuto_inicio=None, minuto_fim=None, tempo=None, agrupar=None):
+    """
+    Soma os minutos jogados por cada jogador dentro da janela de minutos (e do tempo) informada.
+    Retorna {jogador_id: minutos}, ou {valor_do_grupo: {jogador_id: minutos}} com agrupar(confronto_id, tempo).
+    """
+    acrescimos = {
+        confronto_id: (acrescimo1tempo, acrescimo2tempo)
+        for confronto_id, acrescimo1tempo, acrescimo2tempo in confrontos.values_list('id', 'acrescimo1tempo', 'acrescimo2tempo')
+    }
+
+    minutos_por_grupo = defaultdict(lambda: defaultdict(int))
+    for (jogador_id, confronto_id), (inicio, fim) in calcular_periodos(confrontos).items():
+        for numero in (1, 2):
+            if tempo is not None and tempo != numero:
+                continue
+            minutos = recortar_periodo(
+                inicio, fim, *acrescimos[confronto_id], minuto_inicio=minuto_inicio, minuto_fim=minuto_fim, tempo=numero
+            )
+            grupo = agrupar(confronto_id, numero) if agrupar else None
+            minutos_por_grupo[grupo][jogador_id] += minutos
+
+    if agrupar:
+        return minutos_por_grupo
+    return minutos_por_grupo[None]
@@ -2,6 +2,7 @@ from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from datetime import datetime
 from django.core.exceptions import ValidationError
+from analise import campo
 
 class CustomUserManager(BaseUserManager):
     def create_user(self, email, nome, password=None, **extra_fields):
@@ -123,3 +124,87 @@ class Lance(models.Model):
     coordenadaXFinal = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
     coordenadaYFinal = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
     tempo = models.IntegerField(blank=True, null=True)
+    # zona do campo (1 a 18, ver analise/campo.py) da coordenada inicial e da final, calculadas ao salvar
+    zona = models.PositiveSmallIntegerField(blank=True, null=True, editable=False, db_index=True)
+    zona_final = models.PositiveSmallIntegerField(blank=True, null=True, editable=False, db_index=True)
+
+    def save(self, *args, **kwargs):
+        self.zona = campo.zona(self.coordenadaX, self.coordenadaY)
+        self.zona_final = campo.zona(self.coordenadaXFinal, self.coordenadaYFinal)
+        super().save(*args, **kwargs)
+
+
+class EstatisticaJogadorConfronto(models.Model):
+    # Estatísticas pré-agregadas por jogador, confronto e tempo, mantidas pelos signals de analise/signals.py
+    # e reconstruídas com `python manage.py reconstruir_estatisticas`
+
+    # nome do Tipo_Lance -> campo contador
+    CAMPOS_POR_TIPO_LANCE = {
+        'Gol': 'gols',
+        'Gol de Penalti': 'gols_de_penalti',
+        'Penalti perdido': 'penaltis_perdidos',
+        'Assistencia': 'assistencias',
+        'Finalização pra fora': 'chutes_pra_fora',
+        'Finalização defendida': 'chutes_defendidos',
+        'Finalização na trave': 'chutes_na_trave',
+        'Impedimento': 'impedimentos',
+        'Cartão Amarelo': 'cartao_amarelo',
+        'Cartão Vermelho': 'cartao_vermelho',
+        'Desarme': 'desarmes',
+        'Roubada de Bola': 'roubadas_de_bola',
+        'Falta cometida': 'faltas_cometidas',
+        'Falta sofrida': 'faltas_sofridas',
+        'Falta sofrida para cartão': 'faltas_sofridas_para_cartao',
+        'Finalização normal sofrida': 'finalizacoes_sofridas',
+        'Finalização perigosa sofrida': 'finalizacoes_perigosas_sofridas',
+        'Gol sofrido': 'gols_sofridos',
+        'Chance de Gol': 'gols_esperados',
+        'Chance de Assistencia': 'assists_esperados',
+        'Progressão com a bola': 'progressao_com_a_bola',
+        'Passe Quebra linha': 'passe_quebra_linha',
+        'Passe QL recebido': 'passe_ql_recebido',
+    }
+
+    jogador = models.ForeignKey(Jogador, related_name='estatisticas_confronto', on_delete=models.CASCADE)
+    confronto = models.ForeignKey(Confronto, related_name='estatisticas_jogadores', on_delete=models.CASCADE)
+    tempo = models.IntegerField()  # 1 ou 2 (lances sem tempo definido contam no primeiro tempo)
+    titular = models.BooleanField(default=False)
+    substituto = models.BooleanField(default=False)
+    minutos = models.IntegerField(default=0)
+
+    # desempenho
+    gols = models.IntegerField(default=0)
+    gols_de_penalti = models.IntegerField(default=0)
+    penaltis_perdidos = models.IntegerField(default=0)
+    assistencias = models.IntegerField(default=0)
+    chutes_pra_fora = models.IntegerField(default=0)
+    chutes_defendidos = models.IntegerField(default=0)
+    chutes_na_trave = models.IntegerField(default=0)
+    impedimentos = models.IntegerField(default=0)
+
+    # desempenho defensivo
+    cartao_amarelo = models.IntegerField(default=0)
+    cartao_vermelho = models.IntegerField(default=0)
+    desarmes = models.IntegerField(default=0)
+    roubadas_de_bola = models.IntegerField(default=0)
+    faltas_cometidas = models.IntegerField(default=0)
+    faltas_sofridas = models.IntegerField(default=0)
+    faltas_sofridas_para_cartao = models.IntegerField(default=0)
+    finalizacoes_sofridas = models.IntegerField(default=0)
+    finalizacoes_perigosas_sofridas = models.IntegerField(default=0)
+    gols_sofridos = models.IntegerField(default=0)
+
+    # esperado
+    gols_esperados = models.IntegerField(default=0)
+    assists_esperados = models.IntegerField(default=0)
+
+    # progressao
+    progressao_com_a_bola = models.IntegerField(default=0)
+    passe_quebra_linha = models.IntegerField(default=0)
+    passe_ql_recebido = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('jogador', 'confronto', 'tempo')
+
+    def __str__(self):
+        return f"{self.jogador} - {self.confronto_id} ({self.tempo}º tempo)"
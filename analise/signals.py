@@ -0,0 +1,166 @@
+from functools import partial
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save, m2m_changed
+from django.dispatch import receiver
+from analise import models
+from analise.cache_estatisticas import invalidar_confronto, invalidar_confrontos, invalidar_tudo
+from analise.estatisticas import atualizar_estatisticas_confrontos
+from analise.tipos_lance import invalidar_registro
+
+
+class _ConfrontosAlterados(set):
+    # confrontos alterados na transação, recalculados juntos pelo primeiro on_commit do lote que rodar
+    # um Tipo_Lance alterado depois do lote agendado: o registro precisa ser recarregado antes do recálculo
+    recarregar_registro = False
+
+    def __call__(self):
+        # o lote sai da conexão e é esvaziado: os demais on_commit agendados para ele não fazem nada
+        conexao = transaction.get_connection()
+        if getattr(conexao, '_confrontos_alterados', None) is self:
+            conexao._confrontos_alterados = None
+        confronto_ids = list(self)
+        self.clear()
+        if not confronto_ids:
+            return
+        if self.recarregar_registro:
+            self.recarregar_registro = False
+            invalidar_registro()
+        # confrontos apagados na transação não têm mais o que recalcular (a invalidação fica com confronto_apagado)
+        campeonatos = dict(models.Confronto.objects.filter(id__in=confronto_ids).values_list('id', 'campeonato_id'))
+        if campeonatos:
+            atualizar_estatisticas_confrontos(list(campeonatos))
+            invalidar_confrontos(campeonatos)
+
+
+def confronto_alterado(confronto_id):
+    """
+    Marca o confronto para ser recalculado depois do commit.
+    Todos os confrontos marcados na mesma transação são recalculados juntos uma única vez,
+    então uma exclusão em cascata não recalcula o mesmo confronto uma vez por registro apagado.
+    """
+    if confronto_id is None:
+        return
+    conexao = transaction.get_connection()
+    pendentes = getattr(conexao, '_confrontos_alterados', None)
+    if pendentes is None:
+        pendentes = conexao._confrontos_alterados = _ConfrontosAlterados()
+    # fora de uma transação o on_commit roda na hora, então o confronto entra no lote antes de agendar.
+    # Cada marcação agenda o lote de novo: se um savepoint (ou a transação) for desfeito junto com o on_commit
+    # que agendou o lote, o próximo confronto marcado ainda leva o lote inteiro para o commit.
+    pendentes.add(confronto_id)
+    transaction.on_commit(pendentes)
+
+
+@receiver(pre_save, sender=models.Lance)
+@receiver(pre_save, sender=models.Substituicao)
+@receiver(pre_save, sender=models.Escalacao)
+def guardar_confronto_anterior(sender, instance, **kwargs):
+    # se o registro mudar de confronto, o confronto antigo também precisa ser recalculado
+    if instance.pk:
+        instance._confronto_id_anterior = sender.objects.filter(pk=instance.pk).values_list('confronto_id', flat=True).first()
+
+
+@receiver(post_save, sender=models.Lance)
+@receiver(post_save, sender=models.Substituicao)
+@receiver(post_save, sender=models.Escalacao)
+def registro_salvo(sender, instance, **kwargs):
+    confronto_anterior = getattr(instance, '_confronto_id_anterior', None)
+    if confronto_anterior is not None and confronto_anterior != instance.confronto_id:
+        confronto_alterado(confronto_anterior)
+    confronto_alterado(instance.confronto_id)
+
+
+@receiver(post_delete, sender=models.Lance)
+@receiver(post_delete, sender=models.Substituicao)
+@receiver(post_delete, sender=models.Escalacao)
+def registro_apagado(sender, instance, **kwargs):
+    confronto_alterado(instance.confronto_id)
+
+
+@receiver(pre_save, sender=models.Confronto)
+def guardar_campeonato_anterior(sender, instance, **kwargs):
+    if instance.pk:
+        instance._campeonato_id_anterior = sender.objects.filter(pk=instance.pk).values_list('campeonato_id', flat=True).first()
+
+
+@receiver(post_save, sender=models.Confronto)
+def confronto_salvo(sender, instance, created, **kwargs):
+    # acréscimos alterados mudam os minutos jogados; um confronto novo muda as partidas do campeonato
+    campeonato_anterior = getattr(instance, '_campeonato_id_anterior', None)
+    if campeonato_anterior is not None and campeonato_anterior != instance.campeonato_id:
+        transaction.on_commit(partial(invalidar_confronto, instance.id, campeonato_anterior))
+    confronto_alterado(instance.id)
+
+
+@receiver(post_delete, sender=models.Confronto)
+def confronto_apagado(sender, instance, **kwargs):
+    transaction.on_commit(partial(invalidar_confronto, instance.id, instance.campeonato_id))
+
+
+@receiver(post_save, sender=models.Jogador)
+@receiver(post_delete, sender=models.Jogador)
+@receiver(post_save, sender=models.Tipo_Lance)
+@receiver(post_delete, sender=models.Tipo_Lance)
+def cadastro_alterado(sender, **kwargs):
+    # nomes de jogadores e tipos de lance aparecem em todas as respostas de estatísticas
+    transaction.on_commit(invalidar_tudo)
+
+
+@receiver(pre_save, sender=models.Tipo_Lance)
+def guardar_nome_anterior(sender, instance, **kwargs):
+    if instance.pk:
+        instance._tipo_lance_anterior = sender.objects.filter(pk=instance.pk).values_list('tipo_lance', flat=True).first()
+
+
+def registro_alterado():
+    transaction.on_commit(invalidar_registro)
+    # um lote agendado antes nesta transação roda antes desse on_commit
+    pendentes = getattr(transaction.get_connection(), '_confrontos_alterados', None)
+    if pendentes is not None:
+        pendentes.recarregar_registro = True
+
+
+@receiver(post_save, sender=models.Tipo_Lance)
+def tipo_lance_salvo(sender, instance, created, **kwargs):
+    registro_alterado()
+    # as estatísticas materializadas mapeiam os contadores pelo nome do tipo de lance: só um nome que troca
+    # de contador muda alguma linha, e só nos confrontos que têm lances desse tipo (um tipo novo ainda não tem)
+    campos = models.EstatisticaJogadorConfronto.CAMPOS_POR_TIPO_LANCE
+    nome_anterior = getattr(instance, '_tipo_lance_anterior', None)
+    if not created and campos.get(nome_anterior) != campos.get(instance.tipo_lance):
+        transaction.on_commit(partial(recalcular_confrontos_do_tipo, instance.id))
+
+
+@receiver(post_delete, sender=models.Tipo_Lance)
+def tipo_lance_apagado(sender, **kwargs):
+    # os lances do tipo já saíram em cascata, cada um marcando o seu confronto
+    registro_alterado()
+
+
+def recalcular_confrontos_do_tipo(tipo_lance_id):
+    # roda depois de invalidar_registro, então as linhas já saem com o nome novo
+    campeonatos = dict(
+        models.Confronto.objects.filter(lance__tipo_lance_id=tipo_lance_id).distinct().values_list('id', 'campeonato_id')
+    )
+    if campeonatos:
+        atualizar_estatisticas_confrontos(list(campeonatos))
+        invalidar_confrontos(campeonatos)
+
+
+@receiver(m2m_changed, sender=models.Escalacao.jogadores.through)
+def escalacao_jogadores_alterados(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        # escalacao.jogadores.add/remove/clear
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            confronto_alterado(instance.confronto_id)
+        return
+
+    # jogador.escalacoes.add/remove/clear
+    if action == 'pre_clear':
+        instance._escalacoes_anteriores = list(instance.escalacoes.values_list('confronto_id', flat=True))
+    elif action == 'post_clear':
+        for confronto_id in getattr(instance, '_escalacoes_anteriores', []):
+            confronto_alterado(confronto_id)
+    elif action in ('post_add', 'post_remove'):
+        for confronto_id in models.Escalacao.objects.filter(pk__in=pk_set).values_list('confronto_id', flat=True):
+            confronto_alterado(confronto_id)
@@ -1,3 +1,806 @@
+from collections import defaultdict
+from datetime import date
+from unittest import mock
+from django.core.cache import cache
+from django.db import transaction
 from django.test import TestCase
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from analise import models
+from analise.campo import zona
+from analise.em_campo import ADVERSARIO_ID, estado_em_campo
+from analise.api import serializers
+from analise.api.filters import LanceFilter
+from analise.estatisticas import atualizar_estatisticas_confrontos, ranquear, reconstruir_estatisticas
+from analise.indice_lances import contar_lances_na_janela
+from analise.metricas import CAMPOS_JOGADOR, CAMPOS_TIME, Plano
+from analise.minutos import calcular_periodos, minutos_na_janela
+from analise.tipos_lance import registro
 
-# Create your tests here.
+
+class LancesPorConfrontoTests(TestCase):
+    # /lances/filtrar_por_confronto/ monta o JSON a partir de uma única consulta (serializar_lances_confronto)
+
+    @classmethod
+    def setUpTestData(cls):
+        campeonato = models.Campeonato.objects.create(nome='Campeonato')
+        time_a = models.Time.objects.create(nome='Time A')
+        time_b = models.Time.objects.create(nome='Time B')
+        cls.confronto = models.Confronto.objects.create(time_a=time_a, time_b=time_b, campeonato=campeonato, ano=date(2024, 3, 1))
+        cls.jogadores = [
+            models.Jogador.objects.create(nome='Atacante', posicao='Atacante'),
+            models.Jogador.objects.create(nome='Meia', posicao='Meia'),
+        ]
+        cls.tipos = [
+            models.Tipo_Lance.objects.create(tipo_lance='Gol'),
+            models.Tipo_Lance.objects.create(tipo_lance='Desarme'),
+        ]
+        cls.usuario = models.CustomUser.objects.create_user('analista@teste.com', 'Analista')
+
+    def criar_lances(self, quantidade):
+        for indice in range(quantidade):
+            models.Lance.objects.create(
+                confronto=self.confronto,
+                minuto=indice * 7 % 95,
+                jogador=self.jogadores[indice % 2],
+                tipo_lance=self.tipos[indice % 2],
+                link_video='https://videos.exemplo.com/lance' if indice % 3 else None,
+                tempo=[None, 1, 2][indice % 3],
+            )
+
+    def filtrar_por_confronto(self):
+        cliente = APIClient()
+        cliente.force_authenticate(self.usuario)
+        return cliente.get('/lances/filtrar_por_confronto/', {'confronto_id': self.confronto.id})
+
+    def test_saida_igual_ao_lance_serializer2(self):
+        self.criar_lances(12)
+        lances = models.Lance.objects.filter(confronto=self.confronto).order_by('-tempo', '-minuto', '-id')
+
+        esperado = JSONRenderer().render(serializers.LanceSerializer2(lances, many=True).data)
+        self.assertEqual(JSONRenderer().render(serializers.serializar_lances_confronto(lances)), esperado)
+        self.assertEqual(self.filtrar_por_confronto().content, esperado)
+
+    def test_numero_de_consultas_constante(self):
+        self.criar_lances(3)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.filtrar_por_confronto().json()), 3)
+
+        self.criar_lances(20)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.filtrar_por_confronto().json()), 23)
+
+
+class LancesCoordenadaTests(TestCase):
+    # /lancescoordenada/ monta o JSON do LanceCoordenadaSerializer a partir de uma única consulta (serializar_lances_coordenada)
+
+    @classmethod
+    def setUpTestData(cls):
+        campeonato = models.Campeonato.objects.create(nome='Campeonato')
+        time_a = models.Time.objects.create(nome='Time A')
+        cls.confronto = models.Confronto.objects.create(time_a=time_a, campeonato=campeonato, ano=date(2024, 3, 1))
+        jogadores = [models.Jogador.objects.create(nome=nome, posicao='Meia') for nome in ('Meia', 'Volante')]
+        tipos = [models.Tipo_Lance.objects.create(tipo_lance=nome) for nome in ('Passe Quebra linha', 'Desarme')]
+        # inteiros, casas decimais cheias, zero, borda do campo e coordenadas ausentes
+        coordenadas = [
+            ('50', '20', None, None),
+            ('123.456789', '0.000001', '599.999999', '399.5'),
+            ('0', '0', '0.1', '12.34'),
+            (None, None, None, None),
+            ('600', '400', '300.000001', '1.999999'),
+        ]
+        for indice, (x, y, x_final, y_final) in enumerate(coordenadas):
+            models.Lance.objects.create(
+                confronto=cls.confronto, minuto=indice * 11, jogador=jogadores[indice % 2], tipo_lance=tipos[indice % 2], tempo=1,
+                coordenadaX=x, coordenadaY=y, coordenadaXFinal=x_final, coordenadaYFinal=y_final,
+            )
+        cls.usuario = models.CustomUser.objects.create_user('analista@teste.com', 'Analista')
+
+    def test_saida_igual_ao_lance_coordenada_serializer(self):
+        lances = models.Lance.objects.filter(confronto=self.confronto).order_by('id')
+
+        esperado = JSONRenderer().render(serializers.LanceCoordenadaSerializer(lances, many=True).data)
+        self.assertEqual(JSONRenderer().render(serializers.serializar_lances_coordenada(lances)), esperado)
+
+        cliente = APIClient()
+        cliente.force_authenticate(self.usuario)
+        self.assertEqual(cliente.get('/lancescoordenada/filtrar_por_confronto/', {'confronto_id': self.confronto.id}).content, esperado)
+        self.assertEqual(cliente.get('/lancescoordenada/').content, esperado)
+
+
+class EstatisticasPorTempoTests(TestCase):
+    # group_by=tempo e ?tempo=N dão o mesmo resultado para o mesmo tempo, nos jogadores e no time
+
+    @classmethod
+    def setUpTestData(cls):
+        # os callbacks dos signals rodam aqui: registro de tipos recarregado e estatísticas materializadas
+        with cls.captureOnCommitCallbacks(execute=True):
+            campeonato = cls.campeonato = models.Campeonato.objects.create(nome='Campeonato')
+            time_a = cls.time_a = models.Time.objects.create(nome='Time A')
+            goleiro = models.Jogador.objects.create(nome='Goleiro', posicao='Goleiro')
+            atacante = models.Jogador.objects.create(nome='Atacante', posicao='Atacante')
+            reserva = models.Jogador.objects.create(nome='Reserva', posicao='Atacante')
+            # todos os tipos usados pelas métricas, para os endpoints não recusarem tipos não cadastrados
+            tipos = {
+                nome: models.Tipo_Lance.objects.create(tipo_lance=nome)
+                for nome in sorted({*Plano(CAMPOS_JOGADOR).tipos_lance, *Plano(CAMPOS_TIME).tipos_lance})
+            }
+            gol, desarme = tipos['Gol'], tipos['Desarme']
+            for indice in range(2):
+                confronto = models.Confronto.objects.create(time_a=time_a, campeonato=campeonato, ano=date(2024, 3, 1 + indice))
+                escalacao = models.Escalacao.objects.create(confronto=confronto)
+                escalacao.jogadores.set([goleiro, atacante])
+                if indice == 0:
+                    # o atacante titular sai no intervalo e não joga o segundo tempo
+                    models.Substituicao.objects.create(confronto=confronto, minuto=45, jogador_entrada=reserva, jogador_saida=atacante)
+                models.Lance.objects.create(confronto=confronto, minuto=10, jogador=atacante, tipo_lance=gol, tempo=1)
+                models.Lance.objects.create(confronto=confronto, minuto=30, jogador=goleiro, tipo_lance=desarme, tempo=None)
+                models.Lance.objects.create(confronto=confronto, minuto=70, jogador=reserva if indice == 0 else atacante, tipo_lance=gol, tempo=2)
+        cls.usuario = models.CustomUser.objects.create_user('analista@teste.com', 'Analista')
+
+    def setUp(self):
+        cache.clear()
+        self.cliente = APIClient()
+        self.cliente.force_authenticate(self.usuario)
+
+    def test_agrupado_igual_ao_filtrado(self):
+        for endpoint in ('/estatisticas-jogadores/', '/estatisticas_time/'):
+            agrupado = {bloco['tempo']: bloco['estatisticas'] for bloco in self.cliente.get(endpoint, {'group_by': 'tempo'}).json()}
+            for tempo in (1, 2):
+                with self.subTest(endpoint=endpoint, tempo=tempo):
+                    self.assertEqual(agrupado[tempo], self.cliente.get(endpoint, {'tempo': tempo}).json())
+
+    def test_comparacao_igual_ao_resumo_do_campeonato(self):
+        # todos os confrontos são do mesmo campeonato e do mesmo time
+        for tempo in (None, 1, 2):
+            filtro = {'tempo': tempo} if tempo else {}
+            with self.subTest(tempo=tempo):
+                resumo = self.cliente.get('/estatisticas_time/', {'campeonato': self.campeonato.id, **filtro}).json()
+                comparacao = self.cliente.get(
+                    '/estatisticas_time/', {'campeonatos': self.campeonato.id, 'times': self.time_a.id, **filtro}
+                ).json()
+                self.assertEqual(comparacao['campeonatos'], [{'id': self.campeonato.id, 'estatisticas': resumo}])
+                self.assertEqual(comparacao['times'], [{'id': self.time_a.id, 'estatisticas': resumo}])
+
+    def test_partida_no_tempo_so_conta_quem_jogou(self):
+        segundo_tempo = {jogador['nome']: jogador for jogador in self.cliente.get('/estatisticas-jogadores/', {'tempo': 2}).json()}
+        self.assertEqual(segundo_tempo['Atacante']['partidas_jogadas'], 1)
+        self.assertEqual(segundo_tempo['Reserva']['partidas_jogadas'], 1)
+        self.assertEqual(segundo_tempo['Goleiro']['partidas_jogadas'], 2)
+
+
+class RankingTests(TestCase):
+    # /estatisticas-jogadores/ranking/ ranqueia pela coluna da métrica e só lê os jogadores ranqueados
+
+    @classmethod
+    def setUpTestData(cls):
+        with cls.captureOnCommitCallbacks(execute=True):
+            campeonato = models.Campeonato.objects.create(nome='Campeonato')
+            time_a = models.Time.objects.create(nome='Time A')
+            confronto = models.Confronto.objects.create(time_a=time_a, campeonato=campeonato, ano=date(2024, 3, 1))
+            for nome in sorted(Plano(CAMPOS_JOGADOR).tipos_lance):
+                models.Tipo_Lance.objects.create(tipo_lance=nome)
+            gol = models.Tipo_Lance.objects.get(tipo_lance='Gol')
+            # Zé e Ana empatam em segundo, Bia fica de fora do top 2 com os empatados
+            for nome, gols in (('Zé', 2), ('Caio', 3), ('Ana', 2), ('Bia', 1)):
+                jogador = models.Jogador.objects.create(nome=nome, posicao='Atacante')
+                for minuto in range(gols):
+                    models.Lance.objects.create(confronto=confronto, minuto=minuto, jogador=jogador, tipo_lance=gol, tempo=1)
+        cls.usuario = models.CustomUser.objects.create_user('analista@teste.com', 'Analista')
+
+    def setUp(self):
+        cache.clear()
+        self.cliente = APIClient()
+        self.cliente.force_authenticate(self.usuario)
+
+    def test_ranquear(self):
+        self.assertEqual(ranquear([2, 3, 2, 1], 2), [(1, 1), (2, 0), (2, 2)])
+        self.assertEqual(ranquear([1, 1, 1], 1), [(1, 0), (1, 1), (1, 2)])
+        self.assertEqual(ranquear([], 5), [])
+
+    def test_empatados_em_ordem_de_nome(self):
+        ranking = self.cliente.get('/estatisticas-jogadores/ranking/', {'metrica': 'gols', 'n': 2}).json()['ranking']
+        self.assertEqual([(linha['colocacao'], linha['nome'], linha['valor']) for linha in ranking], [(1, 'Caio', 3), (2, 'Ana', 2), (2, 'Zé', 2)])
+
+
+class EstatisticasMaterializadasTests(TestCase):
+    # os signals mantêm EstatisticaJogadorConfronto igual a uma reconstrução completa depois de cada alteração
+
+    @classmethod
+    def setUpTestData(cls):
+        # os callbacks rodam aqui, para o lote da criação não continuar aberto durante os testes
+        with cls.captureOnCommitCallbacks(execute=True):
+            campeonato = models.Campeonato.objects.create(nome='Campeonato')
+            time_a = models.Time.objects.create(nome='Time A')
+            cls.confrontos = [
+                models.Confronto.objects.create(time_a=time_a, campeonato=campeonato, ano=date(2024, 3, dia), acrescimo1tempo=2)
+                for dia in (1, 8)
+            ]
+            cls.jogadores = [models.Jogador.objects.create(nome=nome, posicao='Meia') for nome in ('Titular', 'Outro titular', 'Reserva')]
+            cls.gol = models.Tipo_Lance.objects.create(tipo_lance='Gol')
+            cls.desarme = models.Tipo_Lance.objects.create(tipo_lance='Desarme')
+            cls.cartao_vermelho = models.Tipo_Lance.objects.create(tipo_lance='Cartão Vermelho')
+            for confronto in cls.confrontos:
+                escalacao = models.Escalacao.objects.create(confronto=confronto)
+                escalacao.jogadores.set(cls.jogadores[:2])
+                models.Lance.objects.create(confronto=confronto, minuto=12, jogador=cls.jogadores[0], tipo_lance=cls.gol, tempo=1)
+            cls.substituicao = models.Substituicao.objects.create(
+                confronto=cls.confrontos[0], minuto=60, jogador_entrada=cls.jogadores[2], jogador_saida=cls.jogadores[1]
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def materializadas(self):
+        return sorted(models.EstatisticaJogadorConfronto.objects.values_list(
+            *(campo.attname for campo in models.EstatisticaJogadorConfronto._meta.concrete_fields if campo.attname != 'id')
+        ))
+
+    def assertIgualAReconstrucao(self):
+        mantidas = self.materializadas()
+        reconstruir_estatisticas()
+        self.assertEqual(mantidas, self.materializadas())
+
+    def test_criar_lances(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Lance.objects.create(confronto=self.confrontos[0], minuto=70, jogador=self.jogadores[2], tipo_lance=self.gol, tempo=2)
+            models.Lance.objects.create(confronto=self.confrontos[1], minuto=80, jogador=self.jogadores[1], tipo_lance=self.cartao_vermelho, tempo=2)
+
+        reserva = models.EstatisticaJogadorConfronto.objects.get(jogador=self.jogadores[2], confronto=self.confrontos[0], tempo=2)
+        self.assertEqual(reserva.gols, 1)
+        self.assertIgualAReconstrucao()
+
+    def test_alterar_lance_e_substituicao(self):
+        lance = models.Lance.objects.get(confronto=self.confrontos[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            # o lance muda de confronto: os dois confrontos são recalculados
+            lance.confronto = self.confrontos[1]
+            lance.tempo = 2
+            lance.save()
+            self.substituicao.minuto = 75
+            self.substituicao.save()
+
+        self.assertFalse(models.EstatisticaJogadorConfronto.objects.filter(confronto=self.confrontos[0], gols__gt=0).exists())
+        self.assertIgualAReconstrucao()
+
+    def test_apagar_registros(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.substituicao.delete()
+            models.Lance.objects.filter(confronto=self.confrontos[1]).delete()
+        self.assertIgualAReconstrucao()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.confrontos[0].delete()
+        self.assertFalse(models.EstatisticaJogadorConfronto.objects.filter(confronto_id=self.confrontos[0].id).exists())
+        self.assertIgualAReconstrucao()
+
+    def test_renomear_tipo_lance(self):
+        # 'Desarme' -> 'Roubada de Bola' troca de contador: só o confronto com lances do tipo é recalculado
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Lance.objects.create(confronto=self.confrontos[1], minuto=20, jogador=self.jogadores[1], tipo_lance=self.desarme, tempo=1)
+        with mock.patch('analise.signals.atualizar_estatisticas_confrontos', wraps=atualizar_estatisticas_confrontos) as atualizar:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.desarme.tipo_lance = 'Roubada de Bola'
+                self.desarme.save()
+        atualizar.assert_called_once_with([self.confrontos[1].id])
+        self.assertEqual(models.EstatisticaJogadorConfronto.objects.get(jogador=self.jogadores[1], confronto=self.confrontos[1], tempo=1).roubadas_de_bola, 1)
+        self.assertIgualAReconstrucao()
+
+        # um nome sem contador para outro sem contador só recarrega o registro
+        outro = models.Tipo_Lance.objects.create(tipo_lance='Escanteio')
+        with mock.patch('analise.signals.atualizar_estatisticas_confrontos') as atualizar:
+            with self.captureOnCommitCallbacks(execute=True):
+                outro.tipo_lance = 'Escanteio cobrado'
+                outro.save()
+        atualizar.assert_not_called()
+        self.assertEqual(registro().ids_do_tipo('Escanteio cobrado'), [outro.id])
+
+    def test_tipo_lance_criado_depois_do_lote(self):
+        # o lote já estava agendado quando o tipo foi criado, e mesmo assim conta os lances do tipo novo
+        registro()
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                models.Lance.objects.create(confronto=self.confrontos[0], minuto=20, jogador=self.jogadores[1], tipo_lance=self.desarme, tempo=1)
+                roubada = models.Tipo_Lance.objects.create(tipo_lance='Roubada de Bola')
+                models.Lance.objects.create(confronto=self.confrontos[0], minuto=30, jogador=self.jogadores[1], tipo_lance=roubada, tempo=1)
+
+        self.assertEqual(models.EstatisticaJogadorConfronto.objects.get(jogador=self.jogadores[1], confronto=self.confrontos[0], tempo=1).roubadas_de_bola, 1)
+        self.assertIgualAReconstrucao()
+
+    def test_transacao_recalcula_uma_vez(self):
+        with mock.patch('analise.signals.atualizar_estatisticas_confrontos', wraps=atualizar_estatisticas_confrontos) as atualizar:
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    for minuto in (20, 30, 50):
+                        for confronto in self.confrontos:
+                            models.Lance.objects.create(confronto=confronto, minuto=minuto, jogador=self.jogadores[1], tipo_lance=self.desarme, tempo=1 if minuto < 45 else 2)
+                    self.confrontos[1].escalacao_set.get().jogadores.remove(self.jogadores[1])
+
+        # um único recálculo cobre os dois confrontos
+        atualizar.assert_called_once()
+        self.assertCountEqual(atualizar.call_args.args[0], [confronto.id for confronto in self.confrontos])
+        self.assertIgualAReconstrucao()
+
+    def test_savepoint_desfeito_nao_perde_o_lote(self):
+        # o on_commit que agendou o lote some com o savepoint, mas a próxima marcação agenda o lote de novo
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                models.Lance.objects.create(confronto=self.confrontos[0], minuto=20, jogador=self.jogadores[1], tipo_lance=self.desarme, tempo=1)
+                try:
+                    with transaction.atomic():
+                        models.Lance.objects.create(confronto=self.confrontos[1], minuto=20, jogador=self.jogadores[1], tipo_lance=self.desarme, tempo=1)
+                        raise ValueError
+                except ValueError:
+                    pass
+                models.Lance.objects.create(confronto=self.confrontos[0], minuto=30, jogador=self.jogadores[1], tipo_lance=self.desarme, tempo=1)
+
+        self.assertIgualAReconstrucao()
+
+
+class CacheRespostasTests(TestCase):
+    # respostas das estatísticas em cache, invalidadas só no escopo (jogo, campeonato, geral) que os dados alterados afetam
+
+    @classmethod
+    def setUpTestData(cls):
+        with cls.captureOnCommitCallbacks(execute=True):
+            time_a = models.Time.objects.create(nome='Time A')
+            cls.jogadores = [models.Jogador.objects.create(nome=nome, posicao='Meia') for nome in ('Titular', 'Reserva')]
+            tipos = {nome: models.Tipo_Lance.objects.create(tipo_lance=nome) for nome in sorted(Plano(CAMPOS_JOGADOR).tipos_lance)}
+            cls.gol = tipos['Gol']
+            cls.campeonatos = [models.Campeonato.objects.create(nome=nome) for nome in ('Estadual', 'Copa')]
+            cls.confrontos = [
+                models.Confronto.objects.create(time_a=time_a, campeonato=campeonato, ano=date(2024, 3, 1 + indice))
+                for indice, campeonato in enumerate(cls.campeonatos)
+            ]
+            for confronto in cls.confrontos:
+                models.Escalacao.objects.create(confronto=confronto).jogadores.set(cls.jogadores[:1])
+                models.Lance.objects.create(confronto=confronto, minuto=10, jogador=cls.jogadores[0], tipo_lance=cls.gol, tempo=1)
+        cls.usuario = models.CustomUser.objects.create_user('staff@teste.com', 'Staff', is_staff=True)
+
+    def setUp(self):
+        cache.clear()
+        self.cliente = APIClient()
+        self.cliente.force_authenticate(self.usuario)
+        self.filtros = {
+            'jogo alterado': {'jogo': self.confrontos[0].id},
+            'outro jogo': {'jogo': self.confrontos[1].id},
+            'campeonato alterado': {'campeonato': self.campeonatos[0].id},
+            'outro campeonato': {'campeonato': self.campeonatos[1].id},
+            'sem filtro': {},
+        }
+
+    def respostas_depois_de(self, alterar):
+        # X-Cache de cada filtro depois de guardar as respostas e alterar os dados
+        for filtro in self.filtros.values():
+            self.cliente.get('/estatisticas-jogadores/', filtro)
+        with self.captureOnCommitCallbacks(execute=True):
+            alterar()
+        return {nome: self.cliente.get('/estatisticas-jogadores/', filtro)['X-Cache'] for nome, filtro in self.filtros.items()}
+
+    def test_hit_e_miss_contados(self):
+        self.assertEqual(self.cliente.delete('/estatisticas/cache/').status_code, 204)
+        primeira = self.cliente.get('/estatisticas-jogadores/', {'jogo': self.confrontos[0].id})
+        segunda = self.cliente.get('/estatisticas-jogadores/', {'jogo': self.confrontos[0].id})
+        self.assertEqual((primeira['X-Cache'], segunda['X-Cache']), ('MISS', 'HIT'))
+        self.assertEqual(primeira.json(), segunda.json())
+        self.assertEqual(self.cliente.get('/estatisticas/cache/').json(), {'acertos': 1, 'falhas': 1})
+
+        self.cliente.delete('/estatisticas/cache/')
+        self.assertEqual(self.cliente.get('/estatisticas/cache/').json(), {'acertos': 0, 'falhas': 0})
+
+    def test_alteracao_no_confronto_invalida_so_o_seu_escopo(self):
+        confronto = self.confrontos[0]
+        alteracoes = {
+            'Lance': lambda: models.Lance.objects.create(confronto=confronto, minuto=20, jogador=self.jogadores[1], tipo_lance=self.gol, tempo=1),
+            'Substituicao': lambda: models.Substituicao.objects.create(
+                confronto=confronto, minuto=60, jogador_entrada=self.jogadores[1], jogador_saida=self.jogadores[0]
+            ),
+            'Escalacao': lambda: confronto.escalacao_set.get().jogadores.add(self.jogadores[1]),
+            'Confronto': lambda: models.Confronto.objects.get(id=confronto.id).save(),
+        }
+        esperado = {
+            'jogo alterado': 'MISS',
+            'outro jogo': 'HIT',
+            'campeonato alterado': 'MISS',
+            'outro campeonato': 'HIT',
+            'sem filtro': 'MISS',
+        }
+        for modelo, alterar in alteracoes.items():
+            with self.subTest(modelo=modelo):
+                self.assertEqual(self.respostas_depois_de(alterar), esperado)
+
+    def test_alteracao_de_jogador_invalida_tudo(self):
+        def renomear():
+            self.jogadores[1].nome = 'Reserva renomeado'
+            self.jogadores[1].save()
+
+        self.assertEqual(set(self.respostas_depois_de(renomear).values()), {'MISS'})
+
+
+class JanelaDeMinutosTests(TestCase):
+    # contagens pelos índices acumulados e minutos recortados na janela, conferidos contra uma varredura direta
+
+    JANELAS = [
+        (None, None, None), (10, 50, None), (0, 0, None), (44, 45, None), (45, 90, 2),
+        (20, 70, 1), (None, 44, 1), (50, None, 2), (60, 30, None), (100, None, None),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        with cls.captureOnCommitCallbacks(execute=True):
+            campeonato = models.Campeonato.objects.create(nome='Campeonato')
+            time_a = models.Time.objects.create(nome='Time A')
+            cls.jogadores = [models.Jogador.objects.create(nome=f'Jogador {numero}', posicao='Meia') for numero in range(3)]
+            cls.tipos = {nome: models.Tipo_Lance.objects.create(tipo_lance=nome) for nome in ('Gol', 'Desarme', 'Cartão Vermelho')}
+            cls.confrontos = [
+                models.Confronto.objects.create(time_a=time_a, campeonato=campeonato, ano=date(2024, 3, 1), acrescimo1tempo=3, acrescimo2tempo=5),
+                models.Confronto.objects.create(time_a=time_a, campeonato=campeonato, ano=date(2024, 3, 8)),
+            ]
+            for confronto in cls.confrontos:
+                models.Escalacao.objects.create(confronto=confronto).jogadores.set(cls.jogadores[:2])
+
+            # primeiro confronto: o jogador 2 entra no lugar do 1 aos 60 e o jogador 0 é expulso aos 80
+            models.Substituicao.objects.create(confronto=cls.confrontos[0], minuto=60, jogador_entrada=cls.jogadores[2], jogador_saida=cls.jogadores[1])
+            # segundo confronto: o jogador 2 entra no lugar do 0 aos 30 do primeiro tempo
+            models.Substituicao.objects.create(
+                confronto=cls.confrontos[1], minuto=30, primeiro_tempo=True, jogador_entrada=cls.jogadores[2], jogador_saida=cls.jogadores[0]
+            )
+
+            lances = [
+                (0, 0, 'Gol', 0, 1), (0, 0, 'Desarme', 10, None), (0, 1, 'Desarme', 44, 0), (0, 1, 'Gol', 47, 1),
+                (0, 0, 'Gol', 45, 2), (0, 2, 'Desarme', 70, 2), (0, 0, 'Cartão Vermelho', 80, 2), (0, 2, 'Gol', 97, 2),
+                (1, 0, 'Desarme', 20, 1), (1, 2, 'Gol', 30, 1), (1, 1, 'Gol', 50, 2), (1, 1, 'Desarme', 50, 2), (1, 2, 'Desarme', 90, 2),
+            ]
+            for confronto, jogador, tipo, minuto, tempo in lances:
+                models.Lance.objects.create(
+                    confronto=cls.confrontos[confronto], jogador=cls.jogadores[jogador], tipo_lance=cls.tipos[tipo], minuto=minuto, tempo=tempo
+                )
+
+    def setUp(self):
+        cache.clear()
+
+    def filtro(self, minuto_inicio, minuto_fim, tempo):
+        parametros = {'minuto_inicio': minuto_inicio, 'minuto_fim': minuto_fim, 'tempo': tempo}
+        return {nome: str(valor) for nome, valor in parametros.items() if valor is not None}
+
+    def test_contagem_igual_a_varredura(self):
+        confrontos = models.Confronto.objects.all()
+        for janela in self.JANELAS:
+            with self.subTest(janela=janela):
+                esperado = defaultdict(int)
+                for jogador_id, tipo_lance_id in LanceFilter(self.filtro(*janela), queryset=models.Lance.objects.all()).qs.values_list('jogador_id', 'tipo_lance_id'):
+                    esperado[(jogador_id, tipo_lance_id)] += 1
+
+                contagens = contar_lances_na_janela(confrontos, list(self.tipos), *janela)
+                obtido = {
+                    (jogador_id, tipo_lance_id): total
+                    for jogador_id, contagem in contagens.items() for tipo_lance_id, total in contagem.por_id.items() if total
+                }
+                self.assertEqual(obtido, dict(esperado))
+
+    def test_indices_guardados_no_cache(self):
+        confrontos = models.Confronto.objects.all()
+        registro()
+        with self.assertNumQueries(2):
+            contar_lances_na_janela(confrontos, ['Gol'], 10, 50)
+        # com os índices no cache, só a lista de confrontos é consultada
+        with self.assertNumQueries(1):
+            contar_lances_na_janela(confrontos, ['Gol'], 0, 95)
+
+    def test_minutos_recortados_iguais_a_varredura(self):
+        confrontos = models.Confronto.objects.all()
+        periodos = calcular_periodos(confrontos)
+        j0, j1, j2 = (jogador.id for jogador in self.jogadores)
+        a, b = (confronto.id for confronto in self.confrontos)
+        self.assertEqual(periodos, {
+            (j0, a): (0, 83), (j1, a): (0, 63), (j2, a): (63, 98),
+            (j0, b): (0, 30), (j1, b): (0, 90), (j2, b): (30, 90),
+        })
+
+        acrescimos = {confronto.id: confronto.acrescimo1tempo for confronto in self.confrontos}
+        for minuto_inicio, minuto_fim, tempo in self.JANELAS:
+            with self.subTest(janela=(minuto_inicio, minuto_fim, tempo)):
+                # cada minuto jogado no tempo corrido volta para o minuto marcado e o tempo em que aconteceu
+                esperado = defaultdict(int)
+                for (jogador_id, confronto_id), (inicio, fim) in periodos.items():
+                    for relogio in range(inicio, fim):
+                        numero = 1 if relogio < 45 + acrescimos[confronto_id] else 2
+                        minuto = relogio if numero == 1 else relogio - acrescimos[confronto_id]
+                        if tempo not in (None, numero):
+                            continue
+                        if (minuto_inicio is None or minuto >= minuto_inicio) and (minuto_fim is None or minuto <= minuto_fim):
+                            esperado[jogador_id] += 1
+
+                obtido = minutos_na_janela(confrontos, minuto_inicio, minuto_fim, tempo)
+                self.assertEqual({jogador_id: minutos for jogador_id, minutos in obtido.items() if minutos}, dict(esperado))
+
+
+class EmCampoTests(TestCase):
+    # quem está em campo: a escalação com as substituições e os cartões vermelhos reaplicados na ordem da partida
+
+    @classmethod
+    def setUpTestData(cls):
+        with cls.captureOnCommitCallbacks(execute=True):
+            campeonato = models.Campeonato.objects.create(nome='Campeonato')
+            time_a = models.Time.objects.create(nome='Time A')
+            cls.confronto = models.Confronto.objects.create(time_a=time_a, campeonato=campeonato, ano=date(2024, 3, 1))
+            cls.jogadores = {
+                nome: models.Jogador.objects.create(nome=nome, posicao=posicao)
+                for nome, posicao in (
+                    ('Goleiro', 'Goleiro'), ('Zagueiro', 'Zagueiro'), ('Meia', 'Meia'), ('Atacante', 'Atacante'),
+                    ('Reserva expulso', 'Meia'), ('Reserva', 'Zagueiro'),
+                )
+            }
+            models.Jogador.objects.create(id=ADVERSARIO_ID, nome='Adversário', posicao='')
+            cls.cartao_vermelho = models.Tipo_Lance.objects.create(tipo_lance='Cartão Vermelho')
+            models.Escalacao.objects.create(confronto=cls.confronto).jogadores.set(
+                [cls.jogadores[nome] for nome in ('Goleiro', 'Zagueiro', 'Meia', 'Atacante')]
+            )
+            # registrados fora de ordem: o segundo tempo vem antes do primeiro e o lance sem tempo conta no primeiro
+            cls.substituir('Reserva expulso', 'Meia', minuto=50)
+            cls.expulsar('Reserva expulso', minuto=70, tempo=2)
+            cls.expulsar('Atacante', minuto=30, tempo=None)
+            cls.substituir('Reserva', 'Zagueiro', minuto=80)
+            # o expulso não volta a campo, mesmo numa substituição registrada depois
+            cls.substituir('Atacante', 'Goleiro', minuto=85)
+        cls.usuario = models.CustomUser.objects.create_user('analista@teste.com', 'Analista')
+
+    @classmethod
+    def substituir(cls, entrada, saida, minuto):
+        return models.Substituicao.objects.create(
+            confronto=cls.confronto, minuto=minuto, primeiro_tempo=False, jogador_entrada=cls.jogadores[entrada], jogador_saida=cls.jogadores[saida]
+        )
+
+    @classmethod
+    def expulsar(cls, nome, minuto, tempo):
+        return models.Lance.objects.create(confronto=cls.confronto, minuto=minuto, jogador=cls.jogadores[nome], tipo_lance=cls.cartao_vermelho, tempo=tempo)
+
+    def setUp(self):
+        cache.clear()
+        self.cliente = APIClient()
+        self.cliente.force_authenticate(self.usuario)
+
+    def ids(self, *nomes):
+        return {self.jogadores[nome].id for nome in nomes}
+
+    def test_substituicoes_e_expulsoes(self):
+        estado = estado_em_campo(self.confronto.id)
+        self.assertEqual(estado.titulares, self.ids('Goleiro', 'Zagueiro', 'Meia', 'Atacante'))
+        self.assertEqual(estado.jogadores(), [self.jogadores['Reserva'].id])
+        self.assertEqual(estado.sairam, self.ids('Meia', 'Zagueiro', 'Goleiro'))
+        self.assertEqual(estado.expulsos, self.ids('Atacante', 'Reserva expulso'))
+
+    def test_entrou_e_foi_expulso_no_mesmo_minuto(self):
+        # no mesmo minuto a substituição é aplicada antes do cartão
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Substituicao.objects.filter(jogador_saida=self.jogadores['Goleiro']).delete()
+            self.expulsar('Reserva', minuto=80, tempo=2)
+
+        estado = estado_em_campo(self.confronto.id)
+        self.assertEqual(estado.jogadores(), [self.jogadores['Goleiro'].id])
+        self.assertEqual(estado.expulsos, self.ids('Atacante', 'Reserva expulso', 'Reserva'))
+
+    def test_endpoints_ordenados_por_posicao(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Substituicao.objects.filter(jogador_saida=self.jogadores['Goleiro']).delete()
+
+        nomes = lambda url: [jogador['nome'] for jogador in self.cliente.get(url).json()]
+        self.assertEqual(nomes(f'/em_campo/confronto/{self.confronto.id}/'), ['Goleiro', 'Reserva'])
+        self.assertEqual(nomes(f'/escalacao/confronto/{self.confronto.id}/'), ['Goleiro', 'Reserva', 'Adversário'])
+
+    def test_numero_de_consultas_limitado(self):
+        registro()
+        # escalação e eventos (uma consulta cada) e os jogadores, não importa quantos eventos o confronto tem
+        with self.assertNumQueries(3):
+            self.cliente.get(f'/em_campo/confronto/{self.confronto.id}/')
+        with self.captureOnCommitCallbacks(execute=True):
+            for minuto in range(60, 70):
+                self.substituir('Meia', 'Reserva', minuto=minuto)
+                self.substituir('Reserva', 'Meia', minuto=minuto)
+        with self.assertNumQueries(3):
+            self.cliente.get(f'/em_campo/confronto/{self.confronto.id}/')
+        # com o estado em cache, só os jogadores
+        with self.assertNumQueries(1):
+            self.cliente.get(f'/escalacao/confronto/{self.confronto.id}/')
+
+
+class LinhaDoTempoTests(TestCase):
+    # /linha_do_tempo/confronto/<id>/?tempo=&minuto= devolve o estado da partida depois do último evento até o minuto
+
+    @classmethod
+    def setUpTestData(cls):
+        with cls.captureOnCommitCallbacks(execute=True):
+            campeonato = models.Campeonato.objects.create(nome='Campeonato')
+            time_a = models.Time.objects.create(nome='Time A')
+            cls.confronto = models.Confronto.objects.create(time_a=time_a, campeonato=campeonato, ano=date(2024, 3, 1), acrescimo1tempo=2)
+            cls.atacante = models.Jogador.objects.create(nome='Atacante', posicao='Atacante')
+            cls.zagueiro = models.Jogador.objects.create(nome='Zagueiro', posicao='Zagueiro')
+            cls.goleiro = models.Jogador.objects.create(nome='Goleiro', posicao='Goleiro')
+            cls.reserva = models.Jogador.objects.create(nome='Reserva', posicao='Atacante')
+            tipos = {nome: models.Tipo_Lance.objects.create(tipo_lance=nome) for nome in ('Gol', 'Gol sofrido', 'Cartão Amarelo', 'Cartão Vermelho', 'Desarme')}
+            models.Escalacao.objects.create(confronto=cls.confronto).jogadores.set([cls.atacante, cls.zagueiro, cls.goleiro])
+
+            for jogador, tipo, minuto, tempo in [
+                (cls.atacante, 'Gol', 20, 1), (cls.zagueiro, 'Desarme', 30, 1), (cls.zagueiro, 'Cartão Amarelo', 40, None),
+                (cls.goleiro, 'Gol sofrido', 50, 2), (cls.zagueiro, 'Cartão Vermelho', 75, 2),
+            ]:
+                models.Lance.objects.create(confronto=cls.confronto, jogador=jogador, tipo_lance=tipos[tipo], minuto=minuto, tempo=tempo)
+            models.Substituicao.objects.create(confronto=cls.confronto, minuto=60, jogador_entrada=cls.reserva, jogador_saida=cls.atacante)
+        cls.usuario = models.CustomUser.objects.create_user('analista@teste.com', 'Analista')
+
+    def setUp(self):
+        cache.clear()
+        self.cliente = APIClient()
+        self.cliente.force_authenticate(self.usuario)
+
+    def no_minuto(self, tempo, minuto):
+        return self.cliente.get(f'/linha_do_tempo/confronto/{self.confronto.id}/', {'tempo': tempo, 'minuto': minuto}).json()
+
+    def test_estado_no_minuto(self):
+        inicio = self.no_minuto(1, 10)
+        self.assertIsNone(inicio['evento'])
+        self.assertEqual(inicio['placar'], [0, 0])
+        self.assertEqual(inicio['em_campo'], [self.goleiro.id, self.zagueiro.id, self.atacante.id])
+
+        gol = self.no_minuto(1, 20)
+        self.assertEqual(gol['evento'], {'tipo': 'gol', 'jogador': self.atacante.id})
+        self.assertEqual(gol['placar'], [1, 0])
+
+        # começo do segundo tempo: ainda vale o último evento do primeiro (o amarelo sem tempo definido)
+        intervalo = self.no_minuto(2, 45)
+        self.assertEqual((intervalo['tempo'], intervalo['minuto'], intervalo['relogio']), (1, 40, 40))
+        self.assertEqual(intervalo['amarelos'], [self.zagueiro.id])
+
+        substituicao = self.no_minuto(2, 70)
+        self.assertEqual(substituicao['evento'], {'tipo': 'substituicao', 'jogador': self.atacante.id, 'jogador_entrada': self.reserva.id})
+        self.assertEqual(substituicao['relogio'], 62)
+        self.assertEqual(substituicao['placar'], [1, 1])
+        self.assertEqual(substituicao['em_campo'], [self.goleiro.id, self.zagueiro.id, self.reserva.id])
+
+        final = self.no_minuto(2, 95)
+        self.assertEqual(final['vermelhos'], [self.zagueiro.id])
+        self.assertEqual(final['em_campo'], [self.goleiro.id, self.reserva.id])
+
+    def test_linha_do_tempo_completa_em_cache(self):
+        registro()
+        url = f'/linha_do_tempo/confronto/{self.confronto.id}/'
+        with self.assertNumQueries(4):
+            linha = self.cliente.get(url).json()
+        # o desarme não é evento da linha do tempo: o início e mais cinco eventos
+        self.assertEqual(len(linha['momentos']), 6)
+        self.assertEqual([jogador['id'] for jogador in linha['jogadores']], sorted([self.atacante.id, self.zagueiro.id, self.goleiro.id, self.reserva.id]))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.no_minuto(2, 95), linha['momentos'][-1])
+
+    def test_parametros_invalidos(self):
+        url = f'/linha_do_tempo/confronto/{self.confronto.id}/'
+        self.assertEqual(self.cliente.get(url, {'tempo': 1}).status_code, 400)
+        self.assertEqual(self.cliente.get(url, {'tempo': 3, 'minuto': 10}).status_code, 400)
+        self.assertEqual(self.cliente.get('/linha_do_tempo/confronto/999/').status_code, 404)
+
+
+class LancesEmLoteTests(TestCase):
+    # /lances/em_lote/ cria os lances válidos e devolve os erros de cada item inválido pelo índice
+
+    @classmethod
+    def setUpTestData(cls):
+        with cls.captureOnCommitCallbacks(execute=True):
+            campeonato = models.Campeonato.objects.create(nome='Campeonato')
+            time_a = models.Time.objects.create(nome='Time A')
+            cls.confronto = models.Confronto.objects.create(time_a=time_a, campeonato=campeonato, ano=date(2024, 3, 1))
+            cls.jogador = models.Jogador.objects.create(nome='Meia', posicao='Meia')
+            models.Escalacao.objects.create(confronto=cls.confronto).jogadores.set([cls.jogador])
+            cls.gol = models.Tipo_Lance.objects.create(tipo_lance='Gol')
+        cls.usuario = models.CustomUser.objects.create_user('staff@teste.com', 'Staff', is_staff=True)
+
+    def setUp(self):
+        cache.clear()
+        self.cliente = APIClient()
+        self.cliente.force_authenticate(self.usuario)
+
+    def lance(self, minuto, **campos):
+        return {'confronto': self.confronto.id, 'jogador': self.jogador.id, 'tipo_lance': self.gol.id, 'minuto': minuto, 'tempo': 1, **campos}
+
+    def em_lote(self, itens):
+        return self.cliente.post('/lances/em_lote/', itens, format='json')
+
+    def test_sucesso_parcial(self):
+        itens = [
+            self.lance(10, coordenadaX='50.5', coordenadaY='20'),
+            self.lance(12, jogador=999),
+            'não é um lance',
+            self.lance(None),
+            self.lance(80, tempo=2, coordenadaX='550', coordenadaY='300', coordenadaXFinal='580', coordenadaYFinal='310'),
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = self.em_lote(itens)
+
+        self.assertEqual(resposta.status_code, 201)
+        dados = resposta.json()
+        self.assertEqual([lance['minuto'] for lance in dados['criados']], [10, 80])
+        self.assertEqual([erro['indice'] for erro in dados['erros']], [1, 2, 3])
+        self.assertIn('jogador', dados['erros'][0]['erros'])
+        self.assertIn('minuto', dados['erros'][2]['erros'])
+
+        # as zonas calculadas em lote são as mesmas do Lance.save
+        for lance in models.Lance.objects.filter(confronto=self.confronto):
+            self.assertEqual((lance.zona, lance.zona_final), (zona(lance.coordenadaX, lance.coordenadaY), zona(lance.coordenadaXFinal, lance.coordenadaYFinal)))
+        # os confrontos do lote são recalculados depois do commit
+        self.assertEqual(models.EstatisticaJogadorConfronto.objects.get(jogador=self.jogador, confronto=self.confronto, tempo=2).gols, 1)
+
+    def test_lote_invalido(self):
+        self.assertEqual(self.em_lote({'confronto': self.confronto.id}).status_code, 400)
+        self.assertEqual(self.em_lote([]).status_code, 400)
+
+        resposta = self.em_lote([self.lance(10, tipo_lance=999), self.lance('x')])
+        self.assertEqual(resposta.status_code, 400)
+        self.assertEqual([erro['indice'] for erro in resposta.json()['erros']], [0, 1])
+        self.assertFalse(models.Lance.objects.exists())
+
+    def test_numero_de_consultas_constante(self):
+        # uma consulta de ids por chave estrangeira, o savepoint e um único INSERT (80 lances cabem num lote até no SQLite)
+        with self.assertNumQueries(6):
+            self.em_lote([self.lance(minuto) for minuto in range(3)])
+        with self.assertNumQueries(6):
+            self.em_lote([self.lance(minuto) for minuto in range(80)])
+        self.assertEqual(models.Lance.objects.count(), 83)
+
+
+class DefinirEscalacaoTests(TestCase):
+    # /definir_escalacao/<confronto_id>/ aplica só a diferença para a escalação atual e recalcula o confronto uma vez
+
+    @classmethod
+    def setUpTestData(cls):
+        with cls.captureOnCommitCallbacks(execute=True):
+            campeonato = models.Campeonato.objects.create(nome='Campeonato')
+            time_a = models.Time.objects.create(nome='Time A')
+            cls.confronto = models.Confronto.objects.create(time_a=time_a, campeonato=campeonato, ano=date(2024, 3, 1))
+            cls.jogadores = [models.Jogador.objects.create(nome=f'Jogador {numero}', posicao='Meia') for numero in range(4)]
+            models.Escalacao.objects.create(confronto=cls.confronto).jogadores.set(cls.jogadores[:2])
+        cls.usuario = models.CustomUser.objects.create_user('staff@teste.com', 'Staff', is_staff=True)
+
+    def setUp(self):
+        cache.clear()
+        self.cliente = APIClient()
+        self.cliente.force_authenticate(self.usuario)
+
+    def definir(self, dados, confronto_id=None):
+        return self.cliente.put(f'/definir_escalacao/{confronto_id or self.confronto.id}/', dados, format='json')
+
+    def escalados(self):
+        return set(models.Escalacao.jogadores.through.objects.filter(escalacao__confronto=self.confronto).values_list('jogador_id', flat=True))
+
+    def test_aplica_a_diferenca(self):
+        # o jogador 0 sai, o 1 fica e os jogadores 2 e 3 entram
+        desejados = [self.jogadores[1].id, self.jogadores[2].id, self.jogadores[3].id]
+        with mock.patch('analise.signals.atualizar_estatisticas_confrontos', wraps=atualizar_estatisticas_confrontos) as atualizar:
+            with self.captureOnCommitCallbacks(execute=True):
+                resposta = self.definir({'jogadores': desejados})
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(self.escalados(), set(desejados))
+        atualizar.assert_called_once_with([self.confronto.id])
+        titulares = set(models.EstatisticaJogadorConfronto.objects.filter(confronto=self.confronto, titular=True).values_list('jogador_id', flat=True))
+        self.assertEqual(titulares, set(desejados))
+
+    def test_escalacao_igual_nao_recalcula(self):
+        with mock.patch('analise.signals.atualizar_estatisticas_confrontos') as atualizar:
+            with self.captureOnCommitCallbacks(execute=True):
+                resposta = self.definir({'jogadores': [self.jogadores[0].id, self.jogadores[1].id]})
+        self.assertEqual(resposta.status_code, 200)
+        atualizar.assert_not_called()
+
+    def test_jogador_inexistente(self):
+        resposta = self.definir({'jogadores': [self.jogadores[0].id, 998, 999]})
+        self.assertEqual(resposta.status_code, 404)
+        self.assertEqual(resposta.json()['jogadores'], [998, 999])
+        self.assertEqual(self.escalados(), {self.jogadores[0].id, self.jogadores[1].id})
+
+        self.assertEqual(self.definir({'jogadores': []}, confronto_id=999).status_code, 404)
+
+    def test_corpo_invalido(self):
+        for dados in ([self.jogadores[0].id], {'jogadores': 'todos'}, {'jogadores': [True]}, {}):
+            with self.subTest(dados=dados):
+                self.assertEqual(self.definir(dados).status_code, 400)
+        self.assertEqual(self.escalados(), {self.jogadores[0].id, self.jogadores[1].id})
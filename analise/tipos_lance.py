@@ -0,0 +1,79 @@
+from collections import defaultdict
+from analise import models
+from analise.cache_estatisticas import _incrementar_versao, _versao
+
+# Registro nome <-> id dos Tipo_Lance, carregado uma vez por processo.
+# As consultas de estatísticas filtram e agrupam direto por tipo_lance_id (sem join com Tipo_Lance)
+# e traduzem para os nomes aqui. A versão fica no cache compartilhado para que uma alteração
+# feita em um worker recarregue o registro em todos os outros.
+
+CHAVE_VERSAO = 'tipos_lance:versao'
+
+
+class TipoLanceInexistente(LookupError):
+    pass
+
+
+class RegistroTiposLance:
+
+    def __init__(self, tipos, versao):
+        self.versao = versao
+        self.nomes = dict(tipos)
+        self._ids_por_nome = defaultdict(list)
+        for tipo_lance_id, nome in tipos:
+            self._ids_por_nome[nome].append(tipo_lance_id)
+
+    def ids_do_tipo(self, nome, obrigatorio=True):
+        """
+        Retorna os ids dos tipos de lance com esse nome.
+        Falha se o tipo não existir, a não ser que obrigatorio=False (aí retorna lista vazia).
+        """
+        if nome not in self._ids_por_nome:
+            if not obrigatorio:
+                return []
+            raise TipoLanceInexistente(f"Tipo de lance '{nome}' não cadastrado.")
+        return self._ids_por_nome[nome]
+
+    def nome_do_tipo(self, tipo_lance_id):
+        return self.nomes.get(tipo_lance_id)
+
+
+_registro = None
+
+
+def registro():
+    """
+    Retorna o registro de tipos de lance, recarregando se algum Tipo_Lance mudou desde a última carga.
+    """
+    global _registro
+    versao = _versao(CHAVE_VERSAO)
+    if _registro is None or _registro.versao != versao:
+        _registro = RegistroTiposLance(list(models.Tipo_Lance.objects.values_list('id', 'tipo_lance')), versao)
+    return _registro
+
+
+def invalidar_registro():
+    global _registro
+    _registro = None
+    _incrementar_versao(CHAVE_VERSAO)
+
+
+class ContagemPorTipo:
+    """
+    Contagem de lances por tipo_lance_id, consultada pelo nome do tipo.
+    Pedir um nome que não existe em Tipo_Lance é erro, não zero.
+    """
+
+    def __init__(self, registro_tipos):
+        self.registro = registro_tipos
+        self.por_id = defaultdict(int)
+
+    def adicionar(self, tipo_lance_id, total):
+        self.por_id[tipo_lance_id] += total
+
+    def somar(self, outra):
+        for tipo_lance_id, total in outra.por_id.items():
+            self.por_id[tipo_lance_id] += total
+
+    def get(self, nome, padrao=0):
+        return sum(self.por_id.get(tipo_lance_id, 0) for tipo_lance_id in self.registro.ids_do_tipo(nome)) or padrao
@@ -99,6 +99,29 @@ DATABASES = {
 }
 
 
+# Cache
+# Em produção aponte REDIS_URL para um Redis compartilhado entre os workers;
+# sem ela cada processo usa o cache em memória local (desenvolvimento e testes).
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Tempo (em segundos) que uma resposta de estatísticas fica guardada; as versões
+# de confronto/campeonato já invalidam as respostas quando os dados mudam
+ESTATISTICAS_CACHE_TIMEOUT = 60 * 60 * 24
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -44,13 +44,20 @@ urlpatterns = [
     path('token/refresh/', TokenRefreshView.as_view()),
     path('escalacao/confronto/<int:confronto_id>/', analiseviewsets.EscalacaoConfrontoView.as_view(), name='escalacao_confronto'),
     path('em_campo/confronto/<int:confronto_id>/', analiseviewsets.EscalacaoConfrontoSemAdversarioView.as_view(), name='em_campo_confronto'),
+    path('linha_do_tempo/confronto/<int:confronto_id>/', analiseviewsets.LinhaDoTempoConfrontoView.as_view(), name='linha_do_tempo_confronto'),
     path('reservas/confronto/<int:confronto_id>/', analiseviewsets.JogadoresForaEscalacaoView.as_view(), name='reservas_confronto'),
     path('substituicao/confronto/<int:confronto_id>/', analiseviewsets.SubstituicaoConfrontoViewSet.as_view(), name='substituicao_confronto'),
     path('jogadores-nao-titulares/', analiseviewsets.JogadoresNaoTitularViewSet.as_view({'get': 'list'}), name='jogadores-nao-titulares'),
     path('remover_jogador/<int:confronto_id>/<int:jogador_id>/', analiseviewsets.remover_jogador, name='remover_jogador'),
     path('adicionar_jogador/<int:confronto_id>/<int:jogador_id>/', analiseviewsets.adicionar_jogador, name='adicionar_jogador'),
+    path('definir_escalacao/<int:confronto_id>/', analiseviewsets.definir_escalacao, name='definir_escalacao'),
     path('jogadores_disponiveis/<int:confronto_id>/', analiseviewsets.jogadores_disponiveis, name='jogadores_disponiveis'),
     path('confronto/<int:confronto_id>/jogadores/', analiseviewsets.jogadores_no_confronto),
     path('estatisticas-jogadores/', analiseviewsets.EstatisticasJogadoresView.as_view(), name='estatisticas-jogadores'),
+    path('estatisticas-jogadores/ranking/', analiseviewsets.RankingJogadoresView.as_view(), name='estatisticas-jogadores-ranking'),
+    path('estatisticas-jogadores/percentis/', analiseviewsets.PercentisJogadoresView.as_view(), name='estatisticas-jogadores-percentis'),
+    path('estatisticas-jogadores/forma/', analiseviewsets.FormaJogadoresView.as_view(), name='estatisticas-jogadores-forma'),
+    path('estatisticas-jogadores/semelhantes/', analiseviewsets.JogadoresSemelhantesView.as_view(), name='estatisticas-jogadores-semelhantes'),
     path('estatisticas_time/', analiseviewsets.EstatisticasTimeView.as_view(), name='estatisticas_time'),
+    path('estatisticas/cache/', analiseviewsets.EstatisticasCacheView.as_view(), name='estatisticas_cache'),
 ]
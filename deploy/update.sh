@@ -6,7 +6,12 @@ PROJECT_BASE_PATH='/usr/local/apps/data_analise'
 
 cd $PROJECT_BASE_PATH
 git pull
+# As estatísticas materializadas são mantidas pelos signals; só são reconstruídas quando a migration que cria a tabela é aplicada
+RECONSTRUIR=$($PROJECT_BASE_PATH/env/bin/python manage.py migrate --plan | grep -c 'analise.0006_estatisticajogadorconfronto' || true)
 $PROJECT_BASE_PATH/env/bin/python manage.py migrate
+if [ "$RECONSTRUIR" != "0" ]; then
+    $PROJECT_BASE_PATH/env/bin/python manage.py reconstruir_estatisticas
+fi
 $PROJECT_BASE_PATH/env/bin/python manage.py collectstatic --noinput
 supervisorctl restart data_analise
 